@@ -0,0 +1,16 @@
+""" Benchmarks for the coreference pipeline.
+
+The benchmarks run on synthetic Dutch documents and a tiny randomly
+initialized encoder, so they need neither data nor network access.
+
+  Usage example:
+
+  python -m bench.inference --lengths 100 1000 10000 --out before.json
+  python -m bench.inference --lengths 100 1000 10000 --out after.json
+  python -m bench.compare before.json after.json
+
+Training throughput is measured through run.py:
+
+  python run.py bench-train roberta bench --bench-tiny --bench-finetune both \
+      --bench-batch-sizes 128 512 2048
+"""
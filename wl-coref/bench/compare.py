@@ -0,0 +1,81 @@
+""" Compares two benchmark result files and reports regressions.
+
+Exits with status 1 if any measurement of the new results is slower than
+the baseline by more than the threshold.
+
+Try 'python -m bench.compare -h' for more details.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+
+def measurements(result: Dict[str, Any]) -> Iterator[Tuple[str, float, bool]]:
+    """ Yields (name, value, higher_is_better) for a single result entry """
+    for key, value in result.items():
+        if key.endswith("_per_s"):
+            yield key, value, True
+        elif key.endswith("_ms") and isinstance(value, dict):
+            if "mean" in value:
+                yield key, value["mean"], False
+            else:
+                for stage, stage_ms in value.items():
+                    yield f"{key}.{stage}", stage_ms, False
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    """ Identifies comparable entries of two result files """
+    return ", ".join(f"{key}={result[key]}" for key in sorted(result)
+                     if not isinstance(result[key], (dict, float, list)))
+
+
+def compare(baseline: Dict[str, Any],
+            new: Dict[str, Any],
+            threshold: float) -> bool:
+    """ Prints the comparison, returns True if there are regressions """
+    old_results = {result_key(result): result
+                   for result in baseline["results"]}
+    regressed = False
+    for new_result in new["results"]:
+        key = result_key(new_result)
+        if key not in old_results:
+            continue
+        print(key)
+        old_values = {name: value for name, value, _
+                      in measurements(old_results[key])}
+        for name, value, higher_is_better in measurements(new_result):
+            if name not in old_values or not old_values[name]:
+                continue
+            change = value / old_values[name] - 1
+            slower = -change if higher_is_better else change
+            mark = ""
+            if slower > threshold:
+                mark = "  REGRESSION"
+                regressed = True
+            print(f"  {name:32} {old_values[name]:>12.3f}"
+                  f" -> {value:>12.3f}  ({change:+.1%}){mark}")
+    return regressed
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Compare two benchmark result files")
+    argparser.add_argument("baseline")
+    argparser.add_argument("new")
+    argparser.add_argument("--threshold", type=float, default=0.1,
+                           help="Relative slowdown reported as a regression."
+                                " Defaults to 0.1 (10%%).")
+    args = argparser.parse_args()
+
+    with open(args.baseline, encoding="utf8") as f:
+        baseline_results = json.load(f)
+    with open(args.new, encoding="utf8") as f:
+        new_results = json.load(f)
+    for name, results in (("baseline", baseline_results),
+                          ("new", new_results)):
+        meta = results["meta"]
+        print(f"{name}: {meta.get('git_commit')} {meta.get('device')}"
+              f" torch {meta.get('torch')} ({meta.get('time')})")
+    sys.exit(int(compare(baseline_results, new_results, args.threshold)))
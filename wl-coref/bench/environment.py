@@ -0,0 +1,44 @@
+""" Collects metadata about the environment a benchmark was run in,
+so that results from different commits and machines can be compared. """
+
+from datetime import datetime
+import os
+import platform
+import subprocess
+import sys
+from typing import Any, Dict, Optional
+
+import numpy as np      # type: ignore
+import torch
+import transformers     # type: ignore
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=os.path.dirname(__file__), check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def collect(device: str) -> Dict[str, Any]:
+    """ Returns a json-serializable description of the environment """
+    meta: Dict[str, Any] = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "transformers": transformers.__version__,
+        "numpy": np.__version__,
+        "device": device,
+    }
+    if torch.device(device).type == "cuda":
+        meta["cuda"] = torch.version.cuda
+        meta["gpu"] = torch.cuda.get_device_name(torch.device(device))
+    return meta
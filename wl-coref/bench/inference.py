@@ -0,0 +1,199 @@
+""" Measures inference speed of the coreference pipeline on synthetic
+documents of different lengths.
+
+For every document length the following is reported: documents and words
+per second of CorefModel.run, mean latency of every stage of run() (see
+coref/timing.py), and the time spent in ClusterChecker and
+conll.write_conll per document. Tokenization is done before timing starts
+and the first document of every length is only used to warm up.
+
+Try 'python -m bench.inference -h' for more details.
+"""
+
+import argparse
+from contextlib import contextmanager
+import io
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List
+
+import numpy as np      # type: ignore
+import torch
+
+from bench import environment, synthetic, tiny_model
+from coref import CorefModel, checkpoint, conll
+from coref.cluster_checker import ClusterChecker
+
+
+@contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    """ Changes the working directory in the context. CorefModel writes the
+    tokenized documents cache to the current working directory. """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def latency_stats(seconds: List[float]) -> Dict[str, float]:
+    """ Returns mean, median and max of the measurements in milliseconds """
+    ms = np.array(seconds) * 1000
+    return {"mean": float(ms.mean()),
+            "p50": float(np.median(ms)),
+            "max": float(ms.max())}
+
+
+def stage_means(summary: Dict[str, Any]) -> Dict[str, float]:
+    """ Reduces a StageTimer summary to mean milliseconds per stage """
+    means = {}
+    for name, buckets in summary.items():
+        n_docs = sum(bucket["n_docs"] for bucket in buckets.values())
+        total = sum(bucket["total_s"] for bucket in buckets.values())
+        means[name] = total / n_docs * 1000
+    return means
+
+
+def bench_split(model: CorefModel, path: str) -> Dict[str, Any]:
+    """ Runs the model on all documents of a split, returns the results """
+    docs = model._get_docs(path)  # pylint: disable=protected-access
+    device_is_cuda = torch.device(model.config.device).type == "cuda"
+
+    def sync():
+        if device_is_cuda:
+            torch.cuda.synchronize()
+
+    run_s, checker_s, conll_s = [], [], []
+    n_pairs = []
+    checker = ClusterChecker()
+    conll_f = io.StringIO()
+    with torch.no_grad():
+        model.run(docs[0])
+        model.enable_timing()
+        for doc in docs[1:]:
+            sync()
+            start = time.perf_counter()
+            res = model.run(doc)
+            sync()
+            run_s.append(time.perf_counter() - start)
+            n_pairs.append(res.n_pairs)
+
+            start = time.perf_counter()
+            checker.add_predictions(doc["span_clusters"], res.span_clusters)
+            checker_s.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            conll.write_conll(doc, res.span_clusters, conll_f)
+            conll_s.append(time.perf_counter() - start)
+
+    n_words = [doc["tensors"].n_words for doc in docs[1:]]
+    n_subwords = [len(doc["subword_ids"]) for doc in docs[1:]]
+    total_s = sum(run_s)
+    return {
+        "n_docs": len(run_s),
+        "mean_words": float(np.mean(n_words)),
+        "mean_subwords": float(np.mean(n_subwords)),
+        "docs_per_s": len(run_s) / total_s,
+        "words_per_s": sum(n_words) / total_s,
+        "pairs_per_doc": float(np.mean(n_pairs)),
+        "run_ms": latency_stats(run_s),
+        "stages_ms": stage_means(model.timer.summary()),
+        "cluster_checker_ms": latency_stats(checker_s),
+        "write_conll_ms": latency_stats(conll_s),
+    }
+
+
+def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """ Runs the benchmark, returns the results """
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        templates = synthetic.load_templates()
+        bert_model = args.bert_model
+        if bert_model is None:
+            bert_model = os.path.join(workdir, "tiny_bert")
+            tiny_model.build_tiny_bert(bert_model,
+                                       synthetic.vocabulary(templates),
+                                       hidden_size=args.hidden_size,
+                                       n_layers=args.layers)
+
+        splits = {}
+        for length in args.lengths:
+            docs = synthetic.generate_docs(args.docs + 1, length, args.seed,
+                                           templates)
+            splits[length] = tiny_model.write_split(workdir,
+                                                    f"bench_{length}", docs)
+
+        config_path = tiny_model.write_config(
+            workdir, bert_model, args.device,
+            overrides={"bert_window_size": args.window_size,
+                       "rough_pruning": args.rough_pruning,
+                       "rough_pruning_threshold":
+                           args.rough_pruning_threshold})
+
+        with working_directory(workdir):
+            model = CorefModel(config_path, tiny_model.SECTION,
+                               build_optimizers=False)
+            if args.weights:
+                model.load_weights(path=args.weights, map_location="cpu",
+                                   ignore=checkpoint.TRAINING_STATE_KEYS)
+            model.training = False
+
+            results = []
+            for length, path in splits.items():
+                print(f"Benchmarking documents of {length} words...",
+                      flush=True)
+                result = bench_split(model, path)
+                result["n_words"] = length
+                results.append(result)
+                print(f"  {result['docs_per_s']:.2f} docs/s,"
+                      f" {result['words_per_s']:.0f} words/s", flush=True)
+
+    meta = environment.collect(args.device)
+    meta["args"] = vars(args)
+    return {"meta": meta, "results": results}
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Inference benchmark on synthetic documents")
+    argparser.add_argument("--lengths", type=int, nargs="+",
+                           default=[100, 300, 1000, 3000, 10000],
+                           help="Document lengths in words")
+    argparser.add_argument("--docs", type=int, default=3,
+                           help="Documents per length (plus one for warm-up)")
+    argparser.add_argument("--device", default="cpu")
+    argparser.add_argument("--bert-model",
+                           help="Path or name of an encoder to use instead"
+                                " of a tiny random one")
+    argparser.add_argument("--weights",
+                           help="Path to CorefModel weights to load. If not"
+                                " supplied, random weights are used.")
+    argparser.add_argument("--hidden-size", type=int, default=128,
+                           help="Hidden size of the tiny encoder")
+    argparser.add_argument("--layers", type=int, default=2,
+                           help="Number of layers of the tiny encoder")
+    argparser.add_argument("--window-size", type=int, default=512,
+                           help="Overrides bert_window_size")
+    argparser.add_argument("--rough-pruning", default="fixed",
+                           choices=("fixed", "cumulative", "margin"),
+                           help="Overrides rough_pruning")
+    argparser.add_argument("--rough-pruning-threshold", type=float,
+                           default=0.99,
+                           help="Overrides rough_pruning_threshold")
+    argparser.add_argument("--threads", type=int,
+                           help="Number of torch threads")
+    argparser.add_argument("--seed", type=int, default=2020)
+    argparser.add_argument("--out", default="bench_inference.json",
+                           help="Where to write the results")
+    arguments = argparser.parse_args()
+
+    output = main(arguments)
+    with open(arguments.out, mode="w", encoding="utf8") as out_f:
+        json.dump(output, out_f, indent=2)
+    print(f"Results written to {arguments.out}")
@@ -0,0 +1,104 @@
+""" Generates synthetic Dutch documents of controlled length.
+
+The sentences are taken from the templates of the pronoun test suite
+(Test suite/suite.txt). In every template, the name that starts it and the
+third person pronouns that follow are put into one cluster.
+"""
+
+import os
+import random
+from typing import Any, Dict, List
+
+from coref.const import Doc
+
+
+SUITE_PATH = os.path.join(os.path.dirname(__file__),
+                          "..", "..", "Test suite", "suite.txt")
+
+# Used if the test suite is not available
+FALLBACK_TEMPLATES = [
+    "Sam gaat naar zijn dokter.",
+    "Alex gaat naar haar interview.",
+    "Robin heeft diens afspraak bij de gemeente om 3 uur. die gaat zo heen.",
+    "Charly gaat met het hockeyteam op vakantie. hen is al vaker met hen weggeweest.",
+]
+
+PRONOUNS = {"hij", "hem", "zijn", "zij", "ze", "haar", "hen", "hun",
+            "die", "diens"}
+
+
+def load_templates(path: str = SUITE_PATH) -> List[str]:
+    """ Returns template sentences, one per line of the test suite """
+    if not os.path.exists(path):
+        return list(FALLBACK_TEMPLATES)
+    with open(path, mode="r", encoding="utf8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def split_words(template: str) -> List[str]:
+    """ Splits a template into words, separating the full stops """
+    return template.replace(".", " . ").split()
+
+
+def generate_doc(n_words: int,
+                 templates: List[str],
+                 rng: random.Random,
+                 document_id: str = "synthetic") -> Doc:
+    """ Returns a document of at least n_words words (the last template is
+    not cut) in the same format as the jsonlines files used for training. """
+    doc: Dict[str, Any] = {
+        "document_id": document_id,
+        "part_id": 0,
+        "cased_words": [],
+        "sent_id": [],
+        "speaker": [],
+        "pos": [],
+        "postag": [],
+        "deprel": [],
+        "head": [],
+    }
+    clusters: List[List[int]] = []
+    sent_id = 0
+    while len(doc["cased_words"]) < n_words:
+        words = split_words(rng.choice(templates))
+        cluster = [len(doc["cased_words"])]
+        for i, word in enumerate(words):
+            if i and word.lower() in PRONOUNS:
+                cluster.append(len(doc["cased_words"]))
+            doc["cased_words"].append(word)
+            doc["sent_id"].append(sent_id)
+            doc["speaker"].append("_")
+            doc["pos"].append("PRON" if word.lower() in PRONOUNS else "X")
+            doc["postag"].append("_")
+            doc["deprel"].append("_")
+            doc["head"].append(None)
+            if word == ".":
+                sent_id += 1
+        if words[-1] != ".":
+            sent_id += 1
+        if len(cluster) > 1:
+            clusters.append(cluster)
+
+    doc["word_clusters"] = clusters
+    doc["span_clusters"] = [[(i, i + 1) for i in cluster]
+                            for cluster in clusters]
+    doc["head2span"] = [(i, i, i + 1) for cluster in clusters
+                        for i in cluster]
+    return doc
+
+
+def generate_docs(n_docs: int,
+                  n_words: int,
+                  seed: int = 2020,
+                  templates: List[str] = None) -> List[Doc]:
+    """ Returns n_docs synthetic documents of about n_words words each """
+    rng = random.Random(seed * 100003 + n_words)
+    templates = templates or load_templates()
+    return [generate_doc(n_words, templates, rng, f"synthetic_{n_words}_{i}")
+            for i in range(n_docs)]
+
+
+def vocabulary(templates: List[str]) -> List[str]:
+    """ Returns all the distinct words of the templates """
+    return sorted({word for template in templates
+                   for word in split_words(template)})
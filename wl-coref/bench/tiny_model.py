@@ -0,0 +1,88 @@
+""" Sets up a self-contained working directory for benchmarks: a tiny
+randomly initialized BERT encoder with a word-level tokenizer, synthetic
+data splits and a config file derived from the repository's config.toml.
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import jsonlines        # type: ignore
+import toml
+from transformers import BertConfig, BertModel, BertTokenizer  # type: ignore
+
+from coref.const import Doc
+
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config.toml")
+SECTION = "bench"
+
+
+def build_tiny_bert(path: str,
+                    words: List[str],
+                    hidden_size: int = 128,
+                    n_layers: int = 2,
+                    n_heads: int = 2,
+                    max_length: int = 512):
+    """ Saves a randomly initialized BERT model and a tokenizer whose
+    vocabulary consists of the words given to path """
+    os.makedirs(path, exist_ok=True)
+    vocab_path = os.path.join(path, "vocab.txt")
+    with open(vocab_path, mode="w", encoding="utf8") as f:
+        for token in ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words:
+            f.write(f"{token}\n")
+    tokenizer = BertTokenizer(vocab_path, do_lower_case=False)
+    tokenizer.save_pretrained(path)
+
+    config = BertConfig(vocab_size=len(tokenizer),
+                        hidden_size=hidden_size,
+                        num_hidden_layers=n_layers,
+                        num_attention_heads=n_heads,
+                        intermediate_size=hidden_size * 4,
+                        max_position_embeddings=max_length,
+                        return_dict=False)
+    BertModel(config).save_pretrained(path)
+
+
+def write_split(workdir: str, name: str, docs: List[Doc]) -> str:
+    """ Writes docs to workdir/name.jsonlines, returns the filename """
+    filename = f"{name}.jsonlines"
+    with jsonlines.open(os.path.join(workdir, filename), mode="w") as f:
+        f.write_all(docs)
+    return filename
+
+
+def write_config(workdir: str,
+                 bert_model: Optional[str],
+                 device: Optional[str],
+                 overrides: Optional[Dict[str, Any]] = None,
+                 train_data: str = "bench_train.jsonlines",
+                 dev_data: str = "bench_dev.jsonlines",
+                 test_data: str = "bench_test.jsonlines",
+                 config_path: str = CONFIG_PATH,
+                 base_section: Optional[str] = None) -> str:
+    """ Writes a config file with a single section (SECTION) to workdir,
+    based on the DEFAULT section of config_path merged with base_section.
+    All the data and log directories point to workdir. If bert_model or
+    device are None, the values of the base config are kept.
+    Returns the path to the config file. """
+    config = toml.load(config_path)
+    default = config["DEFAULT"]
+    if base_section is not None:
+        default.update(config[base_section])
+    default.update({
+        "data_dir": workdir,
+        "model_dir": os.path.join(workdir, "model_checkpoints"),
+        "logs_dir": os.path.join(workdir, "train_logs"),
+        "conll_log_dir": os.path.join(workdir, "conll_logs"),
+        "train_data": train_data,
+        "dev_data": dev_data,
+        "test_data": test_data,
+    })
+    if bert_model is not None:
+        default["bert_model"] = bert_model
+    if device is not None:
+        default["device"] = device
+    path = os.path.join(workdir, "config.toml")
+    with open(path, mode="w", encoding="utf8") as f:
+        toml.dump({"DEFAULT": default, SECTION: overrides or {}}, f)
+    return path
@@ -0,0 +1,200 @@
+""" Measures training throughput of CorefModel, see 'run.py bench-train'.
+
+For every combination of bert_finetune, bert_embedding_updates, optimizer
+and a_scoring_batch_size settings a fresh model is built and trained for a
+fixed number of optimizer steps on synthetic documents (or on the documents
+of a jsonlines file, e.g. a fixed subset of SoNaR). The steps per second,
+subwords per second, the split of the step time between the forward pass,
+the backward pass and the optimizer, peak memory, the size of the optimizer
+state and the losses of every step are reported, the latter to compare the
+convergence of the optimizers. The output has the same format as
+bench.inference, so the results can be compared with bench.compare.
+"""
+
+import gc
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np      # type: ignore
+import torch
+
+from bench import environment, synthetic, tiny_model
+from bench.inference import latency_stats, working_directory
+from coref import CorefModel
+
+
+TRAIN_FILE = "bench_train.jsonlines"
+
+
+def bench_setting(config_path: str, steps: int, warmup: int) -> Dict[str, Any]:
+    """ Trains a freshly built model for warmup + steps steps, measuring
+    the last steps """
+    model = CorefModel(config_path, tiny_model.SECTION)
+    docs = model._get_docs(TRAIN_FILE)  # pylint: disable=protected-access
+    avg_spans = sum(len(doc["head2span"]) for doc in docs) / len(docs)
+    cuda = torch.device(model.config.device).type == "cuda"
+
+    model.training = True
+    for i in range(warmup):
+        model.train_step(docs[i % len(docs)], avg_spans)
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats(model.config.device)
+
+    phase_times: Dict[str, float] = {}
+    step_s: List[float] = []
+    losses: List[float] = []
+    n_subwords = 0
+    for i in range(warmup, warmup + steps):
+        doc = docs[i % len(docs)]
+        start = time.perf_counter()
+        c_loss, s_loss = model.train_step(doc, avg_spans, phase_times)
+        step_s.append(time.perf_counter() - start)
+        losses.append(c_loss + s_loss)
+        n_subwords += len(doc["subword_ids"])
+
+    total_s = sum(step_s)
+    memory = model.memory.summary()
+    result = {
+        "steps_per_s": steps / total_s,
+        "subwords_per_s": n_subwords / total_s,
+        "step_ms": latency_stats(step_s),
+        "phase_ms": {name: seconds / steps * 1000
+                     for name, seconds in phase_times.items()},
+        "phase_share": {name: seconds / total_s
+                        for name, seconds in phase_times.items()},
+        "max_rss_mb": max(bucket["max_rss_mb"]
+                          for bucket in memory["by_length"].values()),
+        "optimizer_state_mb": sum(
+            value.element_size() * value.nelement()
+            for optim in model.optimizers.values()
+            for state in optim.state.values()
+            for value in state.values() if torch.is_tensor(value)) / 2 ** 20,
+        "losses": losses,
+    }
+    if cuda:
+        result["cuda_peak_mb"] = \
+            torch.cuda.max_memory_allocated(model.config.device) / 2 ** 20
+
+    del model
+    gc.collect()
+    if cuda:
+        torch.cuda.empty_cache()
+    return result
+
+
+def bench_train(config_file: str,
+                section: str,
+                steps: int = 20,
+                warmup: int = 2,
+                finetune: Optional[List[bool]] = None,
+                batch_sizes: Optional[List[int]] = None,
+                embedding_updates: Optional[List[str]] = None,
+                optimizers: Optional[List[str]] = None,
+                data: Optional[str] = None,
+                n_docs: int = 8,
+                n_words: int = 500,
+                tiny: bool = False,
+                seed: int = 2020) -> Dict[str, Any]:
+    """
+    Runs the training benchmark.
+
+    Args:
+        config_file (str): the config file to take the settings from
+        section (str): the section of the config file to use
+        steps (int): the number of measured optimizer steps
+        warmup (int): the number of steps done before measuring
+        finetune (List[bool]): bert_finetune values to try,
+            defaults to the config value
+        batch_sizes (List[int]): a_scoring_batch_size values to try,
+            defaults to the config value
+        embedding_updates (List[str]): bert_embedding_updates values to try,
+            defaults to the config value
+        optimizers (List[str]): optimizers to try as both bert_optimizer
+            and general_optimizer, defaults to the config values
+        data (str): a jsonlines file with the documents to train on.
+            If not supplied, n_docs synthetic documents of n_words are used
+        tiny (bool): if True, a tiny random encoder replaces bert_model
+        seed (int): the random seed, set before building every model
+
+    Returns:
+        benchmark results with environment metadata
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        bert_model = None
+        templates = synthetic.load_templates()
+        if data is None:
+            tiny_model.write_split(
+                workdir, os.path.splitext(TRAIN_FILE)[0],
+                synthetic.generate_docs(n_docs, n_words, seed, templates))
+        else:
+            shutil.copy(data, os.path.join(workdir, TRAIN_FILE))
+        if tiny:
+            bert_model = os.path.join(workdir, "tiny_bert")
+            tiny_model.build_tiny_bert(bert_model,
+                                       synthetic.vocabulary(templates))
+
+        base_config = CorefModel._load_config(  # pylint: disable=protected-access
+            config_file, section)
+        finetune = finetune or [base_config.bert_finetune]
+        batch_sizes = batch_sizes or [base_config.a_scoring_batch_size]
+        embedding_updates = \
+            embedding_updates or [base_config.bert_embedding_updates]
+
+        optimizer_settings = [{"bert_optimizer": name,
+                               "general_optimizer": name}
+                              for name in optimizers or []] \
+            or [{"bert_optimizer": base_config.bert_optimizer,
+                 "general_optimizer": base_config.general_optimizer}]
+
+        results = []
+        for bert_finetune, updates, optimizer, batch_size in itertools.product(
+                finetune, embedding_updates, optimizer_settings, batch_sizes):
+            if not bert_finetune and updates != embedding_updates[0]:
+                continue    # the embeddings are not trained anyway
+            print(f"bert_finetune={bert_finetune},"
+                  f" bert_embedding_updates={updates},"
+                  f" bert_optimizer={optimizer['bert_optimizer']},"
+                  f" general_optimizer={optimizer['general_optimizer']},"
+                  f" a_scoring_batch_size={batch_size}...", flush=True)
+            config_path = tiny_model.write_config(
+                workdir, bert_model, None,
+                overrides={"bert_finetune": bert_finetune,
+                           "bert_embedding_updates": updates,
+                           "a_scoring_batch_size": batch_size,
+                           **optimizer},
+                train_data=TRAIN_FILE, dev_data=TRAIN_FILE,
+                test_data=TRAIN_FILE,
+                config_path=config_file, base_section=section)
+
+            random.seed(seed)
+            np.random.seed(seed)
+            torch.manual_seed(seed)
+            with working_directory(workdir):
+                result = bench_setting(config_path, steps, warmup)
+            result.update({"bert_finetune": bert_finetune,
+                           "bert_embedding_updates": updates,
+                           **optimizer,
+                           "a_scoring_batch_size": batch_size,
+                           "steps": steps})
+            results.append(result)
+            print(f"  {result['steps_per_s']:.3f} steps/s,"
+                  f" {result['subwords_per_s']:.0f} subwords/s,"
+                  f" optimizer state {result['optimizer_state_mb']:.1f} MB,"
+                  f" loss {result['losses'][0]:.3f} ->"
+                  f" {result['losses'][-1]:.3f},"
+                  f" phases (ms): " + ", ".join(
+                      f"{name} {ms:.1f}"
+                      for name, ms in result["phase_ms"].items()),
+                  flush=True)
+
+    meta = environment.collect(base_config.device)
+    meta.update({"config_file": config_file, "section": section,
+                 "data": data or f"synthetic {n_docs}x{n_words} words",
+                 "tiny": tiny, "seed": seed, "warmup": warmup})
+    return {"meta": meta, "results": results}
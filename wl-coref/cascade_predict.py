@@ -0,0 +1,140 @@
+""" Predicts with a cascade of a fast and a full model, see coref/cascade.py.
+
+With --input and --output, documents are annotated as by predict.py and the
+escalation rate and throughput are printed. Without them, the cascade is
+evaluated on a data split of the full model's config for every threshold
+given, to choose one: a threshold of 0 never escalates (the fast model
+alone) and "inf" always does (the full model alone).
+
+  Usage example:
+
+  python cascade_predict.py xlm-roberta-slim xlm-roberta \\
+      --fast-weights data/model_checkpoints/slim/xlm-roberta-slim_e20.pt \\
+      --full-weights data/model_checkpoints/regular/xlm-roberta_e20.pt \\
+      --thresholds 0 1 2 4 inf --out cascade.json
+
+  python cascade_predict.py xlm-roberta-slim xlm-roberta \\
+      --fast-weights ... --full-weights ... --thresholds 2 --level mention \\
+      --input data/production.jsonlines --output annotated.jsonlines
+"""
+
+import argparse
+import copy
+import json
+
+import jsonlines
+import torch
+from tqdm import tqdm
+
+from coref import CorefModel, checkpoint
+from coref.cascade import LEVELS, Cascade
+from coref.cluster_checker import ClusterChecker
+from predict import build_doc
+
+
+def load_model(config_file: str, experiment: str, weights: str,
+               device: str) -> CorefModel:
+    """ Loads a model for inference """
+    overrides = {"device": device} if device else {}
+    model = CorefModel(config_file, experiment, build_optimizers=False,
+                       config_overrides=overrides)
+    model.load_weights(weights, map_location=model.config.device,
+                       ignore=checkpoint.TRAINING_STATE_KEYS)
+    model.training = False
+    return model
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("fast_experiment")
+    argparser.add_argument("full_experiment")
+    argparser.add_argument("--fast-weights", required=True)
+    argparser.add_argument("--full-weights", required=True)
+    argparser.add_argument("--config-file", default="config.toml")
+    argparser.add_argument("--thresholds", type=float, nargs="+",
+                           default=[1.0],
+                           help="Margins under which words are escalated to"
+                                " the full model; only the first is used"
+                                " with --input")
+    argparser.add_argument("--level", choices=LEVELS, default="doc")
+    argparser.add_argument("--max-uncertain", type=float, default=0.0,
+                           help="Share of uncertain words a document can"
+                                " have without being escalated (level doc)")
+    argparser.add_argument("--input", help="jsonlines file to annotate")
+    argparser.add_argument("--output", help="Where to write the annotations")
+    argparser.add_argument("--data-split", choices=("dev", "test"),
+                           default="dev")
+    argparser.add_argument("--device",
+                           help="Overrides the device of both configs")
+    argparser.add_argument("--out", default="cascade.json",
+                           help="Where to write the evaluation results")
+    args = argparser.parse_args()
+    if (args.input is None) != (args.output is None):
+        argparser.error("--input and --output go together")
+
+    fast = load_model(args.config_file, args.fast_experiment,
+                      args.fast_weights, args.device)
+    full = load_model(args.config_file, args.full_experiment,
+                      args.full_weights, args.device)
+
+    if args.input:
+        cascade = Cascade(fast, full, args.thresholds[0], args.level,
+                          args.max_uncertain)
+        with jsonlines.open(args.input, mode="r") as input_data:
+            raw_docs = list(input_data)
+        docs = [build_doc(copy.deepcopy(doc), fast) for doc in raw_docs]
+        full_docs = (docs if cascade.shares_tokenization else
+                     [build_doc(doc, full) for doc in raw_docs])
+
+        with torch.no_grad():
+            for doc, full_doc in tqdm(zip(docs, full_docs), total=len(docs),
+                                      unit="docs"):
+                result = cascade.run(doc, full_doc)
+                doc["span_clusters"] = result.span_clusters
+                doc["word_clusters"] = result.word_clusters
+
+                for key in ("word2subword", "subwords", "subword_ids",
+                            "word_id", "head2span", "tensors"):
+                    del doc[key]
+
+        with jsonlines.open(args.output, mode="w") as output_data:
+            output_data.write_all(docs)
+        print(json.dumps(cascade.stats(), indent=2))
+
+    else:
+        path = getattr(full.config, f"{args.data_split}_data")
+        # pylint: disable=protected-access
+        docs = fast._get_docs(path)
+        results = []
+        for threshold in args.thresholds:
+            cascade = Cascade(fast, full, threshold, args.level,
+                              args.max_uncertain)
+            full_docs = docs if cascade.shares_tokenization \
+                else full._get_docs(path)
+            w_checker, s_checker = ClusterChecker(), ClusterChecker()
+            with torch.no_grad():
+                for doc, full_doc in zip(docs, full_docs):
+                    res = cascade.run(doc, full_doc)
+                    w_checker.add_predictions(doc["word_clusters"],
+                                              res.word_clusters)
+                    s_checker.add_predictions(doc["span_clusters"],
+                                              res.span_clusters)
+            results.append({"threshold": threshold,
+                            "wl_f1": w_checker.total_lea[0],
+                            "sl_f1": s_checker.total_lea[0],
+                            **cascade.stats()})
+
+        print(f"\n{'threshold':>9} {'docs esc.':>9} {'words unc.':>10}"
+              f" {'words/s':>9} {'wl_f1':>7} {'sl_f1':>7}")
+        for result in results:
+            print(f"{result['threshold']:>9} "
+                  f"{result['doc_escalation_rate']:>9.3f}"
+                  f" {result['word_uncertain_rate']:>10.3f}"
+                  f" {result['words_per_s']:>9.0f}"
+                  f" {result['wl_f1']:>7.4f} {result['sl_f1']:>7.4f}")
+        with open(args.out, mode="w", encoding="utf8") as f:
+            json.dump({"fast_weights": args.fast_weights,
+                       "full_weights": args.full_weights,
+                       "level": args.level, "data_split": args.data_split,
+                       "results": results}, f, indent=2)
+        print(f"Results written to {args.out}")
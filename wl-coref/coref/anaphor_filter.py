@@ -0,0 +1,63 @@
+""" Describes the anaphor pre-filter, which restricts antecedent scoring to
+words that can plausibly be mentions.
+
+Words that are not candidates (punctuation, verbs, most function words) are
+neither scored as anaphors nor considered as antecedents, and always get the
+dummy antecedent. Candidates are chosen by anaphor_filter:
+    "pos"       words whose part of speech is in anaphor_filter_pos, using
+                the universal "pos" of the document or, if it is not
+                annotated, the coarse part of the CGN "postag" (e.g. "VNW"
+                for "VNW|pers|pron|..."). Words tagged "X" and documents
+                without annotation keep all words.
+    "learned"   words scored above anaphor_filter_threshold by AnaphorFilter,
+                a linear head on the word embeddings trained to recognize
+                the words of gold clusters. The filter is applied outside of
+                training only.
+"""
+
+import re
+from typing import Collection, Optional
+
+import numpy as np      # type: ignore
+import torch
+
+from coref.config import Config
+from coref.const import Doc
+
+
+def pos_candidates(doc: Doc, tags: Collection[str]) -> Optional[np.ndarray]:
+    """ Returns the sorted ids of the words whose part of speech is in tags,
+    or None if the document has no part of speech annotation """
+    for field in ("pos", "postag"):
+        doc_tags = doc.get(field)
+        if doc_tags and any(tag != "X" for tag in doc_tags):
+            break
+    else:
+        return None
+    return np.array([i for i, tag in enumerate(doc_tags)
+                     if tag == "X" or re.split(r"[|(]", tag, 1)[0] in tags],
+                    dtype=np.int64)
+
+
+class AnaphorFilter(torch.nn.Module):
+    """ Scores how likely every word is to be part of a coreference
+    cluster """
+    def __init__(self, features: int, config: Config):
+        super().__init__()
+        self.linear = torch.nn.Linear(features, 1)
+        self.threshold = config.anaphor_filter_threshold
+
+    def forward(self,  # type: ignore  # pylint: disable=arguments-differ  #35566 in pytorch
+                words: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            words (torch.Tensor): [n_words, emb_size]
+
+        Returns:
+            torch.Tensor [n_words], logits of the words being mentions
+        """
+        return self.linear(words).squeeze(1)
+
+    def candidates(self, logits: torch.Tensor) -> torch.Tensor:
+        """ Returns the sorted ids of the words scored above the threshold """
+        return (torch.sigmoid(logits) > self.threshold).nonzero()[:, 0]
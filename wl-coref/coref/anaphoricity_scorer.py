@@ -1,6 +1,8 @@
 """ Describes AnaphicityScorer, a torch module that for a matrix of
 mentions produces their anaphoricity scores.
 """
+from typing import Optional
+
 import torch
 
 from coref import utils
@@ -13,6 +15,7 @@ class AnaphoricityScorer(torch.nn.Module):
                  in_features: int,
                  config: Config):
         super().__init__()
+        self.in_features = in_features
         hidden_size = config.hidden_size
         if not config.n_hidden_layers:
             hidden_size = in_features
@@ -31,6 +34,7 @@ class AnaphoricityScorer(torch.nn.Module):
                 pw_batch: torch.Tensor,
                 top_indices_batch: torch.Tensor,
                 top_rough_scores_batch: torch.Tensor,
+                pair_mask_batch: Optional[torch.Tensor] = None,
                 ) -> torch.Tensor:
         """ Builds a pairwise matrix, scores the pairs and returns the scores.
 
@@ -40,11 +44,20 @@ class AnaphoricityScorer(torch.nn.Module):
             pw_batch (torch.Tensor): [batch_size, n_ants, pw_emb]
             top_indices_batch (torch.Tensor): [batch_size, n_ants]
             top_rough_scores_batch (torch.Tensor): [batch_size, n_ants]
+            pair_mask_batch (torch.Tensor): [batch_size, n_ants], if given,
+                only these pairs are built and scored (packed into one
+                matrix), the others get -inf
 
         Returns:
             torch.Tensor [batch_size, n_ants + 1]
                 anaphoricity scores for the pairs + a dummy column
         """
+        if pair_mask_batch is not None:
+            return self._packed_forward(all_mentions, mentions_batch,
+                                        pw_batch, top_indices_batch,
+                                        top_rough_scores_batch,
+                                        pair_mask_batch)
+
         # [batch_size, n_ants, pair_emb]
         pair_matrix = self._get_pair_matrix(
             all_mentions, mentions_batch, pw_batch, top_indices_batch)
@@ -55,6 +68,26 @@ class AnaphoricityScorer(torch.nn.Module):
 
         return scores
 
+    def _packed_forward(self,
+                        all_mentions: torch.Tensor,
+                        mentions_batch: torch.Tensor,
+                        pw_batch: torch.Tensor,
+                        top_indices_batch: torch.Tensor,
+                        top_rough_scores_batch: torch.Tensor,
+                        pair_mask_batch: torch.Tensor) -> torch.Tensor:
+        """ Same as forward, but only scores the pairs of pair_mask_batch """
+        rows, cols = pair_mask_batch.nonzero(as_tuple=True)
+        a_mentions = mentions_batch[rows]
+        b_mentions = all_mentions[top_indices_batch[rows, cols]]
+
+        # [n_pairs, pair_emb]
+        pairs = torch.cat((a_mentions, b_mentions, a_mentions * b_mentions,
+                           pw_batch[rows, cols]), dim=1)
+        scores = torch.full_like(top_rough_scores_batch, float("-inf"))
+        scores[rows, cols] = top_rough_scores_batch[rows, cols] \
+            + self.out(self.hidden(pairs)).squeeze(1)
+        return utils.add_dummy(scores, eps=True)
+
     def _ffnn(self, x: torch.Tensor) -> torch.Tensor:
         """
         Calculates anaphoricity scores.
@@ -0,0 +1,185 @@
+""" Contains helpers for approximate evaluation on a subsample of a split.
+
+Documents are stratified by length (power of two buckets) and by whether
+their share of pronouns is above the median of the split. stratified_sample()
+draws the same fraction of documents from every stratum, and summarize()
+estimates the scores of the whole split from the sampled documents together
+with stratified bootstrap confidence intervals.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+import random
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np      # type: ignore
+
+from coref.const import EPSILON, Doc
+from coref.pronouns import PRONOUNS, third_person_pronouns
+from coref.timing import length_bucket
+
+
+@dataclass
+class Sample:
+    """ A stratified sample of documents of a data split.
+
+    Attributes:
+        indices: indices of the sampled documents in the split
+        strata: stratum of every sampled document
+        weights: number of documents of the split each sampled document
+            stands for
+    """
+    indices: List[int]
+    strata: List[str]
+    weights: np.ndarray
+
+
+def pronoun_ratio(doc: Doc) -> float:
+    """ Returns the share of pronouns among the words of the document """
+    words = doc["cased_words"]
+    pos = doc.get("pos")
+    if pos and any(tag != "X" for tag in pos):
+        n_pronouns = sum(tag == "PRON" for tag in pos)
+    else:
+        n_pronouns = sum(word.lower() in PRONOUNS for word in words)
+    return n_pronouns / max(len(words), 1)
+
+
+def pronoun_counts(doc: Doc, word_clusters: List[List[int]]
+                   ) -> Tuple[int, int]:
+    """ Counts the third person pronouns of the gold clusters whose
+    predicted cluster contains one of their gold antecedents, as the
+    pronoun score of full_evaluation.py does on word level. The pronouns
+    are selected by coref.pronouns.third_person_pronouns.
+
+    Returns:
+        the number of correctly resolved pronouns and of pronouns
+    """
+    predicted = {word: cluster for cluster in word_clusters
+                 for word in cluster}
+    return _count_resolved(doc, lambda word: predicted.get(word, ()))
+
+
+def chain_pronoun_counts(doc: Doc, chains: Dict[int, List[int]]
+                         ) -> Tuple[int, int]:
+    """ Same as pronoun_counts, with the antecedent chains of the pronouns
+    given by CorefModel.resolve (for the words of third_person_pronouns)
+    instead of clusters. A chain lacks the earlier words that only join the
+    cluster through later ones, so the count can be lower than with the
+    clusters of CorefModel.run. """
+    return _count_resolved(doc, lambda word: chains.get(word, ()))
+
+
+def _count_resolved(doc: Doc,
+                    predicted: Callable[[int], Sequence[int]]
+                    ) -> Tuple[int, int]:
+    """ Counts the pronouns of the gold clusters for which predicted gives
+    an earlier word of their gold cluster, and all those pronouns """
+    pronouns = set(third_person_pronouns(doc))
+    correct = total = 0
+    for gold_cluster in doc["word_clusters"]:
+        for word in gold_cluster:
+            if word not in pronouns:
+                continue
+            total += 1
+            correct += any(antecedent < word and antecedent in gold_cluster
+                           for antecedent in predicted(word))
+    return correct, total
+
+
+def stratify(docs: Sequence[Doc]) -> List[str]:
+    """ Returns the stratum of each document: its length bucket and whether
+    its share of pronouns is above the median of the documents """
+    ratios = [pronoun_ratio(doc) for doc in docs]
+    median = float(np.median(ratios)) if ratios else 0.0
+    return [f"{length_bucket(len(doc['cased_words']))}"
+            f"/{'high' if ratio > median else 'low'}_pron"
+            for doc, ratio in zip(docs, ratios)]
+
+
+def stratified_sample(docs: Sequence[Doc],
+                      fraction: float,
+                      seed: int = 0) -> Sample:
+    """ Samples the fraction of documents from every stratum, at least one
+    document per stratum. The same seed gives the same sample. """
+    by_stratum: Dict[str, List[int]] = defaultdict(list)
+    for i, stratum in enumerate(stratify(docs)):
+        by_stratum[stratum].append(i)
+
+    rng = random.Random(seed)
+    indices: List[int] = []
+    strata: List[str] = []
+    weights: List[float] = []
+    for stratum, members in sorted(by_stratum.items()):
+        n_sampled = min(len(members), max(1, round(fraction * len(members))))
+        sampled = sorted(rng.sample(members, n_sampled))
+        indices.extend(sampled)
+        strata.extend([stratum] * n_sampled)
+        weights.extend([len(members) / n_sampled] * n_sampled)
+    return Sample(indices, strata, np.array(weights))
+
+
+def summarize(sample: Sample,
+              w_counts: List[Tuple[float, float, float, float]],
+              s_counts: List[Tuple[float, float, float, float]],
+              span_counts: List[Tuple[int, int]],
+              n_resamples: int,
+              confidence: float,
+              seed: int = 0) -> Dict[str, object]:
+    """
+    Estimates the scores of the whole split from the sampled documents.
+
+    Args:
+        sample (Sample): the sample evaluated
+        w_counts, s_counts: per-document (precision, precision weight,
+            recall, recall weight) LEA sums for word- and span-level clusters,
+            as collected by ClusterChecker
+        span_counts: per-document (correct, total) span predictions
+        n_resamples (int): number of bootstrap resamples
+        confidence (float): the coverage of the intervals, e.g. 0.95
+        seed (int): the seed of the bootstrap
+
+    Returns:
+        a dict with the estimates of wl_f1, wl_p, wl_r, sl_f1, sl_p, sl_r,
+        sl_sa and [low, high] intervals for wl_f1, sl_f1 and sl_sa
+    """
+    # [n_docs, 10]: word LEA counts, span LEA counts, span accuracy counts
+    counts = np.concatenate([np.array(w_counts, dtype=float),
+                             np.array(s_counts, dtype=float),
+                             np.array(span_counts, dtype=float)], axis=1)
+    weighted = counts * sample.weights[:, None]
+
+    estimates = _scores(weighted.sum(axis=0, keepdims=True))
+    summary: Dict[str, object] = {key: float(value[0])
+                                  for key, value in estimates.items()}
+
+    rng = np.random.default_rng(seed)
+    strata = np.array(sample.strata)
+    resampled = np.zeros((n_resamples, counts.shape[1]))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        picks = rng.choice(members, size=(n_resamples, len(members)))
+        resampled += weighted[picks].sum(axis=1)
+    bootstrap = _scores(resampled)
+
+    alpha = (1 - confidence) / 2
+    for key in ("wl_f1", "sl_f1", "sl_sa"):
+        low, high = np.quantile(bootstrap[key], [alpha, 1 - alpha])
+        summary[f"{key}_ci"] = [float(low), float(high)]
+    summary["approx"] = True
+    summary["n_docs"] = len(sample.indices)
+    return summary
+
+
+def _scores(totals: np.ndarray) -> Dict[str, np.ndarray]:
+    """ Computes the scores from [n, 10] summed counts """
+    scores = {}
+    for prefix, offset in (("wl", 0), ("sl", 4)):
+        precision = totals[:, offset] / (totals[:, offset + 1] + EPSILON)
+        recall = totals[:, offset + 2] / (totals[:, offset + 3] + EPSILON)
+        scores[f"{prefix}_f1"] = \
+            precision * recall / (precision + recall + EPSILON) * 2
+        scores[f"{prefix}_p"] = precision
+        scores[f"{prefix}_r"] = recall
+    scores["sl_sa"] = totals[:, 8] / (totals[:, 9] + EPSILON)
+    return scores
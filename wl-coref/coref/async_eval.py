@@ -0,0 +1,160 @@
+""" Describes DevEvaluator, which evaluates checkpoints in a worker process.
+
+With async_dev_eval set, CorefModel.train no longer blocks on a full dev
+pass after every epoch. The checkpoint written by save_weights is handed to
+a worker process, which loads it into its own copy of the model and runs
+CorefModel.evaluate on the dev data, conll output included, while the main
+process continues with the next epoch (see CorefModel.evaluate_epoch).
+Finished evaluations are collected back into train_logs["dev_eval"] in
+epoch order.
+
+The worker compares approximate evaluations (dev_eval_fraction < 1) with
+the best epoch of the evaluations it was given and the ones it made. When
+training is resumed, the evaluator is created with the restored
+train_logs["dev_eval"] and the checkpoints that were still pending are
+submitted again.
+"""
+
+import multiprocessing as mp
+import queue
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from coref import checkpoint
+from coref.config import Config
+
+
+# Seconds between checks that the worker is still alive while waiting
+_POLL_INTERVAL = 5.0
+
+
+class DevEvaluator:
+    """ Evaluates checkpoints on the dev data in a worker process.
+
+    Usage:
+        evaluator = DevEvaluator(config_path, config)
+        evaluator.submit(epoch, checkpoint_path)
+        ...
+        for result in evaluator.collect():     # finished so far
+            ...
+        for result in evaluator.close():       # waits for the rest
+            ...
+
+    If training fails, terminate() stops the worker right away.
+    """
+    def __init__(self,
+                 config_path: str,
+                 config: Config,
+                 dev_eval: Optional[List[Dict[str, Any]]] = None):
+        """
+        Args:
+            config_path (str): the path to the toml file the model was
+                created from
+            config (Config): the configuration of the training model.
+                All of its values, including the ones set after loading,
+                are passed to the worker
+            dev_eval (List[Dict[str, Any]]): the evaluations of earlier
+                epochs, e.g. restored by CorefModel.resume()
+        """
+        values = dict(vars(config))
+        if getattr(config, "dev_eval_device", ""):
+            values["device"] = config.dev_eval_device
+        # Per-document timings of the worker would interleave with
+        # the ones of the training process
+        values["stage_timing_trace"] = False
+        # "spawn" is needed to use cuda in the worker
+        context = mp.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_worker,
+            args=(config_path, config.section, values, list(dev_eval or []),
+                  self._tasks, self._results),
+            daemon=True)
+        self._process.start()
+        # {epoch: checkpoint_path} of the evaluations not collected yet
+        self.pending: Dict[int, str] = {}
+
+    def submit(self, epoch: int, checkpoint_path: str):
+        """ Queues the checkpoint of the epoch for evaluation """
+        self.pending[epoch] = checkpoint_path
+        self._tasks.put((epoch, checkpoint_path))
+
+    def collect(self, block: bool = False) -> List[Dict[str, Any]]:
+        """ Returns the results of the evaluations finished so far, sorted
+        by epoch. If block is True, waits for all pending evaluations. """
+        results = []
+        while self.pending:
+            try:
+                status, payload = self._results.get(
+                    block=block, timeout=_POLL_INTERVAL if block else None)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        f"Dev evaluation worker exited with code"
+                        f" {self._process.exitcode}, epochs not evaluated:"
+                        f" {list(self.pending)}")
+                if block:
+                    continue
+                break
+            if status == "error":
+                raise RuntimeError(f"Dev evaluation failed:\n{payload}")
+            del self.pending[payload["epoch"]]
+            results.append(payload)
+        return sorted(results, key=lambda result: result["epoch"])
+
+    def close(self) -> List[Dict[str, Any]]:
+        """ Waits for the pending evaluations, stops the worker and
+        returns the results not collected yet """
+        try:
+            results = self.collect(block=True)
+        except RuntimeError:
+            self.terminate()
+            raise
+        self._tasks.put(None)
+        self._process.join()
+        return results
+
+    def terminate(self):
+        """ Stops the worker without waiting for pending evaluations """
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+
+
+def _worker(config_path: str,
+            section: str,
+            values: Dict[str, Any],
+            dev_eval: List[Dict[str, Any]],
+            tasks: "mp.Queue[Optional[Tuple[int, str]]]",
+            results: "mp.Queue[Tuple[str, Any]]"):
+    """ Builds the model once and evaluates each checkpoint received """
+    # Imported here to avoid a circular import of coref_model
+    from coref.coref_model import CorefModel  # pylint: disable=import-outside-toplevel
+
+    try:
+        model = CorefModel(config_path, section, build_optimizers=False,
+                           config_overrides=values)
+    except Exception:  # pylint: disable=broad-except
+        results.put(("error", traceback.format_exc()))
+        return
+    # The history approximate evaluations are compared with
+    model.train_logs["dev_eval"] = dev_eval
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        epoch, checkpoint_path = task
+        try:
+            model.load_weights(path=checkpoint_path,
+                               map_location=model.config.device,
+                               ignore=checkpoint.TRAINING_STATE_KEYS)
+            model.evaluate_epoch()
+            result = dict(model.train_logs["dev_eval"][-1])
+            result["epoch"] = epoch
+            result["checkpoint_path"] = checkpoint_path
+            results.put(("ok", result))
+        except Exception:  # pylint: disable=broad-except
+            results.put(("error", traceback.format_exc()))
+            break
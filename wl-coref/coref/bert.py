@@ -1,12 +1,18 @@
 """Functions related to BERT or similar models"""
 
-from typing import List, Tuple
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
 
 import numpy as np                                 # type: ignore
+import torch
 from transformers import AutoModel, AutoTokenizer  # type: ignore
 
 from coref.config import Config
 from coref.const import Doc
+from coref.vocab_trim import (VOCAB_MAP_FILE, TrimmedTokenizer,
+                              load_kept_ids, load_source)
 
 
 def get_subwords_batches(doc: Doc,
@@ -14,7 +20,7 @@ def get_subwords_batches(doc: Doc,
                          tok: AutoTokenizer
                          ) -> np.ndarray:
     """
-    Turns a list of subwords to a list of lists of subword indices
+    Turns subword ids of a document into a list of lists of subword ids
     of max length == batch_size (or shorter, as batch boundaries
     should match sentence boundaries). Each batch is enclosed in cls and sep
     special tokens.
@@ -24,35 +30,72 @@ def get_subwords_batches(doc: Doc,
     """
     batch_size = config.bert_window_size - 2  # to save space for CLS and SEP
 
-    subwords: List[str] = doc["subwords"]
+    subword_ids = doc["subword_ids"]
+    sent_ids = doc["sent_id"]
+    word_ids = doc["word_id"]
     subwords_batches = []
     start, end = 0, 0
 
-    while end < len(subwords):
-        end = min(end + batch_size, len(subwords))
+    while end < len(subword_ids):
+        end = min(end + batch_size, len(subword_ids))
 
         # Move back till we hit a sentence end
-        if end < len(subwords):
-            sent_id = doc["sent_id"][doc["word_id"][end]]
-            while end and doc["sent_id"][doc["word_id"][end - 1]] == sent_id:
+        if end < len(subword_ids):
+            sent_id = sent_ids[word_ids[end]]
+            while end and sent_ids[word_ids[end - 1]] == sent_id:
                 end -= 1
 
         length = end - start
-        batch = [tok.cls_token] + subwords[start:end] + [tok.sep_token]
-        batch_ids = [-1] + list(range(start, end)) + [-1]
+        batch = ([tok.cls_token_id] + list(subword_ids[start:end])
+                 + [tok.sep_token_id])
 
         # Padding to desired length
-        # -1 means the token is a special token
-        batch += [tok.pad_token] * (batch_size - length)
-        batch_ids += [-1] * (batch_size - length)
+        batch += [tok.pad_token_id] * (batch_size - length)
 
-        subwords_batches.append([tok.convert_tokens_to_ids(token)
-                                 for token in batch])
+        subwords_batches.append(batch)
         start += length
 
     return np.array(subwords_batches)
 
 
+def tokenizer_identity(tokenizer: AutoTokenizer) -> Dict[str, str]:
+    """ Returns the class, vocabulary size and a hash of the vocabulary of
+    the tokenizer, to check that weights are used with the tokenizer they
+    were trained with """
+    vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+    vocab_hash = hashlib.sha1(json.dumps(vocab).encode("utf8")).hexdigest()
+    return {"tokenizer_class": type(tokenizer).__name__,
+            "tokenizer_vocab_size": str(len(vocab)),
+            "tokenizer_vocab_sha1": vocab_hash}
+
+
+def tokenizer_name(config: Config) -> str:
+    """ Returns the name of the model whose tokenizer config.bert_model
+    uses: the model a trimmed model (see vocab_trim.py) was trimmed from,
+    config.bert_model otherwise. tokenizer_kwargs, TOKENIZER_FILTERS and
+    TOKENIZER_MAPS are looked up by this name. """
+    if os.path.isfile(os.path.join(config.bert_model, VOCAB_MAP_FILE)):
+        return load_source(config.bert_model)
+    return config.bert_model
+
+
+def load_tokenizer(config: Config) -> AutoTokenizer:
+    """ Loads the tokenizer of config.bert_model. The tokenizer of a model
+    with a trimmed vocabulary (see vocab_trim.py) is wrapped to produce
+    the trimmed ids. """
+    base_bert_name = tokenizer_name(config).split("/")[-1]
+    tokenizer_kwargs = config.tokenizer_kwargs.get(base_bert_name, {})
+    if tokenizer_kwargs:
+        print(f"Using tokenizer kwargs: {tokenizer_kwargs}")
+    tokenizer = AutoTokenizer.from_pretrained(config.bert_model,
+                                              **tokenizer_kwargs)
+    if os.path.isfile(os.path.join(config.bert_model, VOCAB_MAP_FILE)):
+        kept_ids = load_kept_ids(config.bert_model)
+        print(f"Using a trimmed vocabulary of {len(kept_ids)} subwords")
+        tokenizer = TrimmedTokenizer(tokenizer, kept_ids)
+    return tokenizer
+
+
 def load_bert(config: Config) -> Tuple[AutoModel, AutoTokenizer]:
     """
     Loads bert and bert tokenizer as pytorch modules.
@@ -61,15 +104,92 @@ def load_bert(config: Config) -> Tuple[AutoModel, AutoTokenizer]:
     """
     print(f"Loading {config.bert_model}...")
 
-    base_bert_name = config.bert_model.split("/")[-1]
-    tokenizer_kwargs = config.tokenizer_kwargs.get(base_bert_name, {})
-    if tokenizer_kwargs:
-        print(f"Using tokenizer kwargs: {tokenizer_kwargs}")
-    tokenizer = AutoTokenizer.from_pretrained(config.bert_model,
-                                              **tokenizer_kwargs)
-
-    model = AutoModel.from_pretrained(config.bert_model).to(config.device)
+    tokenizer = load_tokenizer(config)
+    model = AutoModel.from_pretrained(config.bert_model)
+    if config.bert_layers or config.bert_pruned_heads:
+        slim_bert(model, config.bert_layers, config.bert_pruned_heads)
+        print(f"Using {model.config.num_hidden_layers} layers and"
+              f" {sum(map(len, config.bert_pruned_heads.values()))} pruned"
+              f" attention heads")
+    model = model.to(config.device)
 
     print("Bert successfully loaded.")
 
     return model, tokenizer
+
+
+def slim_bert(model: AutoModel,
+              n_layers: int,
+              pruned_heads: Dict[str, List[int]]):
+    """
+    Removes transformer layers and attention heads from a BERT-like model
+    in place. The remaining weights are kept.
+
+    Args:
+        model: a model with its layers in model.encoder.layer
+        n_layers (int): the number of bottom layers to keep, 0 keeps all
+        pruned_heads: layer index (as str, the way it is written in the
+            config) to the indices of its attention heads to remove, in the
+            original numbering. Heads already removed are skipped.
+    """
+    layers = model.encoder.layer
+    if 0 < n_layers < len(layers):
+        model.encoder.layer = torch.nn.ModuleList(layers[:n_layers])
+        model.config.num_hidden_layers = n_layers
+    for layer_id, heads in pruned_heads.items():
+        if int(layer_id) < len(model.encoder.layer):
+            _prune_heads(model.encoder.layer[int(layer_id)].attention,
+                         heads, model.config.num_attention_heads)
+
+
+def _prune_heads(attention: torch.nn.Module,
+                 heads: List[int],
+                 n_original_heads: int):
+    """ Removes attention heads from a BERT-like attention module. Works
+    regardless of the prune_heads support of the transformers version. """
+    self_attention = attention.self
+    pruned = set(getattr(attention, "pruned_heads", set()))
+    remaining = [head for head in range(n_original_heads)
+                 if head not in pruned]
+    to_prune = set(heads) - pruned
+    if not to_prune:
+        return
+    if not set(remaining) - to_prune:
+        raise ValueError("Cannot prune all the attention heads of a layer")
+
+    head_size = self_attention.attention_head_size
+    index = torch.cat([
+        torch.arange(i * head_size, (i + 1) * head_size)
+        for i, head in enumerate(remaining) if head not in to_prune])
+    for name in ("query", "key", "value"):
+        setattr(self_attention, name,
+                _slice_linear(getattr(self_attention, name), index, dim=0))
+    attention.output.dense = _slice_linear(attention.output.dense, index,
+                                           dim=1)
+
+    self_attention.num_attention_heads = len(remaining) - len(to_prune)
+    self_attention.all_head_size = \
+        self_attention.num_attention_heads * head_size
+    attention.pruned_heads = pruned | to_prune
+
+
+def _slice_linear(layer: torch.nn.Linear,
+                  index: torch.Tensor,
+                  dim: int) -> torch.nn.Linear:
+    """ Keeps the output (dim=0) or input (dim=1) features of index """
+    weight = layer.weight.detach().index_select(dim, index.to(
+        layer.weight.device))
+    bias = layer.bias
+    if bias is not None and dim == 0:
+        bias = bias.detach()[index.to(bias.device)]
+    new_layer = torch.nn.Linear(weight.shape[1], weight.shape[0],
+                                bias=bias is not None).to(weight.device,
+                                                          weight.dtype)
+    with torch.no_grad():
+        new_layer.weight.copy_(weight)
+        if bias is not None:
+            new_layer.bias.copy_(bias)
+    new_layer.weight.requires_grad = layer.weight.requires_grad
+    if bias is not None:
+        new_layer.bias.requires_grad = layer.bias.requires_grad
+    return new_layer
@@ -0,0 +1,142 @@
+""" Contains cascade inference between a fast and a full CorefModel.
+
+For bulk annotation a cheap model (distilled, slimmed, quantized or with a
+frozen encoder) is run on every document first. The confidence of a word is
+the margin between the score of its best antecedent and that of the dummy
+antecedent (coref_scores), in either direction: a large negative margin is
+a confident "no antecedent". Words whose margin falls under the threshold
+are escalated to the full model:
+    "doc"       documents with more than max_uncertain (a share of the
+                words) uncertain words are run by the full model, the others
+                keep the output of the fast model
+    "mention"   the full model runs on documents with uncertain words, but
+                only the antecedents of those words are taken from it; the
+                rest keep the antecedents of the fast model
+
+Tokenization is shared when both models use the same encoder vocabulary and
+device, otherwise documents are given to the full model as tokenized by it.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+import torch
+
+from coref import bert
+from coref.const import CorefResult, Doc
+
+
+LEVELS = ("doc", "mention")
+
+
+def margins(res: CorefResult) -> torch.Tensor:
+    """ Returns the confidence of every word, [n_words]: the absolute
+    difference between the scores of its best antecedent and the dummy """
+    best = res.coref_scores[:, 1:].max(dim=1).values \
+        if res.coref_scores.shape[1] > 1 \
+        else torch.full_like(res.coref_scores[:, 0], float("-inf"))
+    return (best - res.coref_scores[:, 0]).abs()
+
+
+class Cascade:
+    """ Runs the fast model on every document and the full model where the
+    fast one is not confident, counting escalations and time spent """
+
+    def __init__(self, fast: Any, full: Any,
+                 threshold: float,
+                 level: str = "doc",
+                 max_uncertain: float = 0.0):
+        """
+        Args:
+            fast (CorefModel): the cheap model, run on every document
+            full (CorefModel): the model uncertain words are escalated to
+            threshold (float): words with a smaller margin are uncertain
+            level (str): "doc" or "mention", see the module docstring
+            max_uncertain (float): the share of uncertain words a document
+                can have without being escalated, only used with "doc"
+        """
+        if level not in LEVELS:
+            raise ValueError(f"level must be one of {LEVELS}, got {level}")
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        self.level = level
+        self.max_uncertain = max_uncertain
+        self.shares_tokenization = (
+            fast.config.bert_model == full.config.bert_model
+            or bert.tokenizer_identity(fast.tokenizer)
+            == bert.tokenizer_identity(full.tokenizer)
+        ) and torch.device(fast.config.device) == torch.device(full.config.device)
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Clears the counters reported by stats() """
+        self._counts = {"docs": 0, "docs_escalated": 0,
+                        "words": 0, "words_uncertain": 0}
+        self._seconds = {"fast": 0.0, "full": 0.0}
+
+    def run(self, doc: Doc, full_doc: Optional[Doc] = None) -> CorefResult:
+        """
+        Args:
+            doc (Doc): the document, tokenized for the fast model
+            full_doc (Doc): the same document tokenized for the full model,
+                only needed if not shares_tokenization
+
+        Returns:
+            CorefResult of the full model for escalated documents, with the
+            antecedents of certain words fixed by the fast model at the
+            "mention" level, and of the fast model otherwise
+        """
+        if full_doc is None:
+            if not self.shares_tokenization:
+                raise ValueError("the models tokenize differently,"
+                                 " full_doc is required")
+            full_doc = doc
+        cuda = torch.device(self.fast.config.device).type == "cuda"
+
+        start = time.perf_counter()
+        res = self.fast.run(doc)
+        uncertain = margins(res) < self.threshold
+        if cuda:
+            torch.cuda.synchronize()
+        self._seconds["fast"] += time.perf_counter() - start
+
+        n_words = len(uncertain)
+        n_uncertain = int(uncertain.sum())
+        self._counts["docs"] += 1
+        self._counts["words"] += n_words
+        self._counts["words_uncertain"] += n_uncertain
+        if self.level == "doc":
+            escalate = n_uncertain > self.max_uncertain * n_words
+        else:
+            escalate = n_uncertain > 0
+        if not escalate:
+            return res
+
+        self._counts["docs_escalated"] += 1
+        start = time.perf_counter()
+        fixed = None
+        if self.level == "mention":
+            fixed = (~uncertain,
+                     self.fast.antecedents(res.coref_scores, res.top_indices))
+        res = self.full.run(full_doc, fixed_antecedents=fixed)
+        if cuda:
+            torch.cuda.synchronize()
+        self._seconds["full"] += time.perf_counter() - start
+        return res
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns the escalation rates and the throughput so far """
+        counts = self._counts
+        seconds = sum(self._seconds.values())
+        return {
+            **counts,
+            "doc_escalation_rate":
+                counts["docs_escalated"] / max(counts["docs"], 1),
+            "word_uncertain_rate":
+                counts["words_uncertain"] / max(counts["words"], 1),
+            "fast_s": self._seconds["fast"],
+            "full_s": self._seconds["full"],
+            "docs_per_s": counts["docs"] / seconds if seconds else None,
+            "words_per_s": counts["words"] / seconds if seconds else None,
+        }
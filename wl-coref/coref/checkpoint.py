@@ -0,0 +1,371 @@
+""" Contains the checkpoint file format and CheckpointWriter.
+
+Model weights are stored in the safetensors layout: an 8-byte little-endian
+header length, a json header mapping tensor names to their dtype, shape and
+byte range, and the raw tensor bytes. Such files can be memory-mapped, so
+loading only pages in the tensors as they are copied into the model.
+Tensor names are "{module}.{parameter}", e.g. "we.attn.weight".
+
+Optimizer and scheduler states are not tensors-only, so they are pickled
+with torch.save into a separate training state file next to the weights.
+Only the training state of the latest checkpoint is kept.
+Checkpoints can also be saved as deltas against a base one, see delta.py.
+Release checkpoints (see release_weights.py) may hold float16 tensors and
+int8 tensors with per-row scales, which are dequantized on loading.
+
+CheckpointWriter writes snapshots of the weights on a background thread,
+so that training can continue while the previous epoch is being saved.
+"""
+
+import json
+import os
+import pickle
+import queue
+import struct
+import threading
+import zipfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np      # type: ignore
+import torch
+
+
+SUFFIX = ".safetensors"
+DELTA_SUFFIX = ".delta"
+# Scales of int8 tensors are stored as "{name}{SCALE_SUFFIX}"
+SCALE_SUFFIX = ".__scale__"
+TRAINING_STATE_FILE = "training_state.pt"
+# The keys of the optimizer and scheduler states among the saved state dicts,
+# ignored when loading weights for inference
+TRAINING_STATE_KEYS = frozenset([
+    "bert_optimizer", "general_optimizer", "embedding_optimizer",
+    "bert_scheduler", "general_scheduler", "embedding_scheduler"])
+
+DTYPES = {
+    torch.float64: ("F64", np.float64),
+    torch.float32: ("F32", np.float32),
+    torch.float16: ("F16", np.float16),
+    torch.int64: ("I64", np.int64),
+    torch.int32: ("I32", np.int32),
+    torch.int16: ("I16", np.int16),
+    torch.int8: ("I8", np.int8),
+    torch.uint8: ("U8", np.uint8),
+    torch.bool: ("BOOL", np.bool_),
+}
+NUMPY_DTYPES = {name: np_dtype for name, np_dtype in DTYPES.values()}
+
+
+def _element_size(dtype: torch.dtype) -> int:
+    return np.dtype(DTYPES[dtype][1]).itemsize
+
+
+def snapshot(obj: Any) -> Any:
+    """ Returns a copy of obj with every tensor in it copied to cpu.
+    Works with state dicts, including nested optimizer states. """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return obj.__class__((key, snapshot(value))
+                             for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(snapshot(value) for value in obj)
+    return obj
+
+
+def flatten(state_dicts: Dict[str, Dict[str, torch.Tensor]]
+            ) -> Dict[str, torch.Tensor]:
+    """ {module: {parameter: tensor}} -> {"module.parameter": tensor} """
+    return {f"{module}.{name}": tensor
+            for module, state_dict in state_dicts.items()
+            for name, tensor in state_dict.items()}
+
+
+def unflatten(tensors: Dict[str, torch.Tensor]
+              ) -> Dict[str, Dict[str, torch.Tensor]]:
+    """ {"module.parameter": tensor} -> {module: {parameter: tensor}} """
+    state_dicts: Dict[str, Dict[str, torch.Tensor]] = {}
+    for key, tensor in tensors.items():
+        module, name = key.split(".", 1)
+        state_dicts.setdefault(module, {})[name] = tensor
+    return state_dicts
+
+
+def save_tensors(path: str,
+                 tensors: Dict[str, torch.Tensor],
+                 metadata: Optional[Dict[str, str]] = None):
+    """ Writes tensors to path in the safetensors layout, copying them to
+    cpu one at a time. The file is written under a temporary name and
+    renamed when complete. """
+    write_tensors(path,
+                  [(name, tensor.dtype, tensor.shape,
+                    lambda tensor=tensor: tensor)
+                   for name, tensor in tensors.items()],
+                  metadata)
+
+
+def write_tensors(path: str,
+                  specs: List[Tuple[str, torch.dtype, Sequence[int],
+                                    Callable[[], torch.Tensor]]],
+                  metadata: Optional[Dict[str, str]] = None):
+    """ Same as save_tensors, but the tensors are given as
+    (name, dtype, shape, function returning the tensor). Each tensor is only
+    produced when written, so at most one of them is in memory at a time. """
+    # Larger elements first, so that every tensor stays aligned
+    specs = sorted(specs, key=lambda spec: -_element_size(spec[1]))
+    header: Dict[str, Any] = {}
+    if metadata:
+        header["__metadata__"] = {key: str(value)
+                                  for key, value in metadata.items()}
+    offset = 0
+    for name, dtype, shape, _ in specs:
+        size = int(np.prod(shape, dtype=np.int64)) * _element_size(dtype)
+        header[name] = {"dtype": DTYPES[dtype][0],
+                        "shape": list(shape),
+                        "data_offsets": [offset, offset + size]}
+        offset += size
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode="wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, dtype, shape, produce in specs:
+            tensor = produce()
+            if tensor.dtype != dtype or tuple(tensor.shape) != tuple(shape):
+                raise ValueError(f"{name}: expected {dtype} {list(shape)},"
+                                 f" got {tensor.dtype} {list(tensor.shape)}")
+            array = tensor.detach().cpu().contiguous().numpy()
+            f.write(array.reshape(-1).view(np.uint8).data)
+    os.replace(tmp_path, path)
+
+
+def quantize_int8(tensor: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Symmetric per-row int8 quantization of a 2D tensor. Returns the
+    quantized tensor and the float32 scales of shape [n_rows, 1] """
+    tensor = tensor.detach().float()
+    scale = tensor.abs().max(dim=1, keepdim=True)[0].clamp(min=1e-12) / 127
+    quantized = torch.round(tensor / scale).clamp(-127, 127).to(torch.int8)
+    return quantized, scale
+
+
+def dequantize(tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """ Replaces the int8 tensors quantized by quantize_int8 and stored
+    together with their "{name}{SCALE_SUFFIX}" scales by float32 ones """
+    for scale_name in [name for name in tensors
+                       if name.endswith(SCALE_SUFFIX)]:
+        name = scale_name[:-len(SCALE_SUFFIX)]
+        tensors[name] = tensors[name].float() * tensors.pop(scale_name)
+    return tensors
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """ Returns the header of a tensors file and the offset of its data """
+    with open(path, mode="rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def load_tensors(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """ Returns the tensors and the metadata stored in path. The tensors
+    are copy-on-write views of the memory-mapped file. """
+    header, data_start = read_header(path)
+    metadata = header.pop("__metadata__", {})
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=data_start) \
+        if header else np.zeros(0, dtype=np.uint8)
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        array = data[start:end].view(NUMPY_DTYPES[info["dtype"]])
+        tensors[name] = torch.from_numpy(array.reshape(info["shape"]))
+    return tensors, metadata
+
+
+def training_state_path(checkpoint_path: str) -> str:
+    """ Returns the path of the training state saved with the checkpoint """
+    return os.path.join(os.path.dirname(checkpoint_path), TRAINING_STATE_FILE)
+
+
+def save_checkpoint(path: str,
+                    modules: Dict[str, Dict[str, torch.Tensor]],
+                    metadata: Dict[str, str],
+                    training_state: Optional[Dict[str, Any]] = None,
+                    base: Optional[str] = None):
+    """ Saves the state dicts of modules to path and, if given, the training
+    state (optimizers, schedulers...) to the training state file, replacing
+    the one of the previous checkpoint. If base is given, the weights are
+    saved as a delta against it (see delta.py). """
+    if base:
+        from coref import delta  # pylint: disable=import-outside-toplevel
+        delta.save_delta(path, flatten(modules), base, metadata)
+    else:
+        save_tensors(path, flatten(modules), metadata)
+    if training_state is not None:
+        state_path = training_state_path(path)
+        training_state = dict(training_state,
+                              checkpoint=os.path.basename(path))
+        torch.save(training_state, f"{state_path}.tmp")
+        os.replace(f"{state_path}.tmp", state_path)
+
+
+def load_checkpoint(path: str,
+                    training_state: Optional[Dict[str, Any]] = None
+                    ) -> Dict[str, Any]:
+    """ Loads a checkpoint saved by save_checkpoint in the form of the dicts
+    saved by torch.save in earlier versions: {module: state_dict,
+    "epochs_trained": int, "metadata": Dict[str, str]}. The training state
+    file is not read, see load_latest_checkpoint(); a training state that
+    is passed is included. """
+    if path.endswith(DELTA_SUFFIX):
+        from coref import delta  # pylint: disable=import-outside-toplevel
+        tensors, metadata = delta.load_delta(path)
+    else:
+        tensors, metadata = load_tensors(path)
+    state_dicts: Dict[str, Any] = unflatten(dequantize(tensors))
+    state_dicts["epochs_trained"] = int(metadata.get("epochs_trained", 0))
+    state_dicts["metadata"] = metadata
+    if training_state is not None:
+        state_dicts.update(training_state)
+    return state_dicts
+
+
+def read_weights(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """ Returns the flat weights of the modules saved in a checkpoint of any
+    format, without optimizer and scheduler states, and its metadata """
+    if path.endswith(DELTA_SUFFIX):
+        from coref import delta  # pylint: disable=import-outside-toplevel
+        return delta.load_delta(path)
+    if path.endswith(SUFFIX):
+        return load_tensors(path)
+    state_dicts = _load_lazily(path)
+    metadata = {"epochs_trained": str(state_dicts.pop("epochs_trained", 0))}
+    modules = {key: value for key, value in state_dicts.items()
+               if not key.endswith(("_optimizer", "_scheduler"))
+               and key != "resume"}
+    return flatten(modules), metadata
+
+
+def holds_training_state(path: str) -> bool:
+    """ Returns whether the checkpoint holds optimizer, scheduler or resume
+    states, which read_weights() drops: a checkpoint saved by torch.save
+    with them or the checkpoint the training state file belongs to """
+    if path.endswith(DELTA_SUFFIX):
+        return False
+    if path.endswith(SUFFIX):
+        state_path = training_state_path(path)
+        return (os.path.exists(state_path)
+                and _load_skeleton(state_path)["checkpoint"]
+                == os.path.basename(path))
+    return any(key.endswith(("_optimizer", "_scheduler")) or key == "resume"
+               for key in _load_skeleton(path))
+
+
+class _Placeholder:
+    """ Stands for the tensors and other torch objects of a file loaded by
+    _load_skeleton() """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _SkeletonUnpickler(pickle.Unpickler):
+    """ Unpickles the data.pkl of a file saved by torch.save without reading
+    its storages """
+    def find_class(self, module, name):
+        if module.split(".", 1)[0] == "torch":
+            return _Placeholder
+        return super().find_class(module, name)
+
+    def persistent_load(self, pid):
+        return None
+
+
+def _load_skeleton(path: str) -> Dict[str, Any]:
+    """ Loads a file saved by torch.save with its tensors replaced by
+    placeholders, reading none of their data. Files in the legacy format of
+    torch < 1.6 are loaded in full. """
+    if not zipfile.is_zipfile(path):
+        return _load_lazily(path)
+    with zipfile.ZipFile(path) as archive:
+        pickle_name = next(name for name in archive.namelist()
+                           if name.endswith("/data.pkl"))
+        with archive.open(pickle_name) as f:
+            return _SkeletonUnpickler(f).load()
+
+
+def _load_lazily(path: str) -> Dict[str, Any]:
+    """ Loads a file saved by torch.save to cpu """
+    try:    # tensors are only read when accessed, torch >= 2.1
+        return torch.load(path, map_location="cpu", mmap=True)
+    except (TypeError, RuntimeError):
+        return torch.load(path, map_location="cpu")
+
+
+def load_latest_checkpoint(directory: str,
+                           map_location: Optional[str] = None
+                           ) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """ Loads the checkpoint the training state in the directory belongs to,
+    i.e. the latest one saved. Returns its path and the loaded state dicts,
+    or None if there is no training state. """
+    state_path = os.path.join(directory, TRAINING_STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    training_state = torch.load(state_path, map_location=map_location)
+    path = os.path.join(directory, training_state.pop("checkpoint"))
+    return path, load_checkpoint(path, training_state=training_state)
+
+
+class CheckpointWriter:
+    """ Runs checkpoint writing jobs on a background thread, in order.
+
+    Errors raised by a job are re-raised by the next call to submit()
+    or wait(), so that a failing disk does not go unnoticed.
+
+    Usage:
+        writer = CheckpointWriter()
+        writer.submit(lambda: save_checkpoint(path, snapshot(...), ...))
+        ...
+        writer.wait()
+    """
+    def __init__(self):
+        self._jobs: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._errors: List[BaseException] = []
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[], None]):
+        """ Queues the job. It must not use tensors that the training
+        process may change, see snapshot() """
+        self._raise_errors()
+        self._jobs.put(job)
+
+    def wait(self):
+        """ Blocks until all the jobs submitted are done """
+        self._jobs.join()
+        self._raise_errors()
+
+    def close(self):
+        """ Waits for the jobs and stops the thread """
+        self._jobs.put(None)
+        self._thread.join()
+        self._raise_errors()
+
+    def _loop(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                job()
+            except BaseException as e:  # pylint: disable=broad-except
+                self._errors.append(e)
+            finally:
+                self._jobs.task_done()
+
+    def _raise_errors(self):
+        if self._errors:
+            error = self._errors.pop(0)
+            raise RuntimeError("Checkpoint writing failed") from error
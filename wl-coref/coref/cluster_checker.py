@@ -15,6 +15,8 @@ class ClusterChecker:
         self._r = 0.0
         self._p_weight = 0.0
         self._r_weight = 0.0
+        # (precision, precision weight, recall, recall weight) per document
+        self.doc_counts: List[Tuple[float, float, float, float]] = []
 
     def add_predictions(self,
                         gold_clusters: List[List[Hashable]],
@@ -33,6 +35,7 @@ class ClusterChecker:
         self._r_weight += r_weight
         self._p += precision
         self._p_weight += p_weight
+        self.doc_counts.append((precision, p_weight, recall, r_weight))
 
         doc_precision = precision / (p_weight + EPSILON)
         doc_recall = recall / (r_weight + EPSILON)
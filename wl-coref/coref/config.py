@@ -4,7 +4,7 @@ For description of all config values, refer to config.toml.
 """
 
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, List
 
 
 @dataclass
@@ -19,28 +19,57 @@ class Config:  # pylint: disable=too-many-instance-attributes, too-few-public-me
     train_data: str
     dev_data: str
     test_data: str
+    docs_memory_budget: float
 
     device: str
 
     bert_model: str
     bert_window_size: int
+    bert_layers: int
+    bert_pruned_heads: Dict[str, List[int]]
 
     embedding_size: int
     sp_embedding_size: int
     a_scoring_batch_size: int
+    a_scoring_memory_budget: float
     hidden_size: int
     n_hidden_layers: int
 
     max_span_len: int
 
     rough_k: int
+    rough_pruning: str
+    rough_pruning_threshold: float
+    anaphor_filter: str
+    anaphor_filter_pos: List[str]
+    anaphor_filter_threshold: float
 
     bert_finetune: bool
+    bert_embedding_updates: str
     dropout_rate: float
     learning_rate: float
     bert_learning_rate: float
+    bert_optimizer: str
+    general_optimizer: str
     train_epochs: int
     bce_loss_weight: float
+    distill_teacher_section: str
+    distill_teacher_weights: str
+    distill_weight: float
+    distill_temperature: float
 
     tokenizer_kwargs: Dict[str, dict]
     conll_log_dir: str
+    checkpoint_format: str
+    async_checkpoints: bool
+    keep_checkpoints: int
+    checkpoint_base: str
+    resume_every: int
+    async_dev_eval: bool
+    dev_eval_device: str
+    dev_eval_fraction: float
+    dev_eval_bootstrap: int
+    dev_eval_confidence: float
+
+    stage_timing: bool
+    stage_timing_trace: bool
@@ -17,9 +17,20 @@ Span = Tuple[int, int]
 class CorefResult:
     coref_scores: torch.Tensor = None                  # [n_words, k + 1]
     coref_y: torch.Tensor = None                       # [n_words, k + 1]
+    top_indices: torch.Tensor = None                   # [n_words, k]
+    n_pairs: int = 0                                   # pairs scored
+    anaphor_logits: torch.Tensor = None                # [n_words]
 
     word_clusters: List[List[int]] = None
     span_clusters: List[List[Span]] = None
 
-    span_scores: torch.Tensor = None                   # [n_heads, n_words, 2]
+    # sentence-local, see SpanPredictor.forward
+    span_scores: torch.Tensor = None                   # [n_heads, max_sent_len, 2]
     span_y: Tuple[torch.Tensor, torch.Tensor] = None   # [n_heads] x2
+
+
+@dataclass
+class QueryResult:
+    chains: Dict[int, List[int]]                       # query -> antecedents
+    spans: Dict[int, List[Span]]                       # query -> spans
+    n_rows: int = 0                                    # words scored
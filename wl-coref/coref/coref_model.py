@@ -1,34 +1,52 @@
 """ see __init__.py """
-from datetime import datetime
+import bisect
+import cProfile
+import functools
+import json
 import os
-import pickle
 import random
 import re
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import (Any, Callable, Dict, List, Optional, Sequence, Set,
+                    Tuple)
 from collections import defaultdict
 
 import numpy as np      # type: ignore
 import jsonlines        # type: ignore
 import toml
-import psutil
 
 import torch
 from tqdm import tqdm   # type: ignore
 import transformers     # type: ignore
 
-from coref import bert, conll, utils
+from coref import bert, checkpoint, conll, distill, utils
+from coref.anaphor_filter import AnaphorFilter, pos_candidates
 from coref.anaphoricity_scorer import AnaphoricityScorer
+from coref.approx_eval import Sample, stratified_sample, summarize
+from coref.async_eval import DevEvaluator
 from coref.cluster_checker import ClusterChecker
 from coref.config import Config
-from coref.const import CorefResult, Doc
+from coref.const import EPSILON, CorefResult, Doc, QueryResult, Span
+from coref.doc_tensors import build_doc_tensors
+from coref.document import (Document, Vocab, load_documents,
+                            save_documents)
+from coref.document_store import DocumentStore
 from coref.loss import CorefLoss
+from coref.memory import MemoryTracker, a_scoring_batch_size
+from coref.optim import SparseRowAdam, build_optimizer
 from coref.pairwise_encoder import PairwiseEncoder
 from coref.rough_scorer import RoughScorer
 from coref.span_predictor import SpanPredictor
+from coref.profiling import ProfilingTimer
+from coref.timing import NullTimer, PhaseClock, StageTimer
 from coref.tokenizer_customization import TOKENIZER_FILTERS, TOKENIZER_MAPS
 from coref.utils import GraphNode
 from coref.word_encoder import WordEncoder
 
+
+# Bump whenever the format of the tokenized documents cache changes
+CACHE_VERSION = 4
+
+
 class CorefModel:  # pylint: disable=too-many-instance-attributes
     """Combines all coref modules together to find coreferent spans.
 
@@ -52,31 +70,54 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
     def __init__(self,
                  config_path: str,
                  section: str,
-                 lr: float,
-                 bert_lr: float,
+                 lr: Optional[float] = None,
+                 bert_lr: Optional[float] = None,
                  epochs_trained: int = 0,
-                 build_optimizers: bool = True):
+                 build_optimizers: bool = True,
+                 config_overrides: Optional[Dict[str, Any]] = None):
         """
         A newly created model is set to evaluation mode.
 
         Args:
             config_path (str): the path to the toml file with the configuration
             section (str): the selected section of the config file
+            lr (float): overrides the task learning rate from the config
+            bert_lr (float): overrides the bert learning rate from the config
             epochs_trained (int): the number of epochs finished
                 (useful for warm start)
+            build_optimizers (bool): whether to create the optimizers and
+                schedulers (not needed for inference)
+            config_overrides (Dict[str, Any]): values replacing those loaded
+                from the config file before the model is built
         """
+        self.config_path = config_path
         self.config = CorefModel._load_config(config_path, section)
-        self.config.learning_rate = lr
-        self.config.bert_learning_rate = bert_lr
+        for key, value in (config_overrides or {}).items():
+            setattr(self.config, key, value)
+        if lr is not None:
+            self.config.learning_rate = lr
+        if bert_lr is not None:
+            self.config.bert_learning_rate = bert_lr
         self.epochs_trained = epochs_trained
-        self._docs: Dict[str, List[Doc]] = {}
+        self._docs = DocumentStore(self.config.docs_memory_budget)
+        self._dev_sample: Optional[Sample] = None
+        self._writer: Optional[checkpoint.CheckpointWriter] = None
+        self._resume_point: Optional[Dict[str, Any]] = None
+        self._dev_evaluator: Optional[DevEvaluator] = None
+        self._teacher_outputs: Optional[distill.TeacherOutputs] = None
         self._build_model()
+        self.optimizers: Dict[str, torch.optim.Optimizer] = {}
+        self.schedulers: Dict[str, torch.optim.lr_scheduler.LambdaLR] = {}
         if build_optimizers:
             self._build_optimizers()
         self._set_training(False)
         self._coref_criterion = CorefLoss(self.config.bce_loss_weight)
         self._span_criterion = torch.nn.CrossEntropyLoss(reduction="sum")
         self.train_logs = defaultdict(lambda: [])
+        self.memory = MemoryTracker(self.config.device)
+        self.timer: NullTimer = NullTimer()
+        if self.config.stage_timing:
+            self.enable_timing()
 
     @property
     def training(self) -> bool:
@@ -91,16 +132,60 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
 
     # ========================================================== Public methods
 
+    def enable_timing(self):
+        """ Starts measuring the time spent in each stage of run().
+        If config.stage_timing_trace is set, per-document timings are also
+        appended to a jsonl file next to the logs file. """
+        self.timer.close()
+        trace_path = None
+        if self.config.stage_timing_trace:
+            logs_file = getattr(self.config, "logs_file", None)
+            if logs_file:
+                trace_path = f"{os.path.splitext(logs_file)[0]}_timing.jsonl"
+            else:
+                trace_path = os.path.join(self.config.logs_dir,
+                                          f"{self.config.section}_timing.jsonl")
+        self.timer = StageTimer(self.config.device, trace_path)
+
+    def enable_profiling(self,
+                         n_docs: int,
+                         out_dir: Optional[str] = None,
+                         host_profiler: Optional[cProfile.Profile] = None):
+        """ Profiles the next n_docs documents passed to run() with
+        torch.profiler and cProfile, see coref/profiling.py for the details.
+        Call after enable_timing() if both are needed.
+
+        Args:
+            n_docs (int): the number of documents to profile
+            out_dir (str): where to write the results. Defaults to a
+                directory next to the logs file
+            host_profiler (cProfile.Profile): an already running cProfile
+                profiler, to include the work done before the first document
+        """
+        if out_dir is None:
+            logs_file = getattr(self.config, "logs_file", None)
+            if logs_file:
+                out_dir = f"{os.path.splitext(logs_file)[0]}_profile"
+            else:
+                out_dir = os.path.join(self.config.logs_dir,
+                                       f"{self.config.section}_profile")
+        self.timer = ProfilingTimer(self.timer, n_docs, out_dir,
+                                    self.config.device, host_profiler)
+
     @torch.no_grad()
     def evaluate(self,
                  data_split: str = "dev",
-                 word_level_conll: bool = False
+                 word_level_conll: bool = False,
+                 sample: Optional[Sample] = None
                  ) -> Tuple[float, Tuple[float, float, float]]:
         """ Evaluates the modes on the data split provided.
 
         Args:
             data_split (str): one of 'dev'/'test'/'train'
             word_level_conll (bool): if True, outputs conll files on word-level
+            sample (Sample): if given, only the sampled documents are
+                evaluated and the logged scores are estimates for the whole
+                split with bootstrap confidence intervals (see approx_eval.py)
 
         Returns:
             mean loss
@@ -110,9 +195,13 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
         w_checker = ClusterChecker()
         s_checker = ClusterChecker()
         docs = self._get_docs(self.config.__dict__[f"{data_split}_data"])
+        if sample is not None:
+            docs = [docs[i] for i in sample.indices]
         running_loss = 0.0
         s_correct = 0
         s_total = 0
+        n_pairs = 0
+        span_counts: List[Tuple[int, int]] = []
 
         with conll.open_(self.config, self.epochs_trained, data_split) \
                 as (gold_f, pred_f):
@@ -121,12 +210,17 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
                 res = self.run(doc)
 
                 running_loss += self._coref_criterion(res.coref_scores, res.coref_y).item()
+                n_pairs += res.n_pairs
 
                 if res.span_y:
                     pred_starts = res.span_scores[:, :, 0].argmax(dim=1)
                     pred_ends = res.span_scores[:, :, 1].argmax(dim=1)
-                    s_correct += ((res.span_y[0] == pred_starts) * (res.span_y[1] == pred_ends)).sum().item()
+                    doc_correct = ((res.span_y[0] == pred_starts) * (res.span_y[1] == pred_ends)).sum().item()
+                    s_correct += doc_correct
                     s_total += len(pred_starts)
+                    span_counts.append((doc_correct, len(pred_starts)))
+                else:
+                    span_counts.append((0, 0))
 
                 if word_level_conll:
                     conll.write_conll(doc,
@@ -163,6 +257,7 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
                     f" r: {s_lea[2]:<.5f}"
                 )
             self.train_logs[f'{data_split}_eval'].append({
+                'epoch': self.epochs_trained,
                 'wl_loss': running_loss / (len(docs) + 1),
                 'wl_f1': w_lea[0],
                 'wl_p': w_lea[1],
@@ -170,10 +265,56 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
                 'sl_sa': s_correct / s_total,
                 'sl_f1': s_lea[0],
                 'sl_p': s_lea[1],
-                'sl_r': s_lea[2]})
+                'sl_r': s_lea[2],
+                'pairs_per_doc': n_pairs / len(docs)})
+            if sample is not None:
+                self.train_logs[f'{data_split}_eval'][-1].update(summarize(
+                    sample, w_checker.doc_counts, s_checker.doc_counts,
+                    span_counts, self.config.dev_eval_bootstrap,
+                    self.config.dev_eval_confidence))
+            self.train_logs['doc_store'] = self._docs.stats()
+            if self.timer.enabled:
+                self.train_logs['stage_timing'] = self.timer.summary()
+            self.train_logs['memory'] = self.memory.summary()
             print()
         return (running_loss / len(docs), *s_checker.total_lea)
 
+    def evaluate_epoch(self):
+        """ Evaluates the model on the dev data after an epoch.
+
+        If config.dev_eval_fraction is less than one, only a stratified sample
+        of the dev documents is evaluated first. A full pass follows only if
+        the confidence interval of the estimated sl_f1 overlaps the one of the
+        best epoch so far, i.e. if the sample cannot tell whether the epoch
+        is better or worse. Either way one entry is added to
+        train_logs["dev_eval"]; approximate entries have "approx" set.
+        """
+        if self.config.dev_eval_fraction >= 1:
+            self.evaluate()
+            return
+
+        dev_eval = self.train_logs["dev_eval"]
+        best = max(dev_eval, key=lambda entry: entry["sl_f1"], default=None)
+        if self._dev_sample is None:
+            self._dev_sample = stratified_sample(
+                self._get_docs(self.config.dev_data),
+                self.config.dev_eval_fraction)
+        self.evaluate(sample=self._dev_sample)
+
+        if best is not None:
+            low, high = dev_eval[-1]["sl_f1_ci"]
+            best_low, best_high = best.get("sl_f1_ci",
+                                           (best["sl_f1"], best["sl_f1"]))
+            if low <= best_high and best_low <= high:
+                estimate = dev_eval.pop()
+                print(f"Estimated sl_f1 {estimate['sl_f1']:.5f}"
+                      f" [{low:.5f}, {high:.5f}] is too close to the best"
+                      f" epoch, evaluating on all dev documents")
+                self.evaluate()
+                dev_eval[-1]["estimate"] = {
+                    key: estimate[key]
+                    for key in ("sl_f1", "sl_f1_ci", "n_docs")}
+
     def load_weights(self,
                      path: Optional[str] = None,
                      ignore: Optional[Set[str]] = None,
@@ -200,23 +341,59 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
             _, path = sorted(files)[-1]
             path = os.path.join(self.config.data_dir, path)
 
-        if map_location is None:
-            map_location = self.config.device
-        print(f"Loading from {path}...")
-        state_dicts = torch.load(path, map_location=map_location)
-        self.epochs_trained = state_dicts.pop("epochs_trained", 0)
-        for key, state_dict in state_dicts.items():
-            if not ignore or key not in ignore:
-                if key.endswith("_optimizer"):
-                    self.optimizers[key].load_state_dict(state_dict)
-                elif key.endswith("_scheduler"):
-                    self.schedulers[key].load_state_dict(state_dict)
-                else:
-                    self.trainable[key].load_state_dict(state_dict)
-                print(f"Loaded {key}")
+        state_dicts = self._read_checkpoint(path, map_location)
+        state_dicts.pop("resume", None)     # only used by resume()
+        self._load_state_dicts(state_dicts, ignore)
+
+    def resume(self) -> bool:
+        """
+        Restores the latest checkpoint of the model (config.model_name)
+        together with the state needed to continue training exactly where it
+        stopped: the optimizers and schedulers, the order of the documents,
+        the position within the epoch, the running losses, the random number
+        generator states and the train logs, dev evaluations included. With
+        async_dev_eval, the checkpoints not evaluated yet are evaluated when
+        training continues.
+
+        Mid-epoch checkpoints are saved every resume_every documents if the
+        checkpoint_format is "safetensors". With the "torch" format training
+        resumes from the last finished epoch.
+
+        Returns:
+            False if there was nothing to resume from
+        """
+        directory = self._checkpoint_dir()
+        latest = None
+        if self.config.checkpoint_format != "torch":
+            latest = checkpoint.load_latest_checkpoint(directory,
+                                                       self.config.device)
+        elif os.path.isdir(directory):
+            pattern = rf"{re.escape(self.config.section)}_e(\d+)\.pt$"
+            epochs = [(int(match_obj.group(1)), f)
+                      for f in os.listdir(directory)
+                      for match_obj in [re.match(pattern, f)] if match_obj]
+            if epochs:
+                path = os.path.join(directory, max(epochs)[1])
+                latest = path, self._read_checkpoint(path, None)
+        if latest is None:
+            print("Nothing to resume from", flush=True)
+            return False
+
+        path, state_dicts = latest
+        print(f"Resuming from {path}...")
+        resume_point = state_dicts.pop("resume", None)
+        self._load_state_dicts(state_dicts)
+        if resume_point is not None:
+            self.train_logs = defaultdict(lambda: [],
+                                          resume_point.pop("train_logs"))
+            self._resume_point = resume_point
+            print(f"Resuming epoch {self.epochs_trained + 1} at document"
+                  f" {resume_point['position']}", flush=True)
+        return True
 
     def run(self,  # pylint: disable=too-many-locals
             doc: Doc,
+            fixed_antecedents: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
             ) -> CorefResult:
         """
         This is a massive method, but it made sense to me to not split it into
@@ -224,73 +401,262 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
 
         Args:
             doc (Doc): a dictionary with the document data.
+            fixed_antecedents (Tuple[torch.Tensor, torch.Tensor]): a boolean
+                mask [n_words] and antecedents [n_words] (-1 for the dummy)
+                decided by another model, e.g. the fast model of a cascade
+                (see cascade.py). The masked words keep these antecedents
+                when clustering, the scores are not changed.
 
         Returns:
             CorefResult (see const.py)
         """
+        doc_tensors = doc["tensors"]
+        timer = self.timer
+        timer.start_doc(doc_tensors.n_words)
+        self.memory.start_doc()
+
         # Encode words with bert
         # words           [n_words, span_emb]
         # cluster_ids     [n_words]
-        words, cluster_ids = self.we(doc, self._bertify(doc))
+        with timer.stage("bertify"):
+            bert_out = self._bertify(doc)
+        with timer.stage("we"):
+            words, cluster_ids = self.we(doc_tensors, bert_out)
+
+        # Only plausible mentions are scored, if the anaphor filter is on
+        # mention_ids     [n_mentions], None if all the words are mentions
+        # mentions        [n_mentions, span_emb]
+        with timer.stage("anaphor_filter"):
+            anaphor_logits, mention_ids = self._filter_anaphors(doc, words)
+        mentions = words if mention_ids is None else words[mention_ids]
 
         # Obtain bilinear scores and leave only top-k antecedents for each word
-        # top_rough_scores  [n_words, n_ants]
-        # top_indices       [n_words, n_ants]
-        top_rough_scores, top_indices = self.rough_scorer(words)
+        # top_rough_scores  [n_mentions, n_ants]
+        # top_indices       [n_mentions, n_ants], word ids
+        with timer.stage("rough_scorer"):
+            top_rough_scores, top_indices = self.rough_scorer(mentions)
+            if mention_ids is not None:
+                top_indices = mention_ids[top_indices]
+
+        # Get pairwise features [n_mentions, n_ants, n_pw_features]
+        with timer.stage("pw"):
+            pw = self.pw(top_indices, doc_tensors, rows=mention_ids)
+
+        # coref_scores  [n_mentions, n_ants + 1]
+        with timer.stage("a_scorer"):
+            coref_scores, n_pairs = self._score_antecedents(
+                words, mentions, pw, top_indices, top_rough_scores)
 
-        # Get pairwise features [n_words, n_ants, n_pw_features]
-        pw = self.pw(top_indices, doc)
+        res = CorefResult()
+        res.n_pairs = n_pairs
+        res.anaphor_logits = anaphor_logits
+        res.coref_scores = coref_scores
+        if mention_ids is not None:
+            # Words that are not mentions only have the dummy antecedent
+            res.coref_scores, top_rough_scores, top_indices = (
+                self._scatter_rows(tensor, mention_ids, len(words), fill)
+                for tensor, fill in ((res.coref_scores, float("-inf")),
+                                     (top_rough_scores, float("-inf")),
+                                     (top_indices, 0)))
+            res.coref_scores[:, 0] = EPSILON
+        res.top_indices = top_indices
+
+        with timer.stage("ground_truth"):
+            res.coref_y = self._get_ground_truth(
+                cluster_ids, top_indices, (top_rough_scores > float("-inf")))
+        with timer.stage("clusterize"):
+            res.word_clusters = self._clusterize(doc, res.coref_scores,
+                                                 top_indices,
+                                                 fixed_antecedents)
+        with timer.stage("sp"):
+            res.span_scores, res.span_y = self.sp.get_training_data(doc_tensors,
+                                                                    words)
+
+            if not self.training:
+                res.span_clusters = self.sp.predict(doc_tensors, words,
+                                                    res.word_clusters)
+        timer.end_doc(doc["document_id"])
+        self.memory.end_doc(doc_tensors.n_words)
+        return res
 
-        batch_size = self.config.a_scoring_batch_size
-        a_scores_lst: List[torch.Tensor] = []
+    def resolve(self,
+                doc: Doc,
+                queries: Sequence[int],
+                predict_spans: bool = False) -> QueryResult:
+        """
+        Resolves only the query words of the document, e.g. its pronouns.
+        The encoder runs once, then antecedents are scored for the queries,
+        for their best antecedents, for those antecedents' antecedents and
+        so on, until every chain reaches the dummy. The anaphor filter is
+        not applied.
 
-        for i in range(0, len(words), batch_size):
-            pw_batch = pw[i:i + batch_size]
-            words_batch = words[i:i + batch_size]
-            top_indices_batch = top_indices[i:i + batch_size]
-            top_rough_scores_batch = top_rough_scores[i:i + batch_size]
+        The chains follow the antecedent links that run() clusters by, so
+        a query's chain is the part of its run() cluster reached through
+        earlier words.
 
-            # a_scores_batch    [batch_size, n_ants]
-            a_scores_batch = self.a_scorer(
-                all_mentions=words, mentions_batch=words_batch,
-                pw_batch=pw_batch, top_indices_batch=top_indices_batch,
-                top_rough_scores_batch=top_rough_scores_batch
-            )
-            a_scores_lst.append(a_scores_batch)
+        Args:
+            doc (Doc): a dictionary with the document data
+            queries (Sequence[int]): the word ids to resolve
+            predict_spans (bool): if True, the spans of the queries and of
+                their antecedents are predicted too
 
-        res = CorefResult()
+        Returns:
+            QueryResult (see const.py), the chains list the antecedents of
+            every query from the nearest one back
+        """
+        doc_tensors = doc["tensors"]
+        words, _ = self.we(doc_tensors, self._bertify(doc))
+
+        antecedents: Dict[int, int] = {}
+        pending = sorted(set(queries))
+        while pending:
+            rows = torch.tensor(pending, device=words.device)
+            top_rough_scores, top_indices = self.rough_scorer(words, rows=rows)
+            pw = self.pw(top_indices, doc_tensors, rows=rows)
+            coref_scores, _ = self._score_antecedents(
+                words, words[rows], pw, top_indices, top_rough_scores)
+            best = self.antecedents(coref_scores, top_indices).tolist()
+            antecedents.update(zip(pending, best))
+            pending = sorted({antecedent for antecedent in best
+                              if antecedent >= 0
+                              and antecedent not in antecedents})
+
+        chains: Dict[int, List[int]] = {}
+        for query in queries:
+            chain = chains[query] = []
+            antecedent = antecedents[query]
+            while antecedent >= 0:
+                chain.append(antecedent)
+                antecedent = antecedents[antecedent]
+
+        spans: Dict[int, List[Span]] = {}
+        if predict_spans and chains:
+            clusters = [[query, *chain] for query, chain in chains.items()]
+            for cluster, cluster_spans in zip(
+                    clusters, self.sp.predict(doc_tensors, words, clusters)):
+                spans[cluster[0]] = cluster_spans
+        return QueryResult(chains=chains, spans=spans,
+                           n_rows=len(antecedents))
+
+    def save_weights(self,
+                     on_saved: Optional[Callable[[str], None]] = None,
+                     resume_point: Optional[Dict[str, Any]] = None) -> str:
+        """ Saves trainable models as state dicts.
+
+        With checkpoint_format = "safetensors" the weights are saved in the
+        memory-mappable format described in checkpoint.py, while optimizer
+        and scheduler states go to a training state file that is only kept
+        for the latest checkpoint. If checkpoint_base is set, the weights
+        are saved as a compressed delta against it instead (see delta.py).
+        With async_checkpoints, a cpu snapshot of everything is taken and
+        written on a background thread. Otherwise the tensors are written
+        from the device, copied to cpu one at a time.
 
-        # coref_scores  [n_spans, n_ants]
-        res.coref_scores = torch.cat(a_scores_lst, dim=0)
+        Args:
+            on_saved (Callable[[str], None]): called with the path of the
+                checkpoint once the file is complete
+            resume_point (Dict[str, Any]): the state needed to resume
+                training from this checkpoint, see resume()
 
-        res.coref_y = self._get_ground_truth(
-            cluster_ids, top_indices, (top_rough_scores > float("-inf")))
-        res.word_clusters = self._clusterize(doc, res.coref_scores,
-                                             top_indices)
-        res.span_scores, res.span_y = self.sp.get_training_data(doc, words)
+        Returns:
+            the path of the checkpoint
+        """
+        modules = {key: module.state_dict()
+                   for key, module in self.trainable.items()
+                   if self.config.bert_finetune or key != "bert"}
+        training_state = {key: value.state_dict() for key, value in
+                          (*self.optimizers.items(), *self.schedulers.items())}
+        if resume_point is not None:
+            training_state["resume"] = resume_point
+        if self.config.async_checkpoints:
+            modules = checkpoint.snapshot(modules)
+            training_state = checkpoint.snapshot(training_state)
+
+        path = self._epoch_checkpoint_path()
+        epochs_trained = self.epochs_trained
+        if self.config.checkpoint_format == "torch":
+
+            def write():
+                savedict = {**modules, **training_state,
+                            "epochs_trained": epochs_trained}
+                torch.save(savedict, path)
+        else:
+            base = self.config.checkpoint_base
+            metadata = {"epochs_trained": str(epochs_trained),
+                        "section": self.config.section,
+                        "bert_model": self.config.bert_model}
+
+            def write():
+                checkpoint.save_checkpoint(path, modules, metadata,
+                                           training_state, base)
+
+        def job():
+            write()
+            if on_saved is not None:
+                on_saved(path)
+
+        self._write(job)
+        self.train_logs["checkpoint_paths"].append(path)
+        return path
 
-        if not self.training:
-            res.span_clusters = self.sp.predict(doc, words, res.word_clusters)
-        return res
+    def train_step(self,
+                   doc: Doc,
+                   avg_spans: float,
+                   phase_times: Optional[Dict[str, float]] = None
+                   ) -> Tuple[float, float]:
+        """
+        Does one optimization step on the document.
 
-    def save_weights(self):
-        """ Saves trainable models as state dicts. """
-        to_save: List[Tuple[str, Any]] = \
-            [(key, value) for key, value in self.trainable.items()
-             if self.config.bert_finetune or key != "bert"]
-        to_save.extend(self.optimizers.items())
-        to_save.extend(self.schedulers.items())
-
-        time = datetime.strftime(datetime.now(), "%Y.%m.%d_%H.%M")
-        path = os.path.join(self.config.data_dir,
-                            "model_checkpoints",
-                            f"{self.config.model_name}",
-                            f"{self.config.section}"
-                            f"_e{self.epochs_trained}.pt")
-        savedict = {name: module.state_dict() for name, module in to_save}
-        savedict["epochs_trained"] = self.epochs_trained  # type: ignore
-        torch.save(savedict, path)
-        self.train_logs["checkpoint_paths"].append(path)
+        Args:
+            doc (Doc): the document to train on
+            avg_spans (float): the average number of gold spans per document
+                in the training data, used to normalize the span loss
+            phase_times (Dict[str, float]): if given, the time spent in
+                the forward pass, the backward pass and the optimizer step is
+                added to it under "forward", "backward" and "optimizer"
+
+        Returns:
+            coref loss and span loss
+        """
+        clock = PhaseClock(self.config.device, phase_times)
+
+        for optim in self.optimizers.values():
+            optim.zero_grad()
+
+        res = self.run(doc)
+
+        c_loss = self._coref_criterion(res.coref_scores, res.coref_y)
+        if res.anaphor_logits is not None:
+            c_loss = c_loss + torch.nn.functional.binary_cross_entropy_with_logits(
+                res.anaphor_logits,
+                (doc["tensors"].cluster_ids > 0).to(res.anaphor_logits.dtype))
+        if res.span_y:
+            s_loss = (self._span_criterion(res.span_scores[:, :, 0], res.span_y[0])
+                      + self._span_criterion(res.span_scores[:, :, 1], res.span_y[1])) / avg_spans / 2
+        else:
+            s_loss = torch.zeros_like(c_loss)
+
+        if self._teacher_outputs is not None:
+            c_distill, s_distill = distill.distill_losses(
+                self._teacher_outputs, doc, res,
+                self.config.distill_temperature)
+            c_loss = c_loss + c_distill * self.config.distill_weight
+            s_loss = s_loss + s_distill / avg_spans \
+                * self.config.distill_weight
+
+        del res
+        clock.lap("forward")
+
+        (c_loss + s_loss).backward()
+        clock.lap("backward")
+
+        for optim in self.optimizers.values():
+            optim.step()
+        for scheduler in self.schedulers.values():
+            scheduler.step()
+        clock.lap("optimizer")
+
+        return c_loss.item(), s_loss.item()
 
     def train(self):
         """
@@ -300,62 +666,369 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
         docs_ids = list(range(len(docs)))
         avg_spans = sum(len(doc["head2span"]) for doc in docs) / len(docs)
 
+        if self.config.distill_teacher_section:
+            # Building the teacher must not change the course of training
+            rng_states = _get_rng_states()
+            self._teacher_outputs = distill.TeacherOutputs.load_or_build(self)
+            _set_rng_states(rng_states)
+
         random.shuffle(docs_ids)
         #ADDED
         #insert this, to only use X% (here, X=10) of the data
         #docs_ids = docs_ids[9 * int(len(docs_ids) * 0.1) : 10 * int(len(docs_ids) * 0.1)]
 
-        for epoch in range(self.epochs_trained, self.config.train_epochs):
-            self.training = True
-            running_c_loss = 0.0
-            running_s_loss = 0.0
+        dev_evaluator = None
+        dev_eval_pending = []
+        if self._resume_point is not None:
+            dev_eval_pending = self._resume_point.pop("dev_eval_pending", [])
+        if self.config.async_dev_eval:
+            dev_evaluator = DevEvaluator(self.config_path, self.config,
+                                         self.train_logs["dev_eval"])
+            for epoch, path in dev_eval_pending:
+                dev_evaluator.submit(epoch, path)
+        self._dev_evaluator = dev_evaluator
+
+        try:
+            for epoch in range(self.epochs_trained, self.config.train_epochs):
+                self._train_epoch(epoch, docs, docs_ids, avg_spans)
+                self.epochs_trained += 1
+                path = self._epoch_checkpoint_path()
+                if dev_evaluator is None:
+                    # Evaluated first, so that the resume point holds the
+                    # evaluation approximate ones are compared with
+                    self.evaluate_epoch()
+                    self.train_logs["dev_eval"][-1]["checkpoint_path"] = path
+                    self.save_weights(resume_point=self._get_resume_point(
+                        docs_ids, 0, 0.0, 0.0))
+                else:
+                    # Evaluated once the checkpoint is written
+                    self.save_weights(
+                        on_saved=functools.partial(dev_evaluator.submit,
+                                                   self.epochs_trained),
+                        resume_point=self._get_resume_point(
+                            docs_ids, 0, 0.0, 0.0,
+                            {**dev_evaluator.pending,
+                             self.epochs_trained: path}))
+                    self._merge_dev_eval(dev_evaluator.collect())
+                self._remove_mid_epoch_checkpoint()
+                self._prune_checkpoints()
+            if self._writer is not None:
+                self._writer.wait()
+        except BaseException:
+            if dev_evaluator is not None:
+                dev_evaluator.terminate()
+            raise
+        finally:
+            self._dev_evaluator = None
+        if dev_evaluator is not None:
+            self._merge_dev_eval(dev_evaluator.close())
+            self._prune_checkpoints()
+            if self._writer is not None:
+                self._writer.wait()
+
+    # ========================================================= Private methods
+
+    def _train_epoch(self,
+                     epoch: int,
+                     docs: List[Doc],
+                     docs_ids: List[int],
+                     avg_spans: float):
+        """ Trains the model for one epoch, shuffling docs_ids in place.
+        If the model was restored by resume(), continues from the saved
+        position instead. """
+        self.training = True
+        running_c_loss = 0.0
+        running_s_loss = 0.0
+        start = 0
+        resume_point, self._resume_point = self._resume_point, None
+        if resume_point is not None:
+            docs_ids[:] = resume_point["docs_ids"]
+            start = resume_point["position"]
+            running_c_loss = resume_point["c_loss"]
+            running_s_loss = resume_point["s_loss"]
+            _set_rng_states(resume_point["rng"])
+        if start == 0:
             random.shuffle(docs_ids)
 
-            pbar = tqdm(docs_ids, unit="docs", ncols=0)
-            for doc_id in pbar:
-                doc = docs[doc_id]
+        resume_every = (self.config.resume_every
+                        if self.config.checkpoint_format != "torch" else 0)
+        pbar = tqdm(docs_ids[start:], unit="docs", ncols=0,
+                    initial=start, total=len(docs_ids))
+        for position, doc_id in enumerate(docs_ids[start:], start=start + 1):
+            doc = docs[doc_id]
+
+            c_loss, s_loss = self.train_step(doc, avg_spans)
+            running_c_loss += c_loss
+            running_s_loss += s_loss
+            pbar.update()
+
+            if (resume_every > 0 and position % resume_every == 0
+                    and position < len(docs_ids)):
+                self._save_mid_epoch_checkpoint(self._get_resume_point(
+                    docs_ids, position, running_c_loss, running_s_loss))
+
+            pbar.set_description(
+                f"Epoch {epoch + 1}:"
+                f" {doc['document_id']:26}"
+                f" c_loss: {running_c_loss / position:<.5f}"
+                f" s_loss: {running_s_loss / position:<.5f}"
+            )
+        pbar.close()
+        self.train_logs['training'].append({
+            'epoch' : epoch + 1,
+            'c_loss': running_c_loss  / (len(docs) + 1),
+            's_loss': running_s_loss / (len(docs) + 1)
+            })
+        if self.timer.enabled:
+            self.train_logs['stage_timing'] = self.timer.summary()
+        self.train_logs['memory'] = self.memory.summary()
+
+    def _check_tokenizer(self, metadata: Dict[str, str]):
+        """ Warns if the checkpoint was saved with a different tokenizer """
+        if "tokenizer_vocab_sha1" not in metadata:
+            return
+        identity = bert.tokenizer_identity(self.tokenizer)
+        if any(metadata[key] != value for key, value in identity.items()):
+            print(f"WARNING: the weights were saved with"
+                  f" {metadata.get('bert_model')} tokenizer"
+                  f" {metadata['tokenizer_class']} (vocabulary of"
+                  f" {metadata['tokenizer_vocab_size']}), which differs from"
+                  f" {self.config.bert_model} tokenizer"
+                  f" {identity['tokenizer_class']} (vocabulary of"
+                  f" {identity['tokenizer_vocab_size']})", flush=True)
+
+    def _checkpoint_dir(self) -> str:
+        return os.path.join(self.config.data_dir, "model_checkpoints",
+                            f"{self.config.model_name}")
+
+    def _write(self, job: Callable[[], None]):
+        """ Runs the job writing to the checkpoint directory, on the
+        background thread if async_checkpoints is set """
+        if not self.config.async_checkpoints:
+            job()
+            return
+        if self._writer is None:
+            self._writer = checkpoint.CheckpointWriter()
+        self._writer.submit(job)
+
+    def _get_resume_point(self,
+                          docs_ids: List[int],
+                          position: int,
+                          running_c_loss: float,
+                          running_s_loss: float,
+                          dev_eval_pending: Optional[Dict[int, str]] = None
+                          ) -> Dict[str, Any]:
+        """ Returns the state needed to resume training at the position
+        of the current epoch, see resume(). dev_eval_pending defaults to the
+        checkpoints the dev evaluator has not evaluated yet. """
+        if dev_eval_pending is None and self._dev_evaluator is not None:
+            dev_eval_pending = self._dev_evaluator.pending
+        return {
+            "docs_ids": list(docs_ids),
+            "position": position,
+            "c_loss": running_c_loss,
+            "s_loss": running_s_loss,
+            "rng": _get_rng_states(),
+            # a copy, as the logs keep changing while the checkpoint is saved
+            "train_logs": json.loads(json.dumps(self.train_logs)),
+            # [epoch, checkpoint_path] to submit to the evaluator again
+            "dev_eval_pending": sorted(map(list,
+                                           (dev_eval_pending or {}).items())),
+        }
 
-                for optim in self.optimizers.values():
-                    optim.zero_grad()
+    def _epoch_checkpoint_path(self) -> str:
+        """ Returns the path save_weights() writes the checkpoint of the
+        epochs trained to """
+        if self.config.checkpoint_format == "torch":
+            suffix = ".pt"
+        elif self.config.checkpoint_base:
+            suffix = checkpoint.DELTA_SUFFIX
+        else:
+            suffix = checkpoint.SUFFIX
+        return os.path.join(self._checkpoint_dir(),
+                            f"{self.config.section}_e{self.epochs_trained}"
+                            f"{suffix}")
+
+    def _mid_epoch_checkpoint_path(self) -> str:
+        return os.path.join(self._checkpoint_dir(),
+                            f"{self.config.section}_resume{checkpoint.SUFFIX}")
+
+    def _save_mid_epoch_checkpoint(self, resume_point: Dict[str, Any]):
+        """ Saves a checkpoint to resume training from in the middle of an
+        epoch. It replaces the previous one and is not evaluated. """
+        modules = {key: module.state_dict()
+                   for key, module in self.trainable.items()
+                   if self.config.bert_finetune or key != "bert"}
+        training_state = {key: value.state_dict() for key, value in
+                          (*self.optimizers.items(), *self.schedulers.items())}
+        # Written synchronously, the tensors are copied to cpu one at a time
+        # by save_checkpoint, so that only the writer thread needs a snapshot
+        if self.config.async_checkpoints:
+            modules = checkpoint.snapshot(modules)
+            training_state = checkpoint.snapshot(training_state)
+        training_state["resume"] = resume_point
+        path = self._mid_epoch_checkpoint_path()
+        metadata = {"epochs_trained": str(self.epochs_trained),
+                    "section": self.config.section,
+                    "bert_model": self.config.bert_model}
+        self._write(functools.partial(checkpoint.save_checkpoint, path,
+                                      modules, metadata, training_state))
+
+    def _remove_mid_epoch_checkpoint(self):
+        """ Removes the mid-epoch checkpoint superseded by the checkpoint
+        of the finished epoch """
+        path = self._mid_epoch_checkpoint_path()
+
+        def job():
+            if os.path.exists(path):
+                os.remove(path)
+
+        self._write(job)
+
+    def _prune_checkpoints(self):
+        """ Deletes the checkpoints that are neither among the last
+        keep_checkpoints ones nor the best on the dev data. Only checkpoints
+        already evaluated are considered. """
+        if self.config.keep_checkpoints <= 0:
+            return
+        paths = self.train_logs["checkpoint_paths"]
+        scores = {entry["checkpoint_path"]: entry["sl_f1"]
+                  for entry in self.train_logs["dev_eval"]
+                  if "checkpoint_path" in entry}
+        if not scores:
+            return
+        retained = set(paths[-self.config.keep_checkpoints:])
+        retained.add(max(scores, key=lambda path: scores[path]))
+        deleted = self.train_logs["deleted_checkpoints"]
+        to_delete = [path for path in paths
+                     if path in scores and path not in retained
+                     and path not in deleted]
+        if not to_delete:
+            return
+        deleted.extend(to_delete)
+
+        def job():
+            for path in to_delete:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # Deleting in order with the writes of the checkpoints
+        self._write(job)
+
+    def _a_scoring_batch_size(self, n_words: int, n_ants: int) -> int:
+        """ Returns the fixed a_scoring_batch_size or, if a memory budget
+        for antecedent scoring is set, the largest batch fitting into it """
+        if self.config.a_scoring_memory_budget <= 0:
+            return self.config.a_scoring_batch_size
+        return a_scoring_batch_size(
+            n_words, n_ants,
+            pair_emb=self.a_scorer.in_features,
+            hidden_size=self.config.hidden_size,
+            n_hidden_layers=self.config.n_hidden_layers,
+            budget_mb=self.config.a_scoring_memory_budget)
+
+    def _filter_anaphors(self, doc: Doc, words: torch.Tensor
+                         ) -> Tuple[Optional[torch.Tensor],
+                                    Optional[torch.Tensor]]:
+        """ Returns the logits of the learned anaphor filter (or None) and
+        the sorted ids of the words to score antecedents for (or None for all
+        the words), see anaphor_filter.py """
+        if self.anaphor_filter is not None:
+            logits = self.anaphor_filter(words)
+            if self.training:
+                return logits, None
+            return logits, self.anaphor_filter.candidates(logits)
+        if self.config.anaphor_filter == "pos":
+            mention_ids = pos_candidates(doc, self.config.anaphor_filter_pos)
+            if mention_ids is not None:
+                return None, torch.from_numpy(mention_ids).to(words.device)
+        return None, None
+
+    def _score_antecedents(self,
+                           words: torch.Tensor,
+                           mentions: torch.Tensor,
+                           pw: torch.Tensor,
+                           top_indices: torch.Tensor,
+                           top_rough_scores: torch.Tensor
+                           ) -> Tuple[torch.Tensor, int]:
+        """
+        Scores the candidate antecedents of mentions with a_scorer in batches.
 
-                res = self.run(doc)
+        Args:
+            words (torch.Tensor): [n_words, emb_size], all the words
+            mentions (torch.Tensor): [n_rows, emb_size], the words to score
+                antecedents for
+            pw (torch.Tensor): [n_rows, n_ants, pw_emb]
+            top_indices (torch.Tensor): [n_rows, n_ants], word ids
+            top_rough_scores (torch.Tensor): [n_rows, n_ants]
 
-                c_loss = self._coref_criterion(res.coref_scores, res.coref_y)
-                if res.span_y:
-                    s_loss = (self._span_criterion(res.span_scores[:, :, 0], res.span_y[0])
-                              + self._span_criterion(res.span_scores[:, :, 1], res.span_y[1])) / avg_spans / 2
-                else:
-                    s_loss = torch.zeros_like(c_loss)
+        Returns:
+            coref scores [n_rows, n_ants + 1], dummy first
+            the number of pairs scored
+        """
+        batch_size = self._a_scoring_batch_size(len(mentions),
+                                                top_indices.shape[1])
+        a_scores_lst: List[torch.Tensor] = []
 
-                del res
+        # With adaptive pruning only the kept pairs are scored, and batches
+        # are cut to hold as many pairs as a full batch of rough_k pairs
+        pair_mask = None
+        if self.config.rough_pruning != "fixed" and not self.training:
+            pair_mask = top_rough_scores > float("-inf")
+            batch_bounds = self._packed_batch_bounds(
+                pair_mask.sum(dim=1), batch_size * top_indices.shape[1])
+            n_pairs = int(pair_mask.sum())
+        else:
+            batch_bounds = [(i, i + batch_size)
+                            for i in range(0, len(mentions), batch_size)]
+            n_pairs = top_indices.numel()
+
+        for i, end in batch_bounds:
+            pw_batch = pw[i:end]
+            words_batch = mentions[i:end]
+            top_indices_batch = top_indices[i:end]
+            top_rough_scores_batch = top_rough_scores[i:end]
 
-                (c_loss + s_loss).backward()
-                running_c_loss += c_loss.item()
-                running_s_loss += s_loss.item()
+            # a_scores_batch    [batch_size, n_ants]
+            a_scores_batch = self.a_scorer(
+                all_mentions=words, mentions_batch=words_batch,
+                pw_batch=pw_batch, top_indices_batch=top_indices_batch,
+                top_rough_scores_batch=top_rough_scores_batch,
+                pair_mask_batch=(None if pair_mask is None
+                                 else pair_mask[i:end])
+            )
+            a_scores_lst.append(a_scores_batch)
 
-                del c_loss, s_loss
+        if not a_scores_lst:
+            return utils.add_dummy(top_rough_scores, eps=True), n_pairs
+        return torch.cat(a_scores_lst, dim=0), n_pairs
 
-                for optim in self.optimizers.values():
-                    optim.step()
-                for scheduler in self.schedulers.values():
-                    scheduler.step()
+    @staticmethod
+    def _scatter_rows(tensor: torch.Tensor,
+                      row_ids: torch.Tensor,
+                      n_rows: int,
+                      fill: float) -> torch.Tensor:
+        """ Returns a tensor of n_rows rows filled with fill, except for the
+        rows of row_ids, which are taken from tensor """
+        out = tensor.new_full((n_rows, *tensor.shape[1:]), fill)
+        out[row_ids] = tensor
+        return out
 
-                pbar.set_description(
-                    f"Epoch {epoch + 1}:"
-                    f" {doc['document_id']:26}"
-                    f" c_loss: {running_c_loss / (pbar.n + 1):<.5f}"
-                    f" s_loss: {running_s_loss / (pbar.n + 1):<.5f}"
-                )
-            self.train_logs['training'].append({
-                'epoch' : epoch + 1,
-                'c_loss': running_c_loss  / (len(docs) + 1),
-                's_loss': running_s_loss / (len(docs) + 1)
-                })
-
-            self.epochs_trained += 1
-            self.save_weights()
-            self.evaluate()
-    # ========================================================= Private methods
+    @staticmethod
+    def _packed_batch_bounds(pairs_per_word: torch.Tensor,
+                             max_pairs: int) -> List[Tuple[int, int]]:
+        """ Splits words into consecutive batches of at most max_pairs pairs
+        (or of one word, if it has more) """
+        ends = pairs_per_word.cumsum(dim=0).tolist()
+        bounds = []
+        start, offset = 0, 0
+        while start < len(ends):
+            end = bisect.bisect_right(ends, offset + max_pairs, lo=start)
+            end = max(end, start + 1)
+            bounds.append((start, end))
+            offset = ends[end - 1]
+            start = end
+        return bounds
 
     def _bertify(self, doc: Doc) -> torch.Tensor:
         subwords_batches = bert.get_subwords_batches(doc, self.config,
@@ -403,13 +1076,21 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
             "sp": self.sp
         }
 
+        self.anaphor_filter: Optional[AnaphorFilter] = None
+        if self.config.anaphor_filter == "learned":
+            self.anaphor_filter = AnaphorFilter(bert_emb, self.config).to(self.config.device)
+            self.trainable["anaphor_filter"] = self.anaphor_filter
+        elif self.config.anaphor_filter not in ("none", "pos"):
+            raise ValueError(f"Unknown anaphor_filter:"
+                             f" {self.config.anaphor_filter}")
+
     def _build_optimizers(self):
 
         n_docs = len(self._get_docs(self.config.train_data))
 
-        self.optimizers: Dict[str, torch.optim.Optimizer] = {}
+        self.optimizers = {}
 
-        self.schedulers: Dict[str, torch.optim.lr_scheduler.LambdaLR] = {}
+        self.schedulers = {}
 
 
 
@@ -423,9 +1104,29 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
 
         if self.config.bert_finetune:
 
-            self.optimizers["bert_optimizer"] = torch.optim.Adam(
-
-                self.bert.parameters(), lr=self.config.bert_learning_rate
+            bert_params = list(self.bert.parameters())
+            embeddings = self.bert.get_input_embeddings()
+            if self.config.bert_embedding_updates != "dense":
+                bert_params = [param for param in bert_params
+                               if param is not embeddings.weight]
+            if self.config.bert_embedding_updates == "frozen":
+                embeddings.weight.requires_grad = False
+            elif self.config.bert_embedding_updates == "sparse":
+                embeddings.sparse = True
+                self.optimizers["embedding_optimizer"] = SparseRowAdam(
+                    [embeddings.weight], lr=self.config.bert_learning_rate)
+                self.schedulers["embedding_scheduler"] = \
+                    transformers.get_linear_schedule_with_warmup(
+                        self.optimizers["embedding_optimizer"],
+                        n_docs, n_docs * self.config.train_epochs)
+            elif self.config.bert_embedding_updates != "dense":
+                raise ValueError(f"Unknown bert_embedding_updates:"
+                                 f" {self.config.bert_embedding_updates}")
+
+            self.optimizers["bert_optimizer"] = build_optimizer(
+
+                self.config.bert_optimizer, bert_params,
+                lr=self.config.bert_learning_rate
 
             )
 
@@ -458,9 +1159,10 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
 
 
 
-        self.optimizers["general_optimizer"] = torch.optim.Adam(
+        self.optimizers["general_optimizer"] = build_optimizer(
 
-            params, lr=self.config.learning_rate)
+            self.config.general_optimizer, params,
+            lr=self.config.learning_rate)
 
         self.schedulers["general_scheduler"] = \
             transformers.get_linear_schedule_with_warmup(
@@ -471,13 +1173,19 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
 
             )
 
-    def _clusterize(self, doc: Doc, scores: torch.Tensor, top_indices: torch.Tensor):
-        antecedents = scores.argmax(dim=1) - 1
+    def _clusterize(self, doc: Doc, scores: torch.Tensor, top_indices: torch.Tensor,
+                    fixed_antecedents: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
+        antecedents = self.antecedents(scores, top_indices)
+        if fixed_antecedents is not None:
+            fixed, fixed_values = fixed_antecedents
+            antecedents = torch.where(fixed.to(antecedents.device),
+                                      fixed_values.to(antecedents.device),
+                                      antecedents)
         not_dummy = antecedents >= 0
-        coref_span_heads = torch.arange(0, len(scores))[not_dummy]
-        antecedents = top_indices[coref_span_heads, antecedents[not_dummy]]
+        coref_span_heads = torch.arange(0, len(scores))[not_dummy.cpu()]
+        antecedents = antecedents[not_dummy]
 
-        nodes = [GraphNode(i) for i in range(len(doc["cased_words"]))]
+        nodes = [GraphNode(i) for i in range(doc["tensors"].n_words)]
         for i, j in zip(coref_span_heads.tolist(), antecedents.tolist()):
             nodes[i].link(nodes[j])
             assert nodes[i] is not nodes[j]
@@ -496,19 +1204,46 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
                 clusters.append(sorted(cluster))
         return sorted(clusters)
 
+    @staticmethod
+    def antecedents(scores: torch.Tensor,
+                    top_indices: torch.Tensor) -> torch.Tensor:
+        """ Returns the best antecedent of every word, [n_words], -1 where
+        the dummy is the best """
+        best = scores.argmax(dim=1) - 1
+        if not top_indices.shape[1]:
+            return best
+        return torch.where(best >= 0,
+                           top_indices.gather(1, best.clamp(min=0)[:, None])[:, 0],
+                           torch.full_like(best, -1))
+
+    def _merge_dev_eval(self, results: List[Dict[str, Any]]):
+        """ Adds the results of asynchronous dev evaluations to train_logs,
+        keeping train_logs["dev_eval"] in the order of the checkpoints """
+        for result in results:
+            print(f"dev (epoch {result['epoch']}):"
+                  f" | WL: f1: {result['wl_f1']:.5f}"
+                  f" | SL: sa: {result['sl_sa']:.5f}, f1: {result['sl_f1']:.5f}")
+        dev_eval = self.train_logs["dev_eval"] + results
+        dev_eval.sort(key=lambda result: result["epoch"])
+        self.train_logs["dev_eval"] = dev_eval
+
     def _get_docs(self, path: str) -> List[Doc]:
-        if path not in self._docs:
+        docs = self._docs.get(path)
+        if docs is None:
             basename = os.path.basename(path)
             model_name = self.config.bert_model.replace("/", "_")
-            cache_filename = f"{model_name}_{basename}.pickle"
-            if os.path.exists(cache_filename):
-                with open(cache_filename, mode="rb") as cache_f:
-                    self._docs[path] = pickle.load(cache_f)
-            else:
-                self._docs[path] = self._tokenize_docs(os.path.join(self.config.data_dir, path))
-                with open(cache_filename, mode="wb") as cache_f:
-                    pickle.dump(self._docs[path], cache_f)
-        return self._docs[path]
+            # {cache_filename} and {cache_filename}.npy, see document.py
+            cache_filename = f"{model_name}_{basename}.v{CACHE_VERSION}.docs"
+            if not os.path.exists(cache_filename):
+                save_documents(
+                    self._tokenize_docs(os.path.join(self.config.data_dir, path)),
+                    cache_filename)
+            docs = load_documents(cache_filename)
+            # Static tensors are cached on cpu and moved to the device once
+            for doc in docs:
+                doc.tensors = doc.tensors.to(self.config.device)
+            self._docs.put(path, docs)
+        return docs
 
     @staticmethod
     def _get_ground_truth(cluster_ids: torch.Tensor,
@@ -547,21 +1282,53 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
             raise ValueError(f"Unexpected config keys: {unknown_keys}")
         return Config(section, **{**default_section, **current_section})
 
+    def _read_checkpoint(self,
+                         path: str,
+                         map_location: Optional[str]) -> Dict[str, Any]:
+        if map_location is None:
+            map_location = self.config.device
+        print(f"Loading from {path}...")
+        if path.endswith((checkpoint.SUFFIX, checkpoint.DELTA_SUFFIX)):
+            return checkpoint.load_checkpoint(path)
+        return torch.load(path, map_location=map_location)
+
+    def _load_state_dicts(self,
+                          state_dicts: Dict[str, Any],
+                          ignore: Optional[Set[str]] = None):
+        self.epochs_trained = state_dicts.pop("epochs_trained", 0)
+        self._check_tokenizer(state_dicts.pop("metadata", {}))
+        for key, state_dict in state_dicts.items():
+            if not ignore or key not in ignore:
+                if key.endswith("_optimizer"):
+                    # Models built without optimizers skip training state
+                    if not self.optimizers:
+                        continue
+                    self.optimizers[key].load_state_dict(state_dict)
+                elif key.endswith("_scheduler"):
+                    if not self.schedulers:
+                        continue
+                    self.schedulers[key].load_state_dict(state_dict)
+                else:
+                    self.trainable[key].load_state_dict(state_dict)
+                print(f"Loaded {key}")
+
     def _set_training(self, value: bool):
         self._training = value
         for module in self.trainable.values():
             module.train(self._training)
 
-    def _tokenize_docs(self, path: str) -> List[Doc]:
+    def _tokenize_docs(self, path: str) -> List[Document]:
         print(f"Tokenizing documents at {path}...", flush=True)
-        out: List[Doc] = []
-        filter_func = TOKENIZER_FILTERS.get(self.config.bert_model,
-                                            lambda _: True)
-        token_map = TOKENIZER_MAPS.get(self.config.bert_model, {})
+        out: List[Document] = []
+        vocab = Vocab()
+        tokenizer_name = bert.tokenizer_name(self.config)
+        filter_func = TOKENIZER_FILTERS.get(tokenizer_name, lambda _: True)
+        token_map = TOKENIZER_MAPS.get(tokenizer_name, {})
         with jsonlines.open(path, mode="r") as data_f:
             for doc in data_f:
                 doc["span_clusters"] = [[tuple(mention) for mention in cluster]
                                    for cluster in doc["span_clusters"]]
+                doc["head2span"] = [tuple(span) for span in doc["head2span"]]
                 word2subword = []
                 subwords = []
                 word_id = []
@@ -575,7 +1342,37 @@ class CorefModel:  # pylint: disable=too-many-instance-attributes
                     word_id.extend([i] * len(tokenized_word))
                 doc["word2subword"] = word2subword
                 doc["subwords"] = subwords
+                doc["subword_ids"] = self.tokenizer.convert_tokens_to_ids(subwords)
                 doc["word_id"] = word_id
-                out.append(doc)
+                document = Document.from_dict(doc, vocab)
+                document.tensors = build_doc_tensors(document)
+                out.append(document)
         print("Tokenization OK", flush=True)
         return out
+
+
+def _get_rng_states() -> Dict[str, Any]:
+    """ Returns the states of all the random number generators used in
+    training as plain python objects and tensors """
+    np_state = np.random.get_state()
+    states = {
+        "python": random.getstate(),
+        "numpy": (np_state[0], np_state[1].tolist(), *np_state[2:]),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def _set_rng_states(states: Dict[str, Any]):
+    """ Restores the states returned by _get_rng_states() """
+    python_state = states["python"]
+    random.setstate((python_state[0], tuple(python_state[1]),
+                     python_state[2]))
+    np_state = states["numpy"]
+    np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32),
+                         *np_state[2:]))
+    torch.set_rng_state(states["torch"].cpu())
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in states["cuda"]])
@@ -0,0 +1,156 @@
+""" Describes the delta checkpoint format.
+
+Models fine-tuned from the same starting point share most of their bytes
+with it. A delta checkpoint stores every tensor relative to a base
+checkpoint in the safetensors layout (see checkpoint.py):
+    same    the tensor is identical to the base one, nothing is stored
+    xor     the bitwise xor with the base tensor, zlib-compressed. Small
+            changes of floating point numbers leave the sign, the exponent
+            and the high bits of the mantissa unchanged, so the xor is mostly
+            zeros. Bytes are grouped by significance before compression
+    raw     tensors missing from the base or of a different shape/dtype,
+            zlib-compressed
+The layout mirrors the safetensors one (8-byte header length, json header,
+data), with an "encoding" for every tensor and the base path and
+fingerprint in the metadata.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import struct
+from typing import Any, Dict, Optional, Tuple
+import zlib
+
+import numpy as np      # type: ignore
+import torch
+
+from coref.checkpoint import DTYPES, NUMPY_DTYPES, load_tensors
+
+
+_UINTS = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+def save_delta(path: str,
+               tensors: Dict[str, torch.Tensor],
+               base_path: str,
+               metadata: Optional[Dict[str, str]] = None,
+               level: int = 6):
+    """ Saves tensors to path as a delta against the base checkpoint """
+    base, _ = load_tensors(base_path)
+    header: Dict[str, Any] = {"__metadata__": {
+        **{key: str(value) for key, value in (metadata or {}).items()},
+        "base": base_path,
+        "base_fingerprint": fingerprint(base_path),
+    }}
+    blobs = []
+    offset = 0
+    for name, tensor in tensors.items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        base_tensor = base.get(name)
+        if (base_tensor is not None and base_tensor.dtype == tensor.dtype
+                and base_tensor.shape == tensor.shape):
+            bits = _bits(array) ^ _bits(base_tensor.numpy())
+            if not bits.any():
+                encoding, blob = "same", b""
+            else:
+                encoding, blob = "xor", zlib.compress(_shuffle(bits), level)
+        else:
+            encoding = "raw"
+            blob = zlib.compress(_shuffle(_bits(array)), level)
+        header[name] = {"dtype": DTYPES[tensor.dtype][0],
+                        "shape": list(tensor.shape),
+                        "encoding": encoding,
+                        "data_offsets": [offset, offset + len(blob)]}
+        blobs.append(blob)
+        offset += len(blob)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode="wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def load_delta(path: str,
+               base_path: Optional[str] = None
+               ) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """ Reconstructs the tensors of a delta checkpoint. Tensors equal to
+    the base ones are views of the memory-mapped base.
+
+    Args:
+        path (str): the delta checkpoint
+        base_path (str): overrides the base path stored in the checkpoint.
+            If neither exists, a file with the same name as the base is
+            looked for next to the delta checkpoint.
+    """
+    with open(path, mode="rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        data = f.read()
+    metadata = header.pop("__metadata__")
+
+    if base_path is None:
+        base_path = metadata["base"]
+        if not os.path.exists(base_path):
+            base_path = os.path.join(os.path.dirname(path),
+                                     os.path.basename(base_path))
+    if fingerprint(base_path) != metadata["base_fingerprint"]:
+        raise ValueError(f"{base_path} is not the base {path} was saved"
+                         f" against")
+    base, _ = load_tensors(base_path)
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = NUMPY_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if info["encoding"] == "same":
+            tensors[name] = base[name]
+            continue
+        bits = _unshuffle(zlib.decompress(data[start:end]),
+                          np.dtype(dtype).itemsize)
+        if info["encoding"] == "xor":
+            bits ^= _bits(base[name].numpy()).reshape(-1)
+        array = bits.view(dtype).reshape(info["shape"])
+        tensors[name] = torch.from_numpy(array)
+    return tensors, metadata
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_fingerprint(path: str, size: int, mtime: float) -> str:
+    # pylint: disable=unused-argument
+    sha = hashlib.sha1()
+    with open(path, mode="rb") as f:
+        for chunk in iter(functools.partial(f.read, 2 ** 24), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def fingerprint(path: str) -> str:
+    """ Returns the sha1 of the file, cached while it is not modified """
+    stat = os.stat(path)
+    return _cached_fingerprint(os.path.abspath(path), stat.st_size,
+                               stat.st_mtime)
+
+
+def _bits(array: np.ndarray) -> np.ndarray:
+    """ Returns the array reinterpreted as unsigned integers """
+    return array.view(_UINTS[array.dtype.itemsize])
+
+
+def _shuffle(bits: np.ndarray) -> bytes:
+    """ Groups the bytes by their position in the element, so that
+    the (mostly unchanged) high bytes end up next to each other """
+    itemsize = bits.dtype.itemsize
+    return bits.reshape(-1).view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data: bytes, itemsize: int) -> np.ndarray:
+    """ Reverses _shuffle, returning a flat array of unsigned integers """
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return planes.T.copy().view(_UINTS[itemsize]).reshape(-1)
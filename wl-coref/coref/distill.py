@@ -0,0 +1,216 @@
+""" Contains knowledge distillation from a teacher CorefModel.
+
+If distill_teacher_section is set, a model (the student, usually with a
+smaller encoder) is trained on the outputs of a trained teacher model in
+addition to the gold labels. The teacher is run once over the training
+documents and its outputs are cached to disk in the tensors format of
+checkpoint.py, in data_dir/distill_cache:
+    {doc_key}.ant_indices   [n_words, k] int32, the teacher's candidate
+                            antecedents (top_indices)
+    {doc_key}.ant_logits    [n_words, k + 1] float16, their scores, dummy
+                            first (coref_scores)
+    {doc_key}.span_logits   [n_heads, max_sent_len, 2] float16, the start and
+                            end scores for the gold heads (span_scores, over
+                            the words of the sentence of each head)
+
+The candidate antecedents of the student differ from those of the teacher,
+so the teacher distribution is projected onto the student candidates and
+renormalized. The losses are KL divergences from the teacher
+distributions softened by distill_temperature, scaled by its square
+(Hinton et al., 2015).
+"""
+
+import os
+from typing import Dict, Tuple
+
+import torch
+from tqdm import tqdm
+
+from coref import checkpoint
+from coref.const import CorefResult, Doc
+
+
+def doc_key(doc: Doc) -> str:
+    """ Identifies a document in the cache """
+    return f"{doc['document_id']}/{doc['part_id']}"
+
+
+def cache_path(config) -> str:
+    """ Returns the path of the teacher outputs cache for the training data
+    of the student config """
+    weights = os.path.splitext(
+        os.path.basename(config.distill_teacher_weights))[0]
+    data = os.path.splitext(os.path.basename(config.train_data))[0]
+    return os.path.join(config.data_dir, "distill_cache",
+                        f"{config.distill_teacher_section}_{weights}_{data}"
+                        f"{checkpoint.SUFFIX}")
+
+
+# Bump whenever the format of the cached outputs changes
+CACHE_FORMAT = "2"
+
+
+def cache_metadata(config) -> Dict[str, str]:
+    """ Describes the teacher, so that a stale cache is not used """
+    stat = os.stat(config.distill_teacher_weights)
+    return {"format": CACHE_FORMAT,
+            "teacher_section": config.distill_teacher_section,
+            "teacher_weights": os.path.abspath(config.distill_teacher_weights),
+            "teacher_weights_size": str(stat.st_size),
+            "teacher_weights_mtime": str(stat.st_mtime),
+            "train_data": config.train_data}
+
+
+class TeacherOutputs:
+    """ Gives the cached teacher outputs of training documents """
+
+    def __init__(self, path: str, device: str):
+        self._tensors, self.metadata = checkpoint.load_tensors(path)
+        self._device = device
+
+    def get(self, doc: Doc) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """ Returns the antecedent indices, antecedent logits and span logits
+        of the teacher for the document """
+        key = doc_key(doc)
+        if f"{key}.ant_indices" not in self._tensors:
+            raise KeyError(f"No teacher outputs for {key}, delete the cache"
+                           f" to rebuild it")
+        return (self._tensors[f"{key}.ant_indices"].to(self._device).long(),
+                self._tensors[f"{key}.ant_logits"].to(self._device).float(),
+                self._tensors[f"{key}.span_logits"].to(self._device).float())
+
+    @classmethod
+    def load_or_build(cls, student) -> "TeacherOutputs":
+        """ Loads the cached outputs of the teacher of the student
+        (a CorefModel), running the teacher if the cache is missing or was
+        built by a different teacher """
+        config = student.config
+        path = cache_path(config)
+        metadata = cache_metadata(config)
+        if os.path.exists(path):
+            outputs = cls(path, config.device)
+            if all(outputs.metadata.get(key) == value
+                   for key, value in metadata.items()):
+                return outputs
+            print(f"{path} was built by another teacher or format, rebuilding it")
+        build_cache(student, path, metadata)
+        return cls(path, config.device)
+
+
+def build_cache(student, path: str, metadata: Dict[str, str]):
+    """ Runs the teacher over the training documents of the student and
+    writes its outputs to path """
+    # pylint: disable=import-outside-toplevel,protected-access
+    from coref.coref_model import CorefModel
+    config = student.config
+    teacher = CorefModel(
+        student.config_path, config.distill_teacher_section,
+        build_optimizers=False,
+        config_overrides={"train_data": config.train_data,
+                          "device": config.device,
+                          "data_dir": config.data_dir})
+    teacher.load_weights(config.distill_teacher_weights,
+                         map_location=config.device,
+                         ignore=checkpoint.TRAINING_STATE_KEYS)
+    teacher.training = False
+
+    tensors: Dict[str, torch.Tensor] = {}
+    with torch.no_grad():
+        for doc in tqdm(teacher._get_docs(config.train_data),
+                        desc="Teacher outputs", unit="docs"):
+            res = teacher.run(doc)
+            key = doc_key(doc)
+            tensors[f"{key}.ant_indices"] = \
+                res.top_indices.to(torch.int32).cpu()
+            tensors[f"{key}.ant_logits"] = \
+                res.coref_scores.clamp(-6e4, 6e4).to(torch.float16).cpu()
+            tensors[f"{key}.span_logits"] = \
+                res.span_scores.clamp(-6e4, 6e4).to(torch.float16).cpu()
+    del teacher
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    checkpoint.save_tensors(path, tensors, metadata)
+    print(f"Teacher outputs written to {path}")
+
+
+def coref_loss(student_scores: torch.Tensor,
+               student_indices: torch.Tensor,
+               teacher_logits: torch.Tensor,
+               teacher_indices: torch.Tensor,
+               temperature: float) -> torch.Tensor:
+    """
+    KL divergence of the student antecedent distribution from the teacher
+    one, both softened by the temperature.
+
+    Args:
+        student_scores: [n_words, k_s + 1], dummy first
+        student_indices: [n_words, k_s], candidate antecedents of the student
+        teacher_logits: [n_words, k_t + 1], dummy first
+        teacher_indices: [n_words, k_t], candidate antecedents of the teacher
+
+    Returns:
+        the loss averaged over words
+    """
+    teacher_probs = torch.softmax(teacher_logits / temperature, dim=1)
+    # The probability of every student candidate under the teacher,
+    # zero for candidates the teacher did not consider
+    same = student_indices.unsqueeze(2) == teacher_indices.unsqueeze(1)
+    candidate_probs = (same * teacher_probs[:, None, 1:]).sum(dim=2)
+    target = torch.cat((teacher_probs[:, :1], candidate_probs), dim=1)
+    target = target * torch.isfinite(student_scores)
+    target = target / target.sum(dim=1, keepdim=True).clamp(min=1e-20)
+    return _kl_divergence(student_scores / temperature, target, dim=1).mean() \
+        * temperature ** 2
+
+
+def span_loss(student_scores: torch.Tensor,
+              teacher_logits: torch.Tensor,
+              temperature: float) -> torch.Tensor:
+    """
+    KL divergence of the student start and end distributions from the
+    teacher ones, both softened by the temperature.
+
+    Args:
+        student_scores: [n_heads, max_sent_len, 2]
+        teacher_logits: [n_heads, max_sent_len, 2]
+
+    Returns:
+        the loss summed over heads and averaged over start and end, as the
+        gold span loss
+    """
+    target = torch.softmax(teacher_logits / temperature, dim=1) \
+        * torch.isfinite(student_scores)
+    target = target / target.sum(dim=1, keepdim=True).clamp(min=1e-20)
+    return _kl_divergence(student_scores / temperature, target, dim=1).sum() \
+        / 2 * temperature ** 2
+
+
+def _kl_divergence(logits: torch.Tensor,
+                   target: torch.Tensor,
+                   dim: int) -> torch.Tensor:
+    """ KL divergence of the distribution of logits from the target
+    probabilities. Positions with zero target probability do not contribute,
+    even if their logit is -inf. """
+    log_probs = torch.log_softmax(logits, dim=dim)
+    present = target > 0
+    terms = target * (torch.log(torch.where(present, target,
+                                            torch.ones_like(target)))
+                      - log_probs)
+    return torch.where(present, terms, torch.zeros_like(terms)).sum(dim=dim)
+
+
+def distill_losses(outputs: TeacherOutputs,
+                   doc: Doc,
+                   res: CorefResult,
+                   temperature: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Returns the coreference and span distillation losses of the student
+    result res for the document """
+    teacher_indices, teacher_ant_logits, teacher_span_logits = \
+        outputs.get(doc)
+    c_loss = coref_loss(res.coref_scores, res.top_indices,
+                        teacher_ant_logits, teacher_indices, temperature)
+    if res.span_scores is not None and len(res.span_scores):
+        s_loss = span_loss(res.span_scores, teacher_span_logits, temperature)
+    else:
+        s_loss = torch.zeros_like(c_loss)
+    return c_loss, s_loss
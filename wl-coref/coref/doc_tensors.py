@@ -0,0 +1,80 @@
+""" Describes DocTensors, a bundle of static per-document tensors.
+
+Everything stored here only depends on the document itself, so it is
+computed once when the documents are loaded, cached together with the
+tokenized documents and reused across epochs and evaluations.
+"""
+
+from dataclasses import dataclass, fields
+
+import torch
+
+from coref.const import Doc
+
+
+@dataclass
+class DocTensors:
+    """ Contains tensors used by the model's submodules. """
+    word2subword: torch.Tensor  # [n_words, 2], subword start/end of words
+    cluster_ids: torch.Tensor   # [n_words], zero for non-coreferent words
+    speaker_ids: torch.Tensor   # [n_words]
+    sent_ids: torch.Tensor      # [n_words]
+    sent_bounds: torch.Tensor   # [n_words, 2], word start/end of sentences
+    head2span: torch.Tensor     # [n_heads, 3], (head, start, end), sorted
+
+    @property
+    def n_words(self) -> int:
+        """ The number of words in the document """
+        return len(self.sent_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """ The total size of the tensors in bytes """
+        return sum(getattr(self, field.name).element_size()
+                   * getattr(self, field.name).nelement()
+                   for field in fields(self))
+
+    def to(self, device: torch.device) -> "DocTensors":
+        """ Returns a copy of the bundle with all tensors moved to device """
+        return DocTensors(**{field.name: getattr(self, field.name).to(device)
+                             for field in fields(self)})
+
+
+def build_doc_tensors(doc: Doc) -> DocTensors:
+    """
+    Builds static tensors for a tokenized document. The tensors are
+    created on cpu, use DocTensors.to() to move them to another device.
+    """
+    n_words = len(doc["cased_words"])
+
+    word2cluster = {word_i: i
+                    for i, cluster in enumerate(doc["word_clusters"], start=1)
+                    for word_i in cluster}
+    cluster_ids = [word2cluster.get(word_i, 0) for word_i in range(n_words)]
+
+    # speaker string -> speaker id
+    str2int = {s: i for i, s in enumerate(set(doc["speaker"]))}
+    speaker_ids = [str2int[s] for s in doc["speaker"]]
+
+    head2span = sorted(tuple(span) for span in doc["head2span"])
+
+    # the first and past-the-last word of the sentence of every word,
+    # sentences being runs of words with the same sent_id
+    sent_id = list(doc["sent_id"])
+    sent_bounds = []
+    start = 0
+    for end in range(1, n_words + 1):
+        if end == n_words or sent_id[end] != sent_id[start]:
+            sent_bounds.extend([(start, end)] * (end - start))
+            start = end
+
+    return DocTensors(
+        word2subword=torch.tensor(doc["word2subword"],
+                                  dtype=torch.long).view(n_words, 2),
+        cluster_ids=torch.tensor(cluster_ids, dtype=torch.long),
+        speaker_ids=torch.tensor(speaker_ids, dtype=torch.long),
+        sent_ids=torch.tensor(doc["sent_id"], dtype=torch.long),
+        sent_bounds=torch.tensor(sent_bounds,
+                                 dtype=torch.long).view(n_words, 2),
+        head2span=torch.tensor(head2span, dtype=torch.long).view(-1, 3),
+    )
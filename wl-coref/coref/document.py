@@ -0,0 +1,223 @@
+""" Describes Document, a compact array-backed replacement for Doc dicts.
+
+Word-level strings are interned in a Vocab shared by all the documents of a
+corpus and stored as int32 arrays of string ids, integer fields are stored
+as int32 arrays. Fields that are not used by the model (pos, postag, deprel,
+head) are kept compressed and only decoded when accessed.
+
+Document supports the dict-like access used throughout the code base,
+so doc["cased_words"] or doc["sent_id"][i] keep working.
+
+save_documents/load_documents write the arrays of all documents into one
+flat .npy file next to a pickle with the rest of the data. The flat file is
+memory-mapped on loading, so the arrays are paged in from disk on demand.
+"""
+
+import json
+import pickle
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import zlib
+
+import numpy as np      # type: ignore
+
+from coref.const import Doc
+
+
+class Vocab:
+    """ Maps strings to int32 ids and back. Shared across the documents
+    of a corpus, so that every distinct string is stored only once. """
+    __slots__ = ("_str2id", "_id2str")
+
+    def __init__(self):
+        self._str2id: Dict[str, int] = {}
+        self._id2str: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._id2str)
+
+    def encode(self, strings: Iterable[str]) -> np.ndarray:
+        """ Returns an int32 array of ids, adding unknown strings """
+        ids = []
+        for string in strings:
+            string_id = self._str2id.get(string)
+            if string_id is None:
+                string_id = len(self._id2str)
+                self._str2id[string] = string_id
+                self._id2str.append(string)
+            ids.append(string_id)
+        return np.array(ids, dtype=np.int32)
+
+    def decode(self, ids: np.ndarray) -> List[str]:
+        """ Returns a list of strings for the ids given """
+        id2str = self._id2str
+        return [id2str[i] for i in ids.tolist()]
+
+    def __getstate__(self):
+        return self._id2str
+
+    def __setstate__(self, state: List[str]):
+        self._id2str = state
+        self._str2id = {s: i for i, s in enumerate(state)}
+
+
+class Document:  # pylint: disable=too-many-instance-attributes
+    """ Array-backed document with a dict-compatible accessor. """
+    # Word-level string fields stored as ids in the shared vocabulary
+    STRING_FIELDS = ("cased_words", "speaker", "subwords")
+    # Integer fields stored as int32 arrays
+    ARRAY_FIELDS = ("sent_id", "word_id", "subword_ids", "word2subword")
+    # Fields not used by the model, decoded on access
+    LAZY_FIELDS = ("pos", "postag", "deprel", "head")
+
+    __slots__ = ("document_id", "part_id",
+                 "word_clusters", "span_clusters", "head2span",
+                 "tensors", "_vocab", "_arrays", "_lazy", "_extra")
+
+    def __init__(self, vocab: Vocab):
+        self.document_id: str = ""
+        self.part_id: Any = 0
+        self.word_clusters: List[List[int]] = []
+        self.span_clusters: List[List[tuple]] = []
+        self.head2span: List[tuple] = []
+        self.tensors: Any = None
+        self._vocab = vocab
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._lazy: Dict[str, bytes] = {}
+        self._extra: Dict[str, Any] = {}
+
+    @classmethod
+    def from_dict(cls, doc: Doc, vocab: Vocab) -> "Document":
+        """ Creates a Document out of a Doc dict. """
+        document = cls(vocab)
+        for key, value in doc.items():
+            document[key] = value
+        return document
+
+    def to_dict(self) -> Doc:
+        """ Returns the document as a plain Doc dict """
+        return {key: self[key] for key in self.keys()}
+
+    def keys(self) -> List[str]:
+        """ Returns the names of all the fields present """
+        keys = ["document_id", "part_id",
+                "word_clusters", "span_clusters", "head2span"]
+        keys.extend(self._arrays)
+        keys.extend(self._lazy)
+        if self.tensors is not None:
+            keys.append("tensors")
+        keys.extend(self._extra)
+        return keys
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        """ Same as dict.get """
+        return self[key] if key in self else default
+
+    @property
+    def n_words(self) -> int:
+        """ The number of words in the document """
+        return len(self._arrays["cased_words"])
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """ Returns the approximate (resident, memory-mapped) size of the
+        document in bytes. The shared vocabulary and python objects such as
+        cluster lists are not accounted for. """
+        resident, mapped = 0, 0
+        for array in self._arrays.values():
+            if isinstance(array, np.memmap):
+                mapped += array.nbytes
+            else:
+                resident += array.nbytes
+        resident += sum(len(blob) for blob in self._lazy.values())
+        if self.tensors is not None:
+            resident += self.tensors.nbytes
+        return resident, mapped
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._arrays:
+            if key in Document.STRING_FIELDS:
+                return self._vocab.decode(self._arrays[key])
+            return self._arrays[key]
+        if key in self._lazy:
+            return json.loads(zlib.decompress(self._lazy[key]))
+        if key in self._extra:
+            return self._extra[key]
+        if key in Document.__slots__ and not key.startswith("_"):
+            if key == "tensors" and self.tensors is None:
+                raise KeyError(key)
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in Document.STRING_FIELDS:
+            self._arrays[key] = self._vocab.encode(value)
+        elif key in Document.ARRAY_FIELDS:
+            self._arrays[key] = np.asarray(value, dtype=np.int32)
+        elif key in Document.LAZY_FIELDS:
+            self._lazy[key] = zlib.compress(json.dumps(value).encode("utf8"))
+        elif key in Document.__slots__ and not key.startswith("_"):
+            setattr(self, key, value)
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key: str):
+        for storage in (self._arrays, self._lazy, self._extra):
+            if key in storage:
+                del storage[key]
+                return
+        if key == "tensors":
+            self.tensors = None
+            return
+        raise KeyError(key)
+
+    def __getstate__(self):
+        return {key: getattr(self, key) for key in Document.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+def save_documents(docs: List[Document], path: str):
+    """ Saves documents to path (a pickle) and path + ".npy" (the arrays) """
+    chunks: List[np.ndarray] = []
+    specs: List[Dict[str, Tuple[int, Tuple[int, ...]]]] = []
+    offset = 0
+    for doc in docs:
+        doc_specs = {}
+        for key, array in doc._arrays.items():  # pylint: disable=protected-access
+            doc_specs[key] = (offset, array.shape)
+            chunks.append(array.ravel())
+            offset += array.size
+        specs.append(doc_specs)
+    flat = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    np.save(f"{path}.npy", flat.astype(np.int32, copy=False))
+
+    arrays = [doc._arrays for doc in docs]  # pylint: disable=protected-access
+    try:
+        for doc in docs:
+            doc._arrays = {}  # pylint: disable=protected-access
+        with open(path, mode="wb") as f:
+            pickle.dump((docs, specs), f)
+    finally:
+        for doc, doc_arrays in zip(docs, arrays):
+            doc._arrays = doc_arrays  # pylint: disable=protected-access
+
+
+def load_documents(path: str, mmap: bool = True) -> List[Document]:
+    """ Loads documents saved with save_documents. If mmap is True,
+    the arrays are views of the memory-mapped .npy file. """
+    flat = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+    with open(path, mode="rb") as f:
+        docs, specs = pickle.load(f)
+    for doc, doc_specs in zip(docs, specs):
+        doc._arrays = {  # pylint: disable=protected-access
+            key: flat[offset:offset + int(np.prod(shape))].reshape(shape)
+            for key, (offset, shape) in doc_specs.items()
+        }
+    return docs
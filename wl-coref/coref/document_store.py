@@ -0,0 +1,106 @@
+""" Describes DocumentStore, a bounded LRU cache of loaded data splits.
+
+CorefModel used to keep every split it had ever loaded for the whole life
+of the process. The store keeps track of the approximate size of each split
+and evicts the least recently used splits once the memory budget is
+exceeded. Evicted splits are reopened from the memory-mapped tokenized
+cache the next time they are requested.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from coref.document import Document
+
+
+class DocumentStore:
+    """ Keeps loaded splits under a memory budget, evicting the least
+    recently used ones first.
+
+    Usage:
+        store = DocumentStore(budget_mb=2048)
+        docs = store.get(path)
+        if docs is None:
+            docs = load(path)
+            store.put(path, docs)
+    """
+    def __init__(self, budget_mb: float = 0):
+        """
+        Args:
+            budget_mb (float): the memory budget in megabytes,
+                zero or less means no limit
+        """
+        self.budget = int(budget_mb * 2 ** 20)
+        self._splits: "OrderedDict[str, List[Document]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._mapped: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._splits
+
+    def __len__(self) -> int:
+        return len(self._splits)
+
+    @property
+    def resident_bytes(self) -> int:
+        """ Approximate size of the resident data of all stored splits """
+        return sum(self._sizes.values())
+
+    @property
+    def mapped_bytes(self) -> int:
+        """ Size of the memory-mapped arrays of all stored splits. These
+        are only paged in on access and can be reclaimed by the OS. """
+        return sum(self._mapped.values())
+
+    def get(self, path: str) -> Optional[List[Document]]:
+        """ Returns the documents of the split or None if not loaded """
+        if path not in self._splits:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._splits.move_to_end(path)
+        return self._splits[path]
+
+    def put(self, path: str, docs: List[Document]):
+        """ Stores the documents, evicting other splits if needed. The split
+        just stored is never evicted, even if it exceeds the budget alone. """
+        self._splits[path] = docs
+        self._splits.move_to_end(path)
+        self._sizes[path], self._mapped[path] = DocumentStore._size(docs)
+
+        while (self.budget > 0 and len(self._splits) > 1
+               and self.resident_bytes > self.budget):
+            self.evict(next(iter(self._splits)))
+
+    def evict(self, path: str):
+        """ Drops the split from the store """
+        del self._splits[path]
+        del self._sizes[path]
+        del self._mapped[path]
+        self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns hit/miss counts and sizes of the store """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "budget_mb": self.budget / 2 ** 20,
+            "resident_mb": self.resident_bytes / 2 ** 20,
+            "mapped_mb": self.mapped_bytes / 2 ** 20,
+            "splits": {path: self._sizes[path] / 2 ** 20
+                       for path in self._splits},
+        }
+
+    @staticmethod
+    def _size(docs: List[Document]) -> Tuple[int, int]:
+        """ Returns (resident, memory-mapped) size of the documents in bytes """
+        resident, mapped = 0, 0
+        for doc in docs:
+            doc_resident, doc_mapped = doc.memory_usage()
+            resident += doc_resident
+            mapped += doc_mapped
+        return resident, mapped
@@ -0,0 +1,103 @@
+""" Contains memory accounting used by CorefModel.
+
+MemoryTracker records the resident set size of the process and the peak
+memory allocated by the torch cuda allocator for each document, grouped by
+document length. a_scoring_batch_size() picks the AnaphoricityScorer batch
+size for a document given a memory budget.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict
+
+import psutil
+import torch
+
+from coref.timing import length_bucket
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+
+MB = 2 ** 20
+
+
+class MemoryTracker:
+    """ Collects per-document memory statistics.
+
+    Usage:
+        tracker.start_doc()
+        ...
+        tracker.end_doc(n_words)
+    """
+    def __init__(self, device: str):
+        self._process = psutil.Process()
+        self._device = torch.device(device)
+        self._cuda = self._device.type == "cuda"
+        self._totals: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"n_docs": 0, "max_rss_mb": 0.0, "max_cuda_peak_mb": 0.0,
+                     "total_cuda_peak_mb": 0.0})
+
+    def start_doc(self):
+        """ Resets the peak statistics of the cuda allocator """
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats(self._device)
+
+    def end_doc(self, n_words: int):
+        """ Records the memory usage for a document of n_words words """
+        totals = self._totals[length_bucket(n_words)]
+        totals["n_docs"] += 1
+        rss = self._process.memory_info().rss / MB
+        totals["max_rss_mb"] = max(totals["max_rss_mb"], rss)
+        if self._cuda:
+            peak = torch.cuda.max_memory_allocated(self._device) / MB
+            totals["max_cuda_peak_mb"] = max(totals["max_cuda_peak_mb"], peak)
+            totals["total_cuda_peak_mb"] += peak
+
+    def summary(self) -> Dict[str, Any]:
+        """ Returns the statistics grouped by document length bucket, as well
+        as the peak resident set size of the process """
+        by_length = {}
+        for bucket, totals in sorted(self._totals.items(),
+                                     key=lambda item: int(item[0].split("-")[0])):
+            by_length[bucket] = {
+                "n_docs": totals["n_docs"],
+                "max_rss_mb": totals["max_rss_mb"],
+            }
+            if self._cuda:
+                by_length[bucket]["max_cuda_peak_mb"] = totals["max_cuda_peak_mb"]
+                by_length[bucket]["mean_cuda_peak_mb"] = \
+                    totals["total_cuda_peak_mb"] / totals["n_docs"]
+        summary: Dict[str, Any] = {"by_length": by_length}
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            summary["peak_rss_mb"] = \
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if self._cuda:
+            summary["cuda_max_reserved_mb"] = \
+                torch.cuda.max_memory_reserved(self._device) / MB
+        return summary
+
+
+def a_scoring_batch_size(n_words: int,
+                         n_ants: int,
+                         pair_emb: int,
+                         hidden_size: int,
+                         n_hidden_layers: int,
+                         budget_mb: float,
+                         element_size: int = 4) -> int:
+    """
+    Returns the number of words whose antecedents can be scored in one batch
+    without the AnaphoricityScorer exceeding budget_mb megabytes.
+
+    For every word in a batch the scorer materializes the gathered antecedent
+    embeddings and the similarity term (2 * pair_emb in total, counting the
+    concatenated pair matrix), and for every hidden layer the output of the
+    linear layer, the activation and the dropout mask. All of these are kept
+    for the backward pass during training.
+    """
+    per_word = n_ants * (2 * pair_emb + 3 * hidden_size * n_hidden_layers)
+    per_word *= element_size
+    batch_size = int(budget_mb * MB) // max(per_word, 1)
+    return max(1, min(n_words, batch_size))
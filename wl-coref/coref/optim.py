@@ -0,0 +1,322 @@
+""" Describes optimizers not found in torch.optim.
+
+Adam8bit and FactoredAdam are drop-in replacements of torch.optim.Adam
+that keep less state than its two float32 moments per parameter:
+    Adam8bit        stores both moments as 8-bit codes with one scale per
+                    block of BLOCK_SIZE values (2 bytes per parameter
+                    instead of 8). Codes are companded, so that small values
+                    keep their precision relative to the block maximum
+    FactoredAdam    keeps the first moment, but factors the second moment of
+                    matrices into row and column averages as in Adafactor
+                    (4 bytes per parameter instead of 8)
+Parameters with fewer than MIN_QUANTIZED_SIZE elements (biases, layer norms)
+keep the float32 Adam state in both.
+
+SparseRowAdam is a lazy Adam for embedding matrices trained with sparse
+gradients: only the rows looked up in a step are updated, and the moment
+estimates are only allocated for rows that have been looked up at least
+once. Fine-tuning a multilingual encoder on Dutch text touches a small
+fraction of its subword embeddings, so both the time of a step and the
+memory taken by the optimizer state scale with the rows in use rather than
+with the size of the vocabulary.
+"""
+
+from typing import Any, Dict, Iterable, Tuple
+
+import torch
+
+
+BLOCK_SIZE = 256
+MIN_QUANTIZED_SIZE = 4096
+
+
+class SparseRowAdam(torch.optim.Optimizer):
+    """ Adam with the moments of every row of a 2D parameter updated only
+    when the row has a gradient, as torch.optim.SparseAdam, but with the
+    state kept for the rows seen so far only.
+
+    The state of a parameter consists of:
+        step        the number of steps taken
+        slots       [n_rows] index of the row in the moment tensors, -1 for
+                    rows never seen
+        exp_avg     [capacity, dim] first moments
+        exp_avg_sq  [capacity, dim] second moments
+        n_slots     the number of rows of the moment tensors in use
+    """
+
+    def __init__(self,
+                 params: Iterable[torch.Tensor],
+                 lr: float = 1e-3,
+                 betas: Tuple[float, float] = (0.9, 0.999),
+                 eps: float = 1e-8):
+        super().__init__(params, {"lr": lr, "betas": betas, "eps": eps})
+
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        # Optimizer.load_state_dict casts the state to the parameter dtype
+        for state in self.state.values():
+            if "slots" in state:
+                state["slots"] = state["slots"].long()
+
+    @torch.no_grad()
+    def step(self, closure=None):  # pylint: disable=arguments-differ
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                grad = param.grad
+                if grad.is_sparse:
+                    grad = grad.coalesce()
+                    rows, values = grad.indices()[0], grad.values()
+                else:
+                    rows = grad.abs().sum(dim=1).nonzero().squeeze(1)
+                    values = grad[rows]
+                if not len(rows):
+                    continue
+
+                state = self.state[param]
+                if not state:
+                    state["step"] = 0
+                    state["slots"] = torch.full(
+                        (param.shape[0],), -1, dtype=torch.long,
+                        device=param.device)
+                    state["exp_avg"] = param.new_zeros((0, param.shape[1]))
+                    state["exp_avg_sq"] = param.new_zeros((0, param.shape[1]))
+                    state["n_slots"] = 0
+                state["step"] += 1
+
+                slots = self._get_slots(state, rows)
+                exp_avg = state["exp_avg"][slots]
+                exp_avg_sq = state["exp_avg_sq"][slots]
+                exp_avg.mul_(beta1).add_(values, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(values, values,
+                                                value=1 - beta2)
+                state["exp_avg"][slots] = exp_avg
+                state["exp_avg_sq"][slots] = exp_avg_sq
+
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+                step_size = group["lr"] * bias_correction2 ** 0.5 \
+                    / bias_correction1
+                param.index_add_(
+                    0, rows,
+                    exp_avg.div_(exp_avg_sq.sqrt_().add_(group["eps"]))
+                    .mul_(-step_size))
+        return loss
+
+    @staticmethod
+    def _get_slots(state, rows: torch.Tensor) -> torch.Tensor:
+        """ Returns the slots of the rows, allocating them for new rows.
+        The moment tensors grow by doubling their capacity. """
+        slots = state["slots"]
+        new_rows = rows[slots[rows] < 0]
+        if len(new_rows):
+            n_slots = state["n_slots"]
+            needed = n_slots + len(new_rows)
+            capacity = len(state["exp_avg"])
+            if needed > capacity:
+                capacity = max(needed, 2 * capacity)
+                for key in ("exp_avg", "exp_avg_sq"):
+                    grown = state[key].new_zeros(
+                        (capacity, state[key].shape[1]))
+                    grown[:n_slots] = state[key][:n_slots]
+                    state[key] = grown
+            slots[new_rows] = torch.arange(n_slots, needed,
+                                           device=slots.device)
+            state["n_slots"] = needed
+        return slots[rows]
+
+
+def _quantize(values: torch.Tensor, signed: bool
+              ) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Quantizes values to 8-bit codes in blocks of BLOCK_SIZE.
+    The codes are the square roots of the values relative to the absolute
+    maximum of their block, which spends more codes on small values.
+
+    Returns:
+        codes [n_blocks, BLOCK_SIZE] (int8 if signed, else uint8) and
+        float32 scales [n_blocks, 1]
+    """
+    flat = values.reshape(-1)
+    padding = -len(flat) % BLOCK_SIZE
+    blocks = torch.nn.functional.pad(flat, (0, padding)).view(-1, BLOCK_SIZE)
+    scales = blocks.abs().max(dim=1, keepdim=True)[0].clamp(min=1e-30)
+    levels = 127 if signed else 255
+    codes = (blocks.abs() / scales).sqrt_().mul_(levels).round_()
+    if signed:
+        return (codes * blocks.sign()).to(torch.int8), scales
+    return codes.to(torch.uint8), scales
+
+
+def _dequantize(codes: torch.Tensor,
+                scales: torch.Tensor,
+                like: torch.Tensor,
+                signed: bool) -> torch.Tensor:
+    """ Reverses _quantize, returning a tensor of the shape of like """
+    levels = 127 if signed else 255
+    blocks = codes.float().div_(levels)
+    blocks = blocks.abs() * blocks * scales
+    return blocks.view(-1)[:like.numel()].view_as(like)
+
+
+class _LeanAdam(torch.optim.Optimizer):
+    """ The parts of Adam8bit and FactoredAdam that are the same: the Adam
+    update with bias correction, from the moments returned by _moments().
+    Small parameters keep the float32 moments of torch.optim.Adam. """
+
+    # The state keys of large parameters, checked when loading a state
+    STATE_KEYS: Tuple[str, ...] = ()
+
+    # The dtypes of the state tensors that are not stored as floats
+    CODE_DTYPES: Dict[str, torch.dtype] = {}
+
+    def __init__(self,
+                 params: Iterable[torch.Tensor],
+                 lr: float = 1e-3,
+                 betas: Tuple[float, float] = (0.9, 0.999),
+                 eps: float = 1e-8):
+        super().__init__(params, {"lr": lr, "betas": betas, "eps": eps})
+
+    def load_state_dict(self, state_dict):
+        saved_ids = [param_id for group in state_dict["param_groups"]
+                     for param_id in group["params"]]
+        params = [param for group in self.param_groups
+                  for param in group["params"]]
+        for param_id, param in zip(saved_ids, params):
+            state = state_dict["state"].get(param_id)
+            if (state and param.numel() >= MIN_QUANTIZED_SIZE
+                    and not all(key in state for key in self.STATE_KEYS)):
+                raise ValueError(f"The optimizer state was not saved by"
+                                 f" {type(self).__name__}")
+        super().load_state_dict(state_dict)
+        # Optimizer.load_state_dict casts the state to the parameter dtype
+        for state in self.state.values():
+            for key, dtype in self.CODE_DTYPES.items():
+                if key in state:
+                    state[key] = state[key].to(dtype)
+
+    @torch.no_grad()
+    def step(self, closure=None):  # pylint: disable=arguments-differ
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                grad = param.grad.float()
+                state = self.state[param]
+                if not state:
+                    state["step"] = 0
+                state["step"] += 1
+
+                if param.numel() < MIN_QUANTIZED_SIZE:
+                    if "exp_avg" not in state:
+                        state["exp_avg"] = torch.zeros_like(grad)
+                        state["exp_avg_sq"] = torch.zeros_like(grad)
+                    exp_avg = state["exp_avg"].mul_(beta1).add_(
+                        grad, alpha=1 - beta1)
+                    denom = state["exp_avg_sq"].mul_(beta2).addcmul_(
+                        grad, grad, value=1 - beta2).sqrt()
+                else:
+                    exp_avg, denom = self._moments(state, grad, beta1, beta2)
+
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+                step_size = group["lr"] * bias_correction2 ** 0.5 \
+                    / bias_correction1
+                update = exp_avg / denom.add_(group["eps"]
+                                               * bias_correction2 ** 0.5)
+                param.add_(update.to(param.dtype), alpha=-step_size)
+        return loss
+
+    def _moments(self,
+                 state: Dict[str, Any],
+                 grad: torch.Tensor,
+                 beta1: float,
+                 beta2: float) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Updates the state with the gradient and returns the first moment
+        and the square root of the second moment """
+        raise NotImplementedError
+
+
+class Adam8bit(_LeanAdam):
+    """ Adam with both moments stored as block-quantized 8-bit codes """
+
+    STATE_KEYS = ("step", "exp_avg_codes", "exp_avg_scales",
+                  "exp_avg_sq_codes", "exp_avg_sq_scales")
+    CODE_DTYPES = {"exp_avg_codes": torch.int8,
+                   "exp_avg_sq_codes": torch.uint8}
+
+    def _moments(self, state, grad, beta1, beta2):
+        if "exp_avg_codes" in state:
+            exp_avg = _dequantize(state["exp_avg_codes"],
+                                  state["exp_avg_scales"], grad,
+                                  signed=True)
+            # The square root of the second moment is stored, which halves
+            # the range of the values to cover
+            exp_avg_sq = _dequantize(state["exp_avg_sq_codes"],
+                                     state["exp_avg_sq_scales"], grad,
+                                     signed=False) ** 2
+        else:
+            exp_avg = torch.zeros_like(grad)
+            exp_avg_sq = torch.zeros_like(grad)
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        denom = exp_avg_sq.mul_(beta2).addcmul_(grad, grad,
+                                                value=1 - beta2).sqrt_()
+        state["exp_avg_codes"], state["exp_avg_scales"] = \
+            _quantize(exp_avg, signed=True)
+        state["exp_avg_sq_codes"], state["exp_avg_sq_scales"] = \
+            _quantize(denom, signed=False)
+        return exp_avg, denom
+
+
+class FactoredAdam(_LeanAdam):
+    """ Adam with the second moment of matrices factored into the averages
+    of its rows and columns (Shazeer and Stern, 2018). Parameters of more
+    than two dimensions are factored as [shape[0], rest] matrices. """
+
+    STATE_KEYS = ("step", "first_moment", "row_sq", "col_sq")
+
+    def _moments(self, state, grad, beta1, beta2):
+        matrix = grad.reshape(grad.shape[0], -1)
+        if "first_moment" not in state:
+            state["first_moment"] = torch.zeros_like(grad)
+            state["row_sq"] = matrix.new_zeros(matrix.shape[0])
+            state["col_sq"] = matrix.new_zeros(matrix.shape[1])
+        exp_avg = state["first_moment"].mul_(beta1).add_(grad,
+                                                         alpha=1 - beta1)
+        grad_sq = matrix * matrix
+        row_sq = state["row_sq"].mul_(beta2).add_(grad_sq.mean(dim=1),
+                                                  alpha=1 - beta2)
+        col_sq = state["col_sq"].mul_(beta2).add_(grad_sq.mean(dim=0),
+                                                  alpha=1 - beta2)
+        exp_avg_sq = torch.outer(row_sq, col_sq) \
+            / row_sq.mean().clamp(min=1e-30)
+        return exp_avg, exp_avg_sq.sqrt_().view_as(grad)
+
+
+OPTIMIZERS = {
+    "adam": torch.optim.Adam,
+    "adam8bit": Adam8bit,
+    "factored": FactoredAdam,
+}
+
+
+def build_optimizer(name: str,
+                    params: Iterable[torch.Tensor],
+                    lr: float) -> torch.optim.Optimizer:
+    """ Creates the optimizer called name in OPTIMIZERS """
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer: {name}, expected one of"
+                         f" {sorted(OPTIMIZERS)}")
+    return OPTIMIZERS[name](params, lr=lr)
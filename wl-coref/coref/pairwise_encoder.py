@@ -1,12 +1,12 @@
 """ Describes PairwiseEncodes, that transforms pairwise features, such as
 distance between the mentions, same/different speaker into feature embeddings
 """
-from typing import List
+from typing import Any, Optional, Tuple
 
 import torch
 
 from coref.config import Config
-from coref.const import Doc
+from coref.doc_tensors import DocTensors
 
 
 class PairwiseEncoder(torch.nn.Module):
@@ -14,7 +14,7 @@ class PairwiseEncoder(torch.nn.Module):
 
     Usage:
         encoder = PairwiseEncoder(config)
-        pairwise_features = encoder(pair_indices, doc)
+        pairwise_features = encoder(pair_indices, doc_tensors)
     """
     def __init__(self, config: Config):
         super().__init__()
@@ -28,6 +28,14 @@ class PairwiseEncoder(torch.nn.Module):
         #   [(0, 2), (2, 3), (3, 4), (4, 5), (5, 8),
         #    (8, 16), (16, 32), (32, 64), (64, float("inf"))]
         self.distance_emb = torch.nn.Embedding(9, emb_size)
+        # the bucket of every distance up to 64, larger ones are in the last
+        distance = torch.arange(0, 65).clamp_min(1)
+        log_distance = distance.to(torch.float).log2().floor().clamp_max(6)
+        self.register_buffer(
+            "distance_buckets",
+            torch.where(distance < 5, distance - 1,
+                        log_distance.to(torch.long) + 2),
+            persistent=False)
 
         # two possibilities: same vs different speaker
         self.speaker_emb = torch.nn.Embedding(2, emb_size)
@@ -35,6 +43,11 @@ class PairwiseEncoder(torch.nn.Module):
         self.dropout = torch.nn.Dropout(config.dropout_rate)
         self.shape = emb_size * 3  # genre, distance, speaker\
 
+        # The features of (same_speaker, distance bucket) pairs, cached
+        # outside of training until the embeddings change
+        self._fused_table: Optional[torch.Tensor] = None
+        self._fused_key: Optional[Tuple[Any, ...]] = None
+
     @property
     def device(self) -> torch.device:
         """ A workaround to get current device (which is assumed to be the
@@ -43,35 +56,64 @@ class PairwiseEncoder(torch.nn.Module):
 
     def forward(self,  # type: ignore  # pylint: disable=arguments-differ  #35566 in pytorch
                 top_indices: torch.Tensor,
-                doc: Doc) -> torch.Tensor:
-        word_ids = torch.arange(0, len(doc["cased_words"]), device=self.device)
-        speaker_map = torch.tensor(self._speaker_map(doc), device=self.device)
-
-        same_speaker = (speaker_map[top_indices] == speaker_map.unsqueeze(1))
-        same_speaker = self.speaker_emb(same_speaker.to(torch.long))
-
-        # bucketing the distance (see __init__())
-        distance = (word_ids.unsqueeze(1) - word_ids[top_indices]
-                    ).clamp_min_(min=1)
-        log_distance = distance.to(torch.float).log2().floor_()
-        log_distance = log_distance.clamp_max_(max=6).to(torch.long)
-        distance = torch.where(distance < 5, distance - 1, log_distance + 2)
-        distance = self.distance_emb(distance)
-
-        genre = torch.tensor(0,
-                             #self.genre2int[doc["document_id"][:2]],
-                             device=self.device).expand_as(top_indices)
-        genre = self.genre_emb(genre)
-
-        return self.dropout(torch.cat((same_speaker, distance, genre), dim=2))
-
-    @staticmethod
-    def _speaker_map(doc: Doc) -> List[int]:
+                doc_tensors: DocTensors,
+                rows: Optional[torch.Tensor] = None) -> torch.Tensor:
         """
-        Returns a tensor where i-th element is the speaker id of i-th word.
+        Args:
+            top_indices (torch.Tensor): [n_rows, n_ants], antecedents of
+                every row
+            doc_tensors (DocTensors): static tensors of the document
+            rows (torch.Tensor): [n_rows], the words of the rows, all the
+                words of the document if not given
+
+        Returns:
+            torch.Tensor [n_rows, n_ants, pw_emb]
         """
-        # speaker string -> speaker id
-        str2int = {s: i for i, s in enumerate(set(doc["speaker"]))}
+        word_ids = torch.arange(0, doc_tensors.n_words, device=self.device)
+        speaker_map = doc_tensors.speaker_ids
+        row_ids = word_ids if rows is None else rows
+
+        same_speaker = (speaker_map[top_indices]
+                        == speaker_map[row_ids].unsqueeze(1))
 
-        # word id -> speaker id
-        return [str2int[s] for s in doc["speaker"]]
+        # bucketing the distance (see __init__())
+        distance = (row_ids.unsqueeze(1) - word_ids[top_indices]
+                    ).clamp_(min=1, max=len(self.distance_buckets) - 1)
+        distance = self.distance_buckets[distance]
+
+        # One lookup of same_speaker x distance bucket
+        n_buckets = self.distance_emb.num_embeddings
+        features = self._fused_features()[same_speaker * n_buckets + distance]
+        return self.dropout(features)
+
+    def _fused_features(self) -> torch.Tensor:
+        """ Returns the features of every (same_speaker, distance bucket)
+        pair, [2 * n_buckets, shape]: the speaker, distance and genre
+        embeddings concatenated, the genre being the same for all pairs.
+
+        Outside of training and autograd, the table is built once and
+        reused until an embedding is updated in place (e.g. by an optimizer
+        or load_state_dict), which bumps its version counter. """
+        embeddings = (self.speaker_emb.weight, self.distance_emb.weight,
+                      self.genre_emb.weight)
+        cache = not self.training and not torch.is_grad_enabled()
+        if cache:
+            key = tuple((weight.data_ptr(), weight._version)  # pylint: disable=protected-access
+                        for weight in embeddings)
+            if self._fused_table is not None and key == self._fused_key:
+                return self._fused_table
+
+        n_speakers, n_buckets = (self.speaker_emb.num_embeddings,
+                                 self.distance_emb.num_embeddings)
+        genre = self.genre_emb.weight[0]
+        table = torch.cat((
+            self.speaker_emb.weight.repeat_interleave(n_buckets, dim=0),
+            self.distance_emb.weight.repeat(n_speakers, 1),
+            genre.expand(n_speakers * n_buckets, -1),
+        ), dim=1)
+
+        if cache:
+            self._fused_table, self._fused_key = table, key
+        else:
+            self._fused_table = self._fused_key = None
+        return table
@@ -0,0 +1,143 @@
+""" Describes ProfilingTimer, which runs torch.profiler and cProfile over the
+first documents processed by CorefModel.run.
+
+The stages measured by the timer become record_function ranges, so the
+operators in the exported traces are grouped by CorefModel submodule.
+The following files are written to the output directory:
+    trace.json              chrome trace (open in chrome://tracing or perfetto)
+    operators.txt           operator summary table
+    operators_by_shape.txt  the same, grouped by input shapes
+    host.prof               cProfile dump of the python code, see pstats
+    host.txt                cProfile summary sorted by cumulative time
+"""
+
+import cProfile
+from contextlib import contextmanager
+import io
+import os
+import pstats
+from typing import Optional
+
+import torch
+
+from coref.timing import NullTimer
+
+
+class ProfilingTimer(NullTimer):
+    """ Wraps another timer, profiling the first n_docs documents.
+
+    The host-side profiler is stopped at the start of document n_docs + 1
+    (or when the timer is closed), so that the work done between the calls
+    to run(), such as writing conll files, is profiled as well.
+    """
+    def __init__(self,
+                 inner: NullTimer,
+                 n_docs: int,
+                 out_dir: str,
+                 device: str,
+                 host_profiler: Optional[cProfile.Profile] = None):
+        """
+        Args:
+            inner (NullTimer): the timer to pass the measurements to
+            n_docs (int): the number of documents to profile
+            out_dir (str): the directory to write the results to
+            device (str): the device the model runs on
+            host_profiler (cProfile.Profile): an already running profiler,
+                e.g. started before the model was built to also cover
+                loading and tokenization. If None, a new one is started
+                with the first document.
+        """
+        self.inner = inner
+        self.n_docs = n_docs
+        self.out_dir = out_dir
+        self._cuda = torch.device(device).type == "cuda"
+        self._host = host_profiler
+        self._torch_profiler = None
+        self._n_seen = 0
+        self._done = False
+
+    @property
+    def enabled(self) -> bool:  # type: ignore
+        return self.inner.enabled
+
+    @property
+    def active(self) -> bool:
+        """ Whether the profilers are running """
+        return self._torch_profiler is not None
+
+    def start_doc(self, n_words: int):
+        if not self._done:
+            if self._n_seen >= self.n_docs:
+                self._stop()
+            elif not self.active:
+                self._start()
+        self.inner.start_doc(n_words)
+
+    def end_doc(self, doc_id: str):
+        self.inner.end_doc(doc_id)
+        if self.active:
+            self._n_seen += 1
+
+    def stage(self, name: str):
+        if not self.active:
+            return self.inner.stage(name)
+        return self._ranged_stage(name)
+
+    def summary(self):
+        return self.inner.summary()
+
+    def close(self):
+        self._stop()
+        self.inner.close()
+
+    @contextmanager
+    def _ranged_stage(self, name: str):
+        with torch.profiler.record_function(name):
+            with self.inner.stage(name):
+                yield
+
+    def _start(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self._cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profiler = torch.profiler.profile(
+            activities=activities, record_shapes=True, profile_memory=True)
+        self._torch_profiler.start()
+        if self._host is None:
+            self._host = cProfile.Profile()
+            self._host.enable()
+
+    def _stop(self):
+        if self._done:
+            return
+        self._done = True
+        os.makedirs(self.out_dir, exist_ok=True)
+        print(f"Writing profiling results for {self._n_seen} documents"
+              f" to {self.out_dir}...")
+
+        if self.active:
+            self._torch_profiler.stop()
+            sort_by = ("self_cuda_time_total" if self._cuda
+                       else "self_cpu_time_total")
+            self._torch_profiler.export_chrome_trace(
+                os.path.join(self.out_dir, "trace.json"))
+            with open(os.path.join(self.out_dir, "operators.txt"),
+                      mode="w", encoding="utf8") as f:
+                f.write(self._torch_profiler.key_averages()
+                        .table(sort_by=sort_by, row_limit=100))
+            with open(os.path.join(self.out_dir, "operators_by_shape.txt"),
+                      mode="w", encoding="utf8") as f:
+                f.write(self._torch_profiler
+                        .key_averages(group_by_input_shape=True)
+                        .table(sort_by=sort_by, row_limit=100))
+            self._torch_profiler = None
+
+        if self._host is not None:
+            self._host.disable()
+            self._host.dump_stats(os.path.join(self.out_dir, "host.prof"))
+            stream = io.StringIO()
+            pstats.Stats(self._host, stream=stream) \
+                .sort_stats("cumulative").print_stats(100)
+            with open(os.path.join(self.out_dir, "host.txt"),
+                      mode="w", encoding="utf8") as f:
+                f.write(stream.getvalue())
@@ -0,0 +1,59 @@
+""" Selects the third person Dutch pronouns scored by the pronoun score.
+
+The rule is the one of full_evaluation.py: a pronoun ("PRON") whose CGN
+postag is not exclusive, indefinite, relative, demonstrative, interrogative
+or plural, is in the third person, is not "men" and, unless its gender is
+fem or masc, is in the pronoun list of the setting. full_evaluation.py
+additionally requires every pronoun to be in the list of the setting.
+"""
+
+import re
+from typing import Collection, Dict, List, Tuple
+
+from coref.const import Doc
+
+
+SETTINGS: Dict[str, Tuple[str, ...]] = {
+    "all": ("hij", "hem", "zijn", "zij", "haar", "hen", "hun", "die",
+            "diens", "dee", "dij", "nij", "vij", "zhij", "zem", "dem", "ner",
+            "vijn", "zhaar", "zeer", "dijr", "nijr", "vijns"),
+    "fem": ("zij", "haar"),
+    "masc": ("hij", "hem", "zijn"),
+    "gi": ("hen", "hun", "die", "diens"),
+}
+
+PRONOUNS = frozenset(SETTINGS["all"])
+
+EXCLUDED_TAGS = ("excl", "onbep", "betr", "aanw", "vb")
+PERSON_PATTERN = re.compile(r"[1-3]")
+
+
+def third_person_pronoun(word: str,
+                         postag: str,
+                         pronoun_list: Collection[str]) -> bool:
+    """ Returns whether the postag is that of a singular third person
+    pronoun, requiring words of no gender to be in pronoun_list """
+    if any(tag in postag for tag in EXCLUDED_TAGS) or "mv" in postag:
+        return False
+    person = PERSON_PATTERN.search(postag)
+    if person is None or person[0] != "3":
+        return False
+    if word.lower() == "men":
+        return False
+    gender = postag[-4:].replace("|", "")
+    return gender in ("fem", "masc") or word.lower() in pronoun_list
+
+
+def third_person_pronouns(doc: Doc, setting: str = "all") -> List[int]:
+    """ Returns the ids of the words of the document that full_evaluation.py
+    scores as third person pronouns. Documents without postag annotation
+    only have the words of the setting checked. """
+    words = SETTINGS[setting]
+    postags = doc.get("postag")
+    if not postags or all(tag == "X" for tag in postags):
+        return [i for i, word in enumerate(doc["cased_words"])
+                if word.lower() in words]
+    pos = doc["pos"]
+    return [i for i, word in enumerate(doc["cased_words"])
+            if pos[i] == "PRON" and word.lower() in words
+            and third_person_pronoun(word, postags[i], words)]
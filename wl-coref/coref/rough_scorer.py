@@ -2,7 +2,7 @@
 anaphoricity scores.
 """
 
-from typing import Tuple
+from typing import Optional, Tuple
 
 import torch
 
@@ -21,21 +21,30 @@ class RoughScorer(torch.nn.Module):
         self.bilinear = torch.nn.Linear(features, features)
 
         self.k = config.rough_k
+        self.pruning = config.rough_pruning
+        self.pruning_threshold = config.rough_pruning_threshold
+        if self.pruning not in ("fixed", "cumulative", "margin"):
+            raise ValueError(f"Unknown rough_pruning: {self.pruning}")
 
     def forward(self,  # type: ignore  # pylint: disable=arguments-differ  #35566 in pytorch
                 mentions: torch.Tensor,
+                rows: Optional[torch.Tensor] = None,
                 ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Returns rough anaphoricity scores for candidates, which consist of
         the bilinear output of the current model summed with mention scores.
+        If rows (mention indices) are given, only the candidates of these
+        mentions are scored.
         """
-        # [n_mentions, n_mentions]
-        pair_mask = torch.arange(mentions.shape[0])
-        pair_mask = pair_mask.unsqueeze(1) - pair_mask.unsqueeze(0)
+        # [n_rows, n_mentions]
+        mention_ids = torch.arange(mentions.shape[0])
+        row_ids = mention_ids if rows is None else rows.cpu()
+        pair_mask = row_ids.unsqueeze(1) - mention_ids.unsqueeze(0)
         pair_mask = torch.log((pair_mask > 0).to(torch.float))
         pair_mask = pair_mask.to(mentions.device)
 
-        bilinear_scores = self.dropout(self.bilinear(mentions)).mm(mentions.T)
+        row_mentions = mentions if rows is None else mentions[rows]
+        bilinear_scores = self.dropout(self.bilinear(row_mentions)).mm(mentions.T)
 
         rough_scores = pair_mask + bilinear_scores
 
@@ -45,17 +54,33 @@ class RoughScorer(torch.nn.Module):
                rough_scores: torch.Tensor
                ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
-        Selects top-k rough antecedent scores for each mention.
+        Selects top-k rough antecedent scores for each mention. Outside of
+        training, adaptive pruning (see rough_pruning in config.toml) sets
+        the scores of the candidates it drops to -inf and the candidates are
+        sorted, so k becomes the largest number kept for a mention.
 
         Args:
-            rough_scores: tensor of shape [n_mentions, n_mentions], containing
+            rough_scores: tensor of shape [n_rows, n_mentions], containing
                 rough antecedent scores of each mention-antecedent pair.
 
         Returns:
-            FloatTensor of shape [n_mentions, k], top rough scores
-            LongTensor of shape [n_mentions, k], top indices
+            FloatTensor of shape [n_rows, k], top rough scores
+            LongTensor of shape [n_rows, k], top indices
         """
+        adaptive = self.pruning != "fixed" and not self.training
         top_scores, indices = torch.topk(rough_scores,
-                                         k=min(self.k, len(rough_scores)),
-                                         dim=1, sorted=False)
-        return top_scores, indices
+                                         k=min(self.k, rough_scores.shape[1]),
+                                         dim=1, sorted=adaptive)
+        if not adaptive:
+            return top_scores, indices
+
+        if self.pruning == "cumulative":
+            probs = torch.softmax(top_scores, dim=1).nan_to_num(0.0)
+            # Keep a candidate if the better ones do not reach the threshold
+            keep = probs.cumsum(dim=1) - probs < self.pruning_threshold
+        else:
+            keep = top_scores >= top_scores[:, :1] - self.pruning_threshold
+        keep &= top_scores > float("-inf")
+        top_scores = top_scores.masked_fill(~keep, float("-inf"))
+        k = max(int(keep.sum(dim=1).max()), 1) if len(keep) else 0
+        return top_scores[:, :k], indices[:, :k]
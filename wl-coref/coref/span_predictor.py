@@ -4,7 +4,8 @@ head word and context embeddings.
 
 from typing import List, Optional, Tuple
 
-from coref.const import Doc, Span
+from coref.const import Span
+from coref.doc_tensors import DocTensors
 import torch
 
 
@@ -33,90 +34,120 @@ class SpanPredictor(torch.nn.Module):
         return next(self.ffnn.parameters()).device
 
     def forward(self,  # type: ignore  # pylint: disable=arguments-differ  #35566 in pytorch
-                doc: Doc,
+                doc_tensors: DocTensors,
                 words: torch.Tensor,
                 heads_ids: torch.Tensor) -> torch.Tensor:
         """
-        Calculates span start/end scores of words for each span head in
-        heads_ids
+        Calculates span start/end scores of the words of the sentence of
+        each span head in heads_ids.
+
+        Only the words of the head's sentence are candidates, so the scores
+        are kept sentence-local: [i, j] scores the j-th word of the sentence
+        of the i-th head (see sentence_starts). The first layer of the FFNN
+        is applied to the head, candidate and distance embeddings separately,
+        so that each word is only projected once.
 
         Args:
-            doc (Doc): the document data
+            doc_tensors (DocTensors): static tensors of the document
             words (torch.Tensor): contextual embeddings for each word in the
                 document, [n_words, emb_size]
             heads_ids (torch.Tensor): word indices of span heads
 
         Returns:
-            torch.Tensor: span start/end scores, [n_heads, n_words, 2]
+            torch.Tensor: span start/end scores, [n_heads, max_sent_len, 2],
+                -inf past the end of each sentence
         """
-        # Obtain distance embedding indices, [n_heads, n_words]
-        relative_positions = (heads_ids.unsqueeze(1) - torch.arange(words.shape[0], device=words.device).unsqueeze(0))
-        emb_ids = relative_positions + 63               # make all valid distances positive
+        # [n_heads]
+        starts = self.sentence_starts(doc_tensors, heads_ids)
+        lengths = doc_tensors.sent_bounds[heads_ids, 1] - starts
+        max_len = int(lengths.max()) if len(heads_ids) else 0
+
+        # Pairs of heads and the words of their sentences
+        # [n_heads, max_sent_len]
+        padding_mask = torch.arange(0, max_len, device=words.device).unsqueeze(0)
+        padding_mask = (padding_mask < lengths.unsqueeze(1))
+        rows, cols = padding_mask.nonzero(as_tuple=True)
+        candidates = starts[rows] + cols
+
+        # Obtain distance embedding indices, [n_pairs]
+        emb_ids = heads_ids[rows] - candidates + 63     # make all valid distances positive
         emb_ids[(emb_ids < 0) + (emb_ids > 126)] = 127  # "too_far"
 
-        # Obtain "same sentence" boolean mask, [n_heads, n_words]
-        sent_id = torch.tensor(doc["sent_id"], device=words.device)
-        same_sent = (sent_id[heads_ids].unsqueeze(1) == sent_id.unsqueeze(0))
-
-        # To save memory, only pass candidates from one sentence for each head
-        # pair_matrix contains concatenated span_head_emb + candidate_emb + distance_emb
-        # for each candidate among the words in the same sentence as span_head
-        # [n_heads, input_size * 2 + distance_emb_size]
-        rows, cols = same_sent.nonzero(as_tuple=True)
-        pair_matrix = torch.cat((
-            words[heads_ids[rows]],
-            words[cols],
-            self.emb(emb_ids[rows, cols]),
-        ), dim=1)
-
-        lengths = same_sent.sum(dim=1)
-        padding_mask = torch.arange(0, lengths.max(), device=words.device).unsqueeze(0)
-        padding_mask = (padding_mask < lengths.unsqueeze(1))  # [n_heads, max_sent_len]
-
-        # [n_heads, max_sent_len, input_size * 2 + distance_emb_size]
+        # The first layer applied to span_head_emb + candidate_emb + distance_emb
+        # as the sum of the projections of each part, [n_pairs, input_size]
+        first = self.ffnn[0]
+        emb_size = words.shape[1]
+        w_head, w_candidate, w_distance = first.weight.split(
+            (emb_size, emb_size, first.in_features - 2 * emb_size), dim=1)
+        candidate_words, candidate_pos = torch.unique(candidates,
+                                                      return_inverse=True)
+        hidden = (torch.nn.functional.linear(words[heads_ids], w_head)[rows]
+                  + torch.nn.functional.linear(words[candidate_words],
+                                               w_candidate)[candidate_pos]
+                  + torch.nn.functional.linear(self.emb.weight, w_distance,
+                                               first.bias)[emb_ids])
+        pair_scores = self.ffnn[1:](hidden)  # [n_pairs, last_layer_output]
+
+        # [n_heads, max_sent_len, last_layer_output]
         # This is necessary to allow the convolution layer to look at several
-        # word scores
-        padded_pairs = torch.zeros(*padding_mask.shape, pair_matrix.shape[-1], device=words.device)
-        padded_pairs[padding_mask] = pair_matrix
-
-        res = self.ffnn(padded_pairs) # [n_heads, n_candidates, last_layer_output]
-        res = self.conv(res.permute(0, 2, 1)).permute(0, 2, 1) # [n_heads, n_candidates, 2]
-
-        scores = torch.full((heads_ids.shape[0], words.shape[0], 2), float('-inf'), device=words.device)
-        scores[rows, cols] = res[padding_mask]
+        # word scores. Padding is what the FFNN outputs for a zero input;
+        # in training every padded position gets a dropout mask of its own.
+        if self.training:
+            padding = self.ffnn(hidden.new_zeros(int((~padding_mask).sum()),
+                                                 first.in_features))
+            padded_scores = padding.new_empty(*padding_mask.shape,
+                                              padding.shape[-1])
+            padded_scores[~padding_mask] = padding
+        else:
+            padding = self.ffnn(hidden.new_zeros(1, first.in_features))
+            padded_scores = padding.expand(*padding_mask.shape, -1).clone()
+        padded_scores[padding_mask] = pair_scores.to(padded_scores.dtype)
+
+        res = self.conv(padded_scores.permute(0, 2, 1)).permute(0, 2, 1) # [n_heads, max_sent_len, 2]
+        scores = res.masked_fill(~padding_mask.unsqueeze(2), float("-inf"))
 
         # Make sure that start <= head <= end during inference
         if not self.training:
+            relative_positions = (heads_ids - starts).unsqueeze(1) \
+                - torch.arange(0, max_len, device=words.device).unsqueeze(0)
             valid_starts = torch.log((relative_positions >= 0).to(torch.float))
             valid_ends = torch.log((relative_positions <= 0).to(torch.float))
             valid_positions = torch.stack((valid_starts, valid_ends), dim=2)
             return scores + valid_positions
         return scores
 
+    @staticmethod
+    def sentence_starts(doc_tensors: DocTensors,
+                        heads_ids: torch.Tensor) -> torch.Tensor:
+        """ Returns the first word of the sentence of every head, the offset
+        of the sentence-local positions of forward() """
+        return doc_tensors.sent_bounds[heads_ids, 0]
+
     def get_training_data(self,
-                          doc: Doc,
+                          doc_tensors: DocTensors,
                           words: torch.Tensor
                           ) -> Tuple[Optional[torch.Tensor],
                                      Optional[Tuple[torch.Tensor, torch.Tensor]]]:
-        """ Returns span starts/ends for gold mentions in the document. """
-        head2span = sorted(doc["head2span"])
-        if not head2span:
+        """ Returns span scores and sentence-local span starts/ends for gold
+        mentions in the document. """
+        head2span = doc_tensors.head2span
+        if not len(head2span):
             return None, None
-        heads, starts, ends = zip(*head2span)
-        heads = torch.tensor(heads, device=self.device)
-        starts = torch.tensor(starts, device=self.device)
-        ends = torch.tensor(ends, device=self.device) - 1
-        return self(doc, words, heads), (starts, ends)
+        heads = head2span[:, 0]
+        offsets = self.sentence_starts(doc_tensors, heads)
+        starts = head2span[:, 1] - offsets
+        ends = head2span[:, 2] - 1 - offsets
+        return self(doc_tensors, words, heads), (starts, ends)
 
     def predict(self,
-                doc: Doc,
+                doc_tensors: DocTensors,
                 words: torch.Tensor,
                 clusters: List[List[int]]) -> List[List[Span]]:
         """
         Predicts span clusters based on the word clusters.
 
         Args:
-            doc (Doc): the document data
+            doc_tensors (DocTensors): static tensors of the document
             words (torch.Tensor): [n_words, emb_size] matrix containing
                 embeddings for each of the words in the text
             clusters (List[List[int]]): a list of clusters where each cluster
@@ -129,13 +160,14 @@ class SpanPredictor(torch.nn.Module):
             return []
 
         heads_ids = torch.tensor(
-            sorted(i for cluster in clusters for i in cluster),
+            sorted({i for cluster in clusters for i in cluster}),
             device=self.device
         )
 
-        scores = self(doc, words, heads_ids)
-        starts = scores[:, :, 0].argmax(dim=1).tolist()
-        ends = (scores[:, :, 1].argmax(dim=1) + 1).tolist()
+        scores = self(doc_tensors, words, heads_ids)
+        offsets = self.sentence_starts(doc_tensors, heads_ids)
+        starts = (scores[:, :, 0].argmax(dim=1) + offsets).tolist()
+        ends = (scores[:, :, 1].argmax(dim=1) + offsets + 1).tolist()
 
         head2span = {
             head: (start, end)
@@ -0,0 +1,162 @@
+""" Describes StageTimer, used to find out where CorefModel.run spends time.
+
+Timings are aggregated per pipeline stage and per document length bucket,
+optionally every document can also be written as a line to a jsonl trace.
+When timing is disabled, CorefModel uses NullTimer, whose methods do nothing.
+
+PhaseClock is a simpler stopwatch used to split a training step into
+the forward pass, the backward pass and the optimizer step.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import time
+from typing import Any, Dict, Optional, TextIO
+
+import torch
+
+
+def length_bucket(n_words: int) -> str:
+    """ Returns a power of two bucket name for the document length,
+    e.g. "256-511" for n_words == 300 """
+    if n_words < 1:
+        return "0"
+    low = 1 << (n_words.bit_length() - 1)
+    return f"{low}-{low * 2 - 1}"
+
+
+class NullTimer:
+    """ A timer that does nothing, used when timing is disabled """
+    enabled = False
+    _null = nullcontext()
+
+    def start_doc(self, n_words: int):
+        """ Does nothing """
+
+    def end_doc(self, doc_id: str):
+        """ Does nothing """
+
+    def stage(self, name: str):  # pylint: disable=unused-argument
+        """ Returns a context manager that does nothing """
+        return self._null
+
+    def summary(self) -> Dict[str, Any]:
+        """ Returns an empty summary """
+        return {}
+
+    def close(self):
+        """ Does nothing """
+
+
+class StageTimer(NullTimer):
+    """ Measures wall time of named stages of document processing.
+
+    Usage:
+        timer.start_doc(n_words)
+        with timer.stage("bertify"):
+            ...
+        timer.end_doc(doc_id)
+    """
+    enabled = True
+
+    def __init__(self, device: str, trace_path: Optional[str] = None):
+        """
+        Args:
+            device (str): the device the model runs on. For cuda devices
+                the timer waits for the kernels to finish at stage boundaries
+            trace_path (str): if set, per-document timings are appended
+                to this file as json lines. It is opened with the first
+                document timed.
+        """
+        self._sync = torch.device(device).type == "cuda"
+        self._trace_path = trace_path
+        self._trace_f: Optional[TextIO] = None
+        self._n_words = 0
+        self._doc_stages: Dict[str, float] = defaultdict(float)
+        # stage -> length bucket -> [n_docs, total seconds]
+        self._totals: Dict[str, Dict[str, list]] = \
+            defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+
+    def start_doc(self, n_words: int):
+        self._n_words = n_words
+        self._doc_stages = defaultdict(float)
+
+    def end_doc(self, doc_id: str):
+        bucket = length_bucket(self._n_words)
+        for name, elapsed in self._doc_stages.items():
+            total = self._totals[name][bucket]
+            total[0] += 1
+            total[1] += elapsed
+        if self._trace_path:
+            if self._trace_f is None:
+                os.makedirs(os.path.dirname(self._trace_path) or ".",
+                            exist_ok=True)
+                self._trace_f = open(self._trace_path, mode="a",
+                                     encoding="utf8")
+            self._trace_f.write(json.dumps({
+                "document_id": doc_id,
+                "n_words": self._n_words,
+                "stages": self._doc_stages
+            }) + "\n")
+
+    @contextmanager
+    def stage(self, name: str):
+        if self._sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._sync:
+                torch.cuda.synchronize()
+            self._doc_stages[name] += time.perf_counter() - start
+
+    def summary(self) -> Dict[str, Any]:
+        """ Returns {stage: {length_bucket: {n_docs, total_s, mean_ms}}} """
+        return {
+            name: {
+                bucket: {"n_docs": n_docs,
+                         "total_s": total,
+                         "mean_ms": total / n_docs * 1000}
+                for bucket, (n_docs, total) in sorted(
+                    buckets.items(), key=lambda item: int(item[0].split("-")[0]))
+            }
+            for name, buckets in self._totals.items()
+        }
+
+    def close(self):
+        if self._trace_f is not None:
+            self._trace_f.close()
+            self._trace_f = None
+
+
+class PhaseClock:
+    """ Adds the time elapsed since the previous lap to a dict of totals.
+    Does nothing if the dict is None.
+
+    Usage:
+        clock = PhaseClock(device, totals)
+        ...
+        clock.lap("forward")
+        ...
+        clock.lap("backward")
+    """
+    def __init__(self, device: str, totals: Optional[Dict[str, float]]):
+        self._totals = totals
+        self._sync = (totals is not None
+                      and torch.device(device).type == "cuda")
+        if self._sync:
+            torch.cuda.synchronize()
+        self._last = time.perf_counter() if totals is not None else 0.0
+
+    def lap(self, name: str):
+        """ Adds the time since the previous lap to totals[name] """
+        if self._totals is None:
+            return
+        if self._sync:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self._totals[name] = self._totals.get(name, 0.0) + now - self._last
+        self._last = now
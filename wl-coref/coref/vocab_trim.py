@@ -0,0 +1,164 @@
+""" Describes vocabulary trimming of the encoder.
+
+Multilingual encoders (e.g. xlm-roberta-base with its 250k subwords) spend
+most of their parameters on the subword embedding matrix, while only a
+small fraction of the subwords ever occurs in Dutch text. A trimmed model
+keeps the embedding rows of the subwords seen in the tokenized corpora
+(see trim_vocab.py), renumbered in the order of the original ids.
+
+The directory of a trimmed model holds the trimmed encoder, the original
+tokenizer and VOCAB_MAP_FILE with the original ids of the kept subwords.
+bert.load_tokenizer wraps the tokenizer of such a directory in
+TrimmedTokenizer, which maps the original ids to the new ones and every
+subword that was not kept to the unknown token.
+"""
+
+from collections import Counter
+import json
+import os
+from typing import Any, Dict, Iterable, List, Sequence, Union
+
+import numpy as np      # type: ignore
+import torch
+
+from coref.const import Doc
+
+
+VOCAB_MAP_FILE = "vocab_map.json"
+
+
+class TrimmedTokenizer:
+    """ Wraps a tokenizer to produce the ids of a trimmed vocabulary.
+    Everything but the ids is delegated to the wrapped tokenizer. """
+
+    def __init__(self, tokenizer: Any, kept_ids: Sequence[int]):
+        self.tokenizer = tokenizer
+        self.kept_ids = np.asarray(kept_ids, dtype=np.int64)
+        fallback = int(np.searchsorted(self.kept_ids, tokenizer.unk_token_id))
+        if self.kept_ids[fallback] != tokenizer.unk_token_id:
+            raise ValueError("the trimmed vocabulary lacks the unknown token")
+        self.old_to_new = np.full(len(tokenizer), fallback, dtype=np.int64)
+        self.old_to_new[self.kept_ids] = np.arange(len(self.kept_ids))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.tokenizer, name)
+
+    def __len__(self) -> int:
+        return len(self.kept_ids)
+
+    @property
+    def cls_token_id(self) -> int:
+        return self.map_id(self.tokenizer.cls_token_id)
+
+    @property
+    def sep_token_id(self) -> int:
+        return self.map_id(self.tokenizer.sep_token_id)
+
+    @property
+    def pad_token_id(self) -> int:
+        return self.map_id(self.tokenizer.pad_token_id)
+
+    @property
+    def unk_token_id(self) -> int:
+        return self.map_id(self.tokenizer.unk_token_id)
+
+    def map_id(self, old_id: int) -> int:
+        """ Returns the trimmed id of an id of the original vocabulary """
+        return int(self.old_to_new[old_id])
+
+    def convert_tokens_to_ids(self, tokens: Union[str, List[str]]
+                              ) -> Union[int, List[int]]:
+        """ Same as the tokenizer's method, with the trimmed ids """
+        ids = self.tokenizer.convert_tokens_to_ids(tokens)
+        if isinstance(ids, int):
+            return self.map_id(ids)
+        return self.old_to_new[np.asarray(ids, dtype=np.int64)].tolist()
+
+    def convert_ids_to_tokens(self, ids: Union[int, List[int]]
+                              ) -> Union[str, List[str]]:
+        """ Same as the tokenizer's method, with the trimmed ids """
+        if isinstance(ids, int):
+            return self.tokenizer.convert_ids_to_tokens(
+                int(self.kept_ids[ids]))
+        return self.tokenizer.convert_ids_to_tokens(
+            self.kept_ids[np.asarray(ids, dtype=np.int64)].tolist())
+
+    def get_vocab(self) -> Dict[str, int]:
+        """ Returns the kept subwords with their trimmed ids """
+        tokens = self.tokenizer.convert_ids_to_tokens(self.kept_ids.tolist())
+        return {token: i for i, token in enumerate(tokens)}
+
+
+def count_subword_ids(docs: Iterable[Doc]) -> Counter:
+    """ Counts the occurrences of subword ids in tokenized documents """
+    counts: Counter = Counter()
+    for doc in docs:
+        counts.update(np.asarray(doc["subword_ids"], dtype=np.int64).tolist())
+    return counts
+
+
+def select_ids(counts: Counter, tokenizer: Any, min_count: int = 1
+               ) -> List[int]:
+    """ Returns the sorted ids of the subwords to keep: the special tokens
+    and those occurring at least min_count times """
+    kept = {subword_id for subword_id, count in counts.items()
+            if count >= min_count}
+    kept.update(tokenizer.all_special_ids)
+    return sorted(kept)
+
+
+def load_kept_ids(directory: str) -> List[int]:
+    """ Returns the original ids of the subwords kept in a trimmed model """
+    with open(os.path.join(directory, VOCAB_MAP_FILE),
+              mode="r", encoding="utf8") as f:
+        return json.load(f)["kept_ids"]
+
+
+def load_source(directory: str) -> str:
+    """ Returns the name of the model a trimmed model was trimmed from """
+    with open(os.path.join(directory, VOCAB_MAP_FILE),
+              mode="r", encoding="utf8") as f:
+        return json.load(f)["source"]
+
+
+def save_kept_ids(directory: str, kept_ids: Sequence[int], source: str):
+    """ Writes the original ids of the subwords kept in a trimmed model """
+    with open(os.path.join(directory, VOCAB_MAP_FILE),
+              mode="w", encoding="utf8") as f:
+        json.dump({"source": source, "kept_ids": list(kept_ids)}, f)
+
+
+def trim_embeddings(model: torch.nn.Module, kept_ids: Sequence[int]):
+    """ Keeps the rows of kept_ids in the input embeddings of a transformers
+    model, and renumbers the special token ids of its config """
+    old_to_new = {old_id: new_id for new_id, old_id in enumerate(kept_ids)}
+    embeddings = model.get_input_embeddings()
+    padding_idx = embeddings.padding_idx
+    if padding_idx is not None:
+        padding_idx = old_to_new[padding_idx]
+    trimmed = torch.nn.Embedding(len(kept_ids), embeddings.embedding_dim,
+                                 padding_idx=padding_idx).to(
+                                     embeddings.weight.device)
+    with torch.no_grad():
+        trimmed.weight.copy_(embeddings.weight[list(kept_ids)])
+    model.set_input_embeddings(trimmed)
+
+    # Roberta-like models compute positions from the padding id
+    model_embeddings = getattr(model, "embeddings", None)
+    if getattr(model_embeddings, "padding_idx", None) is not None:
+        model_embeddings.padding_idx = padding_idx
+    model.config.vocab_size = len(kept_ids)
+    for key in ("pad_token_id", "bos_token_id", "eos_token_id"):
+        if getattr(model.config, key, None) is not None:
+            setattr(model.config, key, old_to_new[getattr(model.config, key)])
+
+
+def trim_weights(tensors: Dict[str, torch.Tensor],
+                 embedding_name: str,
+                 kept_ids: Sequence[int]) -> Dict[str, torch.Tensor]:
+    """ Keeps the rows of kept_ids in the embedding matrix of flat
+    checkpoint weights (see checkpoint.flatten) """
+    tensors = dict(tensors)
+    tensors[embedding_name] = \
+        tensors[embedding_name][torch.as_tensor(list(kept_ids))].contiguous()
+    return tensors
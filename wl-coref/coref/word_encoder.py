@@ -6,7 +6,7 @@ from typing import Tuple
 import torch
 
 from coref.config import Config
-from coref.const import Doc
+from coref.doc_tensors import DocTensors
 
 
 class WordEncoder(torch.nn.Module):  # pylint: disable=too-many-instance-attributes
@@ -30,14 +30,14 @@ class WordEncoder(torch.nn.Module):  # pylint: disable=too-many-instance-attribu
         return next(self.attn.parameters()).device
 
     def forward(self,  # type: ignore  # pylint: disable=arguments-differ  #35566 in pytorch
-                doc: Doc,
+                doc_tensors: DocTensors,
                 x: torch.Tensor,
                 ) -> Tuple[torch.Tensor, ...]:
         """
         Extracts word representations from text.
 
         Args:
-            doc: the document data
+            doc_tensors: static tensors of the document
             x: a tensor containing bert output, shape (n_subtokens, bert_dim)
 
         Returns:
@@ -46,8 +46,7 @@ class WordEncoder(torch.nn.Module):  # pylint: disable=too-many-instance-attribu
             cluster_ids: tensor of shape [n_words], containing cluster indices
                 for each word. Non-coreferent words have cluster id of zero.
         """
-        word_boundaries = torch.tensor(doc["word2subword"], device=self.device)
-        #print(f"word boundaries shape : {word_boundaries.size()}")
+        word_boundaries = doc_tensors.word2subword
         starts = word_boundaries[:, 0]
         ends = word_boundaries[:, 1]
 
@@ -56,7 +55,7 @@ class WordEncoder(torch.nn.Module):  # pylint: disable=too-many-instance-attribu
 
         words = self.dropout(words)
 
-        return (words, self._cluster_ids(doc))
+        return (words, doc_tensors.cluster_ids)
 
     def _attn_scores(self,
                      bert_out: torch.Tensor,
@@ -88,22 +87,3 @@ class WordEncoder(torch.nn.Module):  # pylint: disable=too-many-instance-attribu
         attn_scores = attn_mask + attn_scores
         del attn_mask
         return torch.softmax(attn_scores, dim=1)  # [n_words, n_subtokens]
-
-    def _cluster_ids(self, doc: Doc) -> torch.Tensor:
-        """
-        Args:
-            doc: document information
-
-        Returns:
-            torch.Tensor of shape [n_word], containing cluster indices for
-                each word. Non-coreferent words have cluster id of zero.
-        """
-        word2cluster = {word_i: i
-                        for i, cluster in enumerate(doc["word_clusters"], start=1)
-                        for word_i in cluster}
-
-        return torch.tensor(
-            [word2cluster.get(word_i, 0)
-             for word_i in range(len(doc["cased_words"]))],
-            device=self.device
-        )
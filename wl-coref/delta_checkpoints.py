@@ -0,0 +1,133 @@
+""" Stores saved models as deltas against a shared base checkpoint.
+
+Variants fine-tuned from the same model (e.g. the regular model and its
+CDA, delexicalised or neopronoun fine-tunes) differ from it by small
+changes of the weights. Stored as deltas (see coref/delta.py), they take a
+fraction of the space and are loaded by CorefModel.load_weights as usual.
+
+Deltas only keep the weights. compress --remove refuses to delete
+checkpoints holding optimizer, scheduler or resume states (those saved by
+torch.save during training and the latest "safetensors" checkpoint of a
+run); release them first with release_weights.py if they are not needed.
+
+  Usage examples:
+
+  # A base made of the checkpoint the variants were fine-tuned from
+  python delta_checkpoints.py base data/base.safetensors \\
+      --from data/model_checkpoints/regular/xlm-roberta_e20.pt
+
+  # ...or of the pretrained encoder of a config section
+  python delta_checkpoints.py base data/base.safetensors --section xlm-roberta
+
+  python delta_checkpoints.py compress data/base.safetensors \\
+      data/model_checkpoints/*/*.pt
+  python delta_checkpoints.py expand data/model_checkpoints/cda/xlm-roberta_e5.delta
+"""
+
+import argparse
+import os
+import time
+import torch
+
+from coref import CorefModel, checkpoint, delta
+
+
+def make_base(args: argparse.Namespace):
+    """ Writes the base checkpoint """
+    if args.from_path:
+        tensors, metadata = checkpoint.read_weights(args.from_path)
+        metadata = dict(metadata, source=args.from_path)
+    else:
+        model = CorefModel(args.config_file, args.section,
+                           build_optimizers=False)
+        tensors = checkpoint.flatten({"bert": model.bert.state_dict()})
+        metadata = {"bert_model": model.config.bert_model}
+    checkpoint.save_tensors(args.out, tensors, metadata)
+    print(f"Base written to {args.out}")
+
+
+def compress(args: argparse.Namespace):
+    """ Writes every checkpoint as a delta against the base """
+    if args.remove:
+        stateful = [path for path in args.checkpoints
+                    if checkpoint.holds_training_state(path)]
+        if stateful:
+            raise ValueError(f"Not removing {', '.join(stateful)}: deltas"
+                             f" do not keep their optimizer, scheduler or"
+                             f" resume states. Run without --remove")
+    total_before = total_after = 0
+    for path in args.checkpoints:
+        if path.endswith(checkpoint.DELTA_SUFFIX):
+            continue
+        tensors, metadata = checkpoint.read_weights(path)
+        out_path = f"{os.path.splitext(path)[0]}{checkpoint.DELTA_SUFFIX}"
+        start = time.perf_counter()
+        delta.save_delta(out_path, tensors, args.base, metadata)
+        elapsed = time.perf_counter() - start
+
+        restored, _ = delta.load_delta(out_path, args.base)
+        if (restored.keys() != tensors.keys()
+                or any(not torch.equal(restored[key], tensor)
+                       for key, tensor in tensors.items())):
+            raise RuntimeError(f"{out_path} does not restore {path}")
+
+        before, after = os.path.getsize(path), os.path.getsize(out_path)
+        total_before += before
+        total_after += after
+        print(f"{path}: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB"
+              f" ({elapsed:.1f} s)")
+        if args.remove:
+            os.remove(path)
+    if total_after:
+        print(f"Total: {total_before / 2 ** 20:.1f} MB ->"
+              f" {total_after / 2 ** 20:.1f} MB"
+              f" ({total_before / total_after:.1f}x smaller)")
+
+
+def expand(args: argparse.Namespace):
+    """ Writes a delta checkpoint as a full one """
+    tensors, metadata = delta.load_delta(args.delta, args.base)
+    for key in ("base", "base_fingerprint"):
+        metadata.pop(key)
+    out = args.out or \
+        f"{os.path.splitext(args.delta)[0]}{checkpoint.SUFFIX}"
+    checkpoint.save_tensors(out, tensors, metadata)
+    print(f"Written to {out}")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    base_parser = subparsers.add_parser(
+        "base", help="Create a base checkpoint")
+    base_parser.add_argument("out", help="Path of the .safetensors to write")
+    source = base_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from", dest="from_path",
+                        help="Checkpoint to use as the base")
+    source.add_argument("--section",
+                        help="Config section whose pretrained encoder to use"
+                             " as the base")
+    base_parser.add_argument("--config-file", default="config.toml")
+    base_parser.set_defaults(func=make_base)
+
+    compress_parser = subparsers.add_parser(
+        "compress", help="Save checkpoints as deltas next to them")
+    compress_parser.add_argument("base")
+    compress_parser.add_argument("checkpoints", nargs="+")
+    compress_parser.add_argument("--remove", action="store_true",
+                                 help="Delete the original checkpoints once"
+                                      " the deltas are verified. Refused for"
+                                      " checkpoints holding training state")
+    compress_parser.set_defaults(func=compress)
+
+    expand_parser = subparsers.add_parser(
+        "expand", help="Write a delta checkpoint as a full one")
+    expand_parser.add_argument("delta")
+    expand_parser.add_argument("--out")
+    expand_parser.add_argument("--base",
+                               help="Overrides the stored base path")
+    expand_parser.set_defaults(func=expand)
+
+    args = argparser.parse_args()
+    args.func(args)
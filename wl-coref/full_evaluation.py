@@ -6,6 +6,7 @@ import json
 from typing import Dict, Generator, List
 import argparse
 from run import eval
+from coref.pronouns import third_person_pronoun
 
 WORD_PATTERN = re.compile(r"(?:^(?!#).+$\n?)", flags=re.M) 
 COREF_PATTERN = re.compile(r"\([0-9]*\)",flags=re.M)
@@ -18,25 +19,6 @@ setting_dict = {
                 'gi'  : ['hen', 'hun', 'die', 'diens']
                }
 
-def third_person_pronoun(word,postag, pronoun_list):
-    if 'excl' not in postag and 'onbep' not in postag and 'betr' not in postag and 'aanw' not in postag and "vb" not in postag:
-        if 'mv' not in postag :
-            try: 
-                number = re.search(re.compile(r"[1-3]", flags=re.M), postag)[0]
-
-                if number == '3':
-                    gender = postag[-4:].replace("|","")
-                    if word.lower()  == 'men':
-                        return False
-                    if gender not in ['fem', 'masc']:
-                        if word.lower() not in pronoun_list:
-                            return False
-                    return True
-                else:
-                    return False
-            except:
-                    print(f"FAil for {word, postag}")   
-
 def split_mention(mention : str) -> str:
     return mention.replace('(','').replace(')','')
 
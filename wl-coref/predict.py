@@ -1,17 +1,21 @@
 import argparse
+import cProfile
+import json
 
 import jsonlines
 import torch
 from tqdm import tqdm
 
-from coref import CorefModel
+from coref import CorefModel, bert, checkpoint
+from coref.doc_tensors import build_doc_tensors
+from coref.pronouns import third_person_pronouns
 from coref.tokenizer_customization import *
 
 
 def build_doc(doc: dict, model: CorefModel) -> dict:
-    filter_func = TOKENIZER_FILTERS.get(model.config.bert_model,
-                                        lambda _: True)
-    token_map = TOKENIZER_MAPS.get(model.config.bert_model, {})
+    tokenizer_name = bert.tokenizer_name(model.config)
+    filter_func = TOKENIZER_FILTERS.get(tokenizer_name, lambda _: True)
+    token_map = TOKENIZER_MAPS.get(tokenizer_name, {})
 
     word2subword = []
     subwords = []
@@ -26,6 +30,7 @@ def build_doc(doc: dict, model: CorefModel) -> dict:
         word_id.extend([i] * len(tokenized_word))
     doc["word2subword"] = word2subword
     doc["subwords"] = subwords
+    doc["subword_ids"] = model.tokenizer.convert_tokens_to_ids(subwords)
     doc["word_id"] = word_id
 
     doc["head2span"] = []
@@ -33,6 +38,7 @@ def build_doc(doc: dict, model: CorefModel) -> dict:
         doc["speaker"] = ["_" for _ in doc["cased_words"]]
     doc["word_clusters"] = []
     doc["span_clusters"] = []
+    doc["tensors"] = build_doc_tensors(doc).to(model.config.device)
 
     return doc
 
@@ -46,21 +52,58 @@ if __name__ == "__main__":
     argparser.add_argument("--batch-size", type=int,
                            help="Adjust to override the config value if you're"
                                 " experiencing out-of-memory issues")
+    argparser.add_argument("--a-scoring-memory", type=float, metavar="MB",
+                           help="Choose the antecedent scoring batch size for"
+                                " each document so that scoring takes at most"
+                                " MB megabytes. Overrides '--batch-size'.")
     argparser.add_argument("--weights",
                            help="Path to file with weights to load."
                                 " If not supplied, in the latest"
                                 " weights of the experiment will be loaded;"
                                 " if there aren't any, an error is raised.")
+    argparser.add_argument("--pronouns-only", action="store_true",
+                           help="If set, only resolve the third person"
+                                " pronouns scored by full_evaluation.py (see"
+                                " coref/pronouns.py) with CorefModel.resolve"
+                                " and write their antecedents as"
+                                " 'pronoun_antecedents' instead of clusters")
+    argparser.add_argument("--timing", action="store_true",
+                           help="If set, measure the time spent in each stage"
+                                " of the pipeline and print a summary")
+    argparser.add_argument("--timing-trace", action="store_true",
+                           help="If set, also write per-document stage"
+                                " timings to <output_file>_timing.jsonl."
+                                " Implies '--timing'.")
+    argparser.add_argument("--profile", type=int, default=0, metavar="N",
+                           help="If set, profile the first N documents with"
+                                " torch.profiler and cProfile and write the"
+                                " results to <output_file>_profile")
     args = argparser.parse_args()
 
+    host_profiler = None
+    if args.profile:
+        host_profiler = cProfile.Profile()
+        host_profiler.enable()
+
     model = CorefModel(args.config_file, args.experiment, build_optimizers=False)
 
     if args.batch_size:
         model.config.a_scoring_batch_size = args.batch_size
+    if args.a_scoring_memory:
+        model.config.a_scoring_memory_budget = args.a_scoring_memory
+    if args.timing or args.timing_trace:
+        model.config.stage_timing = True
+    if args.timing_trace:
+        model.config.stage_timing_trace = True
+        model.config.logs_file = f"{args.output_file}.json"
+    if model.config.stage_timing:
+        model.enable_timing()
+    if args.profile:
+        model.enable_profiling(args.profile, f"{args.output_file}_profile",
+                               host_profiler)
 
     model.load_weights(path=args.weights, map_location="cpu",
-                       ignore={"bert_optimizer", "general_optimizer",
-                               "bert_scheduler", "general_scheduler"})
+                       ignore=checkpoint.TRAINING_STATE_KEYS)
     model.training = False
 
     with jsonlines.open(args.input_file, mode="r") as input_data:
@@ -68,12 +111,27 @@ if __name__ == "__main__":
 
     with torch.no_grad():
         for doc in tqdm(docs, unit="docs"):
-            result = model.run(doc)
-            doc["span_clusters"] = result.span_clusters
-            doc["word_clusters"] = result.word_clusters
-
-            for key in ("word2subword", "subwords", "word_id", "head2span"):
+            if args.pronouns_only:
+                result = model.resolve(doc, third_person_pronouns(doc),
+                                       predict_spans=True)
+                doc["pronoun_antecedents"] = [
+                    {"word": word, "span": result.spans[word][0],
+                     "antecedents": chain,
+                     "antecedent_spans": result.spans[word][1:]}
+                    for word, chain in result.chains.items()]
+                del doc["span_clusters"], doc["word_clusters"]
+            else:
+                result = model.run(doc)
+                doc["span_clusters"] = result.span_clusters
+                doc["word_clusters"] = result.word_clusters
+
+            for key in ("word2subword", "subwords", "subword_ids", "word_id",
+                        "head2span", "tensors"):
                 del doc[key]
 
     with jsonlines.open(args.output_file, mode="w") as output_data:
         output_data.write_all(docs)
+
+    model.timer.close()
+    if model.timer.enabled:
+        print(json.dumps(model.timer.summary(), indent=2))
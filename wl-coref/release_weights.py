@@ -1,28 +1,106 @@
-""" Takes a saved model and re-saves it without optimizer and scheduler weights
-to save space """
+""" Takes a saved model and writes a release version of it: the weights only,
+without optimizer and scheduler states, in the memory-mappable format of
+coref/checkpoint.py, so that CorefModel.load_weights maps it lazily.
+
+The tensors are written one at a time, optionally cast to float16 or, for
+the task-specific heads (everything but the encoder), quantized to int8
+with per-row scales. The config section and the identity of the tokenizer
+are recorded in the file.
+
+  Usage example:
+
+  python release_weights.py data/model_checkpoints/regular/xlm-roberta_e20.pt \\
+      --section xlm-roberta --dtype fp16 --int8-heads
+"""
 
 import argparse
+import functools
+import json
 import os
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
 
 import torch
 
+from coref import bert, checkpoint
+from coref.coref_model import CorefModel
+
+
+Spec = Tuple[str, torch.dtype, Sequence[int], Callable[[], torch.Tensor]]
+
+
+def release_specs(tensors: Dict[str, torch.Tensor],
+                  dtype: str,
+                  int8_heads: bool) -> List[Spec]:
+    """ Returns what to write for every tensor, see write_tensors() """
+    specs: List[Spec] = []
+    for name, tensor in tensors.items():
+        if (int8_heads and not name.startswith("bert.")
+                and tensor.dim() == 2 and tensor.is_floating_point()):
+            quantized = functools.lru_cache(maxsize=1)(
+                functools.partial(checkpoint.quantize_int8, tensor))
+            specs.append((name, torch.int8, tensor.shape,
+                          lambda quantized=quantized: quantized()[0]))
+            specs.append((f"{name}{checkpoint.SCALE_SUFFIX}", torch.float32,
+                          (tensor.shape[0], 1),
+                          lambda quantized=quantized: quantized()[1]))
+        elif dtype == "fp16" and tensor.dtype == torch.float32:
+            specs.append((name, torch.float16, tensor.shape,
+                          lambda tensor=tensor: tensor.half()))
+        else:
+            specs.append((name, tensor.dtype, tensor.shape,
+                          lambda tensor=tensor: tensor))
+    return specs
+
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument("path", help="Path to saved model weights")
+    argparser.add_argument("--config-file", default="config.toml")
+    argparser.add_argument("--section",
+                           help="The config section the model was trained"
+                                " with. Defaults to the one recorded in the"
+                                " checkpoint, if any.")
+    argparser.add_argument("--dtype", choices=("fp32", "fp16"),
+                           default="fp32",
+                           help="Cast floating point weights to this type")
+    argparser.add_argument("--int8-heads", action="store_true",
+                           help="Quantize the weight matrices of all modules"
+                                " but the encoder to int8")
+    argparser.add_argument("--out",
+                           help="Output path, defaults to"
+                                " {input}_release.safetensors")
     args = argparser.parse_args()
 
-    state_dict = torch.load(args.path)
-    for key in ("general_optimizer", "general_scheduler",
-                "bert_optimizer", "bert_scheduler"):
-        state_dict.pop(key, None)
+    start = time.perf_counter()
+    tensors, metadata = checkpoint.read_weights(args.path)
+    section = args.section or metadata.get("section")
+    if section is None:
+        argparser.error("the checkpoint does not record its config section,"
+                        " please specify --section")
+
+    config = CorefModel._load_config(  # pylint: disable=protected-access
+        args.config_file, section)
+    tokenizer = bert.load_tokenizer(config)
 
-    dirname = os.path.dirname(args.path)
-    filename = os.path.basename(args.path)
-    filename, extension = os.path.splitext(filename)
-    result_filename = f"{filename}_release{extension}"
-    result_path = os.path.join(dirname, result_filename)
+    release_metadata = {
+        "epochs_trained": metadata.get("epochs_trained", "0"),
+        "section": section,
+        "config": json.dumps(vars(config)),
+        "bert_model": config.bert_model,
+        **bert.tokenizer_identity(tokenizer),
+        "dtype": args.dtype,
+        "int8_heads": str(args.int8_heads),
+    }
 
+    result_path = args.out or \
+        f"{os.path.splitext(args.path)[0]}_release{checkpoint.SUFFIX}"
     print(f"Writing result to {result_path}")
+    checkpoint.write_tensors(
+        result_path, release_specs(tensors, args.dtype, args.int8_heads),
+        release_metadata)
 
-    torch.save(state_dict, result_path)
+    before = os.path.getsize(args.path) / 2 ** 20
+    after = os.path.getsize(result_path) / 2 ** 20
+    print(f"{before:.1f} MB -> {after:.1f} MB"
+          f" in {time.perf_counter() - start:.1f} s")
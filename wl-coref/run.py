@@ -4,6 +4,7 @@ Try 'python run.py -h' for more details.
 """
 
 import argparse
+import cProfile
 from contextlib import contextmanager
 import datetime
 import random
@@ -11,13 +12,12 @@ import sys
 import time
 import os
 import shutil
-import psutil
 
 import numpy as np  # type: ignore
 import torch        # type: ignore
 import json
 
-from coref import CorefModel
+from coref import CorefModel, checkpoint
 
 
 @contextmanager
@@ -61,8 +61,7 @@ def eval(modelname, data_split, weights, config_file='config.toml', lr=3e-4, ber
 
     model.config.data_type = os.path.splitext(os.path.basename(model.config.__dict__[f"{data_split}_data"]))[0]
     model.load_weights(path=weights, map_location="cpu",
-                           ignore={"bert_optimizer", "general_optimizer",
-                                   "bert_scheduler", "general_scheduler"})
+                           ignore=checkpoint.TRAINING_STATE_KEYS)
 
     model.evaluate(data_split,
                        word_level_conll=False)#args.word_level)
@@ -76,7 +75,7 @@ def eval(modelname, data_split, weights, config_file='config.toml', lr=3e-4, ber
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("mode", choices=("train", "eval"))
+    argparser.add_argument("mode", choices=("train", "eval", "bench-train"))
     argparser.add_argument("experiment")
     argparser.add_argument("modelname")
     argparser.add_argument("--config-file", default="config.toml")
@@ -88,9 +87,15 @@ if __name__ == "__main__":
     argparser.add_argument("--batch-size", type=int,
                            help="Adjust to override the config value if you're"
                                 " experiencing out-of-memory issues")
+    argparser.add_argument("--a-scoring-memory", type=float, metavar="MB",
+                           help="Choose the antecedent scoring batch size for"
+                                " each document so that scoring takes at most"
+                                " MB megabytes. Overrides '--batch-size'.")
     argparser.add_argument("--warm-start", action="store_true",
                            help="If set, the training will resume from the"
-                                " last checkpoint saved if any. Ignored in"
+                                " last checkpoint saved if any, continuing"
+                                " mid-epoch if a resume_every checkpoint is"
+                                " newer than the last epoch. Ignored in"
                                 " evaluation modes."
                                 " Incompatible with '--weights'.")
     argparser.add_argument("--weights",
@@ -114,8 +119,81 @@ if __name__ == "__main__":
                           help="Adjust to override the path to the dev dataset")
     argparser.add_argument("--testdata", type=str, 
                           help="Adjust to override the path to the test dataset") 
+    argparser.add_argument("--timing", action="store_true",
+                           help="If set, measure the time spent in each stage"
+                                " of the pipeline and store it in the logs"
+                                " file (same as stage_timing in the config)")
+    argparser.add_argument("--timing-trace", action="store_true",
+                           help="If set, also write per-document stage"
+                                " timings to a jsonl file next to the logs"
+                                " file. Implies '--timing'.")
+    argparser.add_argument("--profile", type=int, default=0, metavar="N",
+                           help="If set, profile the first N documents with"
+                                " torch.profiler and cProfile and write chrome"
+                                " traces and summary tables to a directory"
+                                " next to the logs file")
+    argparser.add_argument("--async-dev-eval", action="store_true",
+                           help="If set, evaluate each epoch's checkpoint on"
+                                " the dev data in a separate process while"
+                                " training continues (same as async_dev_eval"
+                                " in the config)")
+    argparser.add_argument("--dev-eval-fraction", type=float,
+                           help="Evaluate each epoch on this fraction of the"
+                                " dev documents first and on all of them only"
+                                " if the result is too close to the best"
+                                " epoch (overrides dev_eval_fraction)")
+    argparser.add_argument("--bench-steps", type=int, default=20,
+                           help="bench-train: the number of measured"
+                                " optimizer steps")
+    argparser.add_argument("--bench-warmup", type=int, default=2,
+                           help="bench-train: steps done before measuring")
+    argparser.add_argument("--bench-finetune", choices=("on", "off", "both"),
+                           help="bench-train: bert_finetune settings to"
+                                " measure. Defaults to the config value.")
+    argparser.add_argument("--bench-batch-sizes", type=int, nargs="+",
+                           help="bench-train: a_scoring_batch_size values to"
+                                " measure. Defaults to the config value.")
+    argparser.add_argument("--bench-embedding-updates", nargs="+",
+                           choices=("dense", "sparse", "frozen"),
+                           help="bench-train: bert_embedding_updates values"
+                                " to compare, defaults to the config value")
+    argparser.add_argument("--bench-optimizers", nargs="+",
+                           choices=("adam", "adam8bit", "factored"),
+                           help="bench-train: optimizers to compare (used as"
+                                " both bert_optimizer and general_optimizer),"
+                                " defaults to the config values")
+    argparser.add_argument("--bench-data",
+                           help="bench-train: jsonlines file with documents"
+                                " to train on. If not supplied, synthetic"
+                                " documents are generated.")
+    argparser.add_argument("--bench-docs", type=int, default=8,
+                           help="bench-train: number of synthetic documents")
+    argparser.add_argument("--bench-words", type=int, default=500,
+                           help="bench-train: words per synthetic document")
+    argparser.add_argument("--bench-tiny", action="store_true",
+                           help="bench-train: replace bert_model with a tiny"
+                                " randomly initialized encoder")
     args = argparser.parse_args()
 
+    if args.mode == "bench-train":
+        # modelname is used as the name of the results file
+        from bench.training import bench_train
+        finetune_settings = {None: None, "on": [True], "off": [False],
+                             "both": [True, False]}[args.bench_finetune]
+        bench_results = bench_train(
+            args.config_file, args.experiment,
+            steps=args.bench_steps, warmup=args.bench_warmup,
+            finetune=finetune_settings, batch_sizes=args.bench_batch_sizes,
+            embedding_updates=args.bench_embedding_updates,
+            optimizers=args.bench_optimizers,
+            data=args.bench_data, n_docs=args.bench_docs,
+            n_words=args.bench_words, tiny=args.bench_tiny, seed=args.seed)
+        bench_path = f"{args.modelname}_bench_train.json"
+        with open(bench_path, "w") as outfile:
+            json.dump(bench_results, outfile, indent=2)
+        print(f"Results written to {bench_path}")
+        sys.exit()
+
 
     if args.warm_start and args.weights is not None:
         print("The following options are incompatible:"
@@ -123,6 +201,11 @@ if __name__ == "__main__":
         sys.exit(1)
 
     seed(args.seed)
+    host_profiler = None
+    if args.profile:
+        # Started here to also cover model loading and tokenization
+        host_profiler = cProfile.Profile()
+        host_profiler.enable()
     print("start to create model")
     model = CorefModel(args.config_file, args.experiment, args.lr, args.bertlr)
     print("created model")
@@ -140,8 +223,8 @@ if __name__ == "__main__":
     model.config.data_type = os.path.splitext(os.path.basename(model.config.__dict__[f"{args.data_split}_data"]))[0]
     model.config.logs_file = os.path.join(model.config.logs_dir, (model.config.model_name + '.json'))
     model_path = os.path.join(model.config.model_dir, model.config.model_name)
-    )
-    if os.path.exists(model.config.logs_file) and args.mode == "train":
+    if (os.path.exists(model.config.logs_file) and args.mode == "train"
+            and not args.warm_start):
         response = input(f"a model with the name {model.config.model_name} already exists!"
                          f" Enter 'yes' to delete it or anything to exit: ")
         if response != "yes":
@@ -155,6 +238,20 @@ if __name__ == "__main__":
 
     if args.batch_size:
         model.config.a_scoring_batch_size = args.batch_size
+    if args.a_scoring_memory:
+        model.config.a_scoring_memory_budget = args.a_scoring_memory
+    if args.timing or args.timing_trace:
+        model.config.stage_timing = True
+    if args.timing_trace:
+        model.config.stage_timing_trace = True
+    if model.config.stage_timing:
+        model.enable_timing()
+    if args.profile:
+        model.enable_profiling(args.profile, host_profiler=host_profiler)
+    if args.dev_eval_fraction:
+        model.config.dev_eval_fraction = args.dev_eval_fraction
+    if args.async_dev_eval:
+        model.config.async_dev_eval = True
     if args.epochs:
         model.config.train_epochs = args.epochs
     if args.devdata:
@@ -175,29 +272,36 @@ if __name__ == "__main__":
         model.train_logs['seed'] = args.seed
 
 
-        if args.weights is not None or args.warm_start:
-            model.load_weights(path=args.weights, map_location="cpu",
-                               noexception=args.warm_start)
+        if args.warm_start:
+            model.resume()
+        elif args.weights is not None:
+            model.load_weights(path=args.weights, map_location="cpu")
         with output_running_time():
             print("start training model")
             model.train()
+        model.timer.close()
 
         dev_f1s = [epoch['sl_f1'] for epoch in model.train_logs['dev_eval']]
         best_epoch = dev_f1s.index(max(dev_f1s))
-        model.train_logs['best_epoch_path'] =  model.train_logs["checkpoint_paths"][best_epoch]
+        model.train_logs['best_epoch_path'] = model.train_logs['dev_eval'][best_epoch].get(
+            'checkpoint_path', model.train_logs["checkpoint_paths"][best_epoch])
+        # False if the best epoch was only scored on a sample of the dev data
+        model.train_logs['best_epoch_exact'] = not model.train_logs['dev_eval'][best_epoch].get('approx', False)
 
         with open(model.config.logs_file, "w") as outfile: # store model details in log file (ADDED)
             json.dump(model.train_logs, outfile, indent=2)
     else:
         model.load_weights(path=args.weights, map_location="cpu",
-                           ignore={"bert_optimizer", "general_optimizer",
-                                   "bert_scheduler", "general_scheduler"})
+                           ignore=checkpoint.TRAINING_STATE_KEYS)
         model.evaluate(data_split=args.data_split,
                        word_level_conll=args.word_level)
+        model.timer.close()
 
         with open(model.config.logs_file, "r+") as outfile: # store additional eval results in logs file (ADDED)
             data = json.load(outfile)
             data[f'{model.config.test_data}_eval'] = model.train_logs[f'{args.data_split}_eval']
+            if model.timer.enabled:
+                data[f'{model.config.test_data}_stage_timing'] = model.train_logs['stage_timing']
         
         with open(model.config.logs_file, "w") as outfile:
             json.dump(data, outfile, indent=2)
@@ -0,0 +1,236 @@
+""" Tries shallower and narrower encoders for faster (cpu) inference.
+
+For every combination of the number of layers kept and the share of
+attention heads pruned, a trained model is slimmed (see bert.slim_bert),
+optionally fine-tuned for a few epochs with CorefModel.train() and
+evaluated. Heads are pruned in the order of their importance, estimated on
+training documents as the absolute gradient of the coreference loss with
+respect to a gate on every head (Michel et al., 2019). The latency of
+CorefModel.run, LEA and the pronoun score are reported for every setting.
+
+A slimmed model is loaded by a config section with the bert_layers and
+bert_pruned_heads values printed for it.
+
+  Usage example:
+
+  python slim_encoder.py xlm-roberta \\
+      --weights data/model_checkpoints/regular/xlm-roberta_e20.pt \\
+      --layers 12 9 6 --prune-heads 0 0.25 0.5 --device cpu \\
+      --finetune-epochs 1 --out slimming.json
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Sequence
+
+import torch
+
+from bench.inference import latency_stats
+from coref import CorefModel, bert, checkpoint
+from coref.approx_eval import pronoun_counts
+from coref.cluster_checker import ClusterChecker
+from coref.const import Doc
+
+
+def head_importance(model: CorefModel, docs: Sequence[Doc]) -> torch.Tensor:
+    """ Returns the importance of every attention head of the encoder,
+    [n_layers, n_heads], normalized within every layer """
+    layers = model.bert.encoder.layer
+    n_heads = model.bert.config.num_attention_heads
+    gates = torch.ones(len(layers), n_heads, device=model.config.device,
+                       requires_grad=True)
+
+    def gate_heads(layer_id, _, inputs):
+        context = inputs[0]
+        gated = context.view(*context.shape[:-1], n_heads, -1) \
+            * gates[layer_id, :, None]
+        return (gated.view(context.shape), *inputs[1:])
+
+    hooks = [layer.attention.output.dense.register_forward_pre_hook(
+                 lambda module, inputs, layer_id=layer_id:
+                 gate_heads(layer_id, module, inputs))
+             for layer_id, layer in enumerate(layers)]
+    params = [param for module in model.trainable.values()
+              for param in module.parameters()]
+    requires_grad = [param.requires_grad for param in params]
+    for param in params:
+        param.requires_grad = False
+
+    model.training = False
+    importance = torch.zeros_like(gates)
+    try:
+        for doc in docs:
+            res = model.run(doc)
+            loss = model._coref_criterion(  # pylint: disable=protected-access
+                res.coref_scores, res.coref_y)
+            gate_grad, = torch.autograd.grad(loss, gates)
+            importance += gate_grad.abs()
+    finally:
+        for hook in hooks:
+            hook.remove()
+        for param, value in zip(params, requires_grad):
+            param.requires_grad = value
+    return importance / importance.norm(dim=1, keepdim=True).clamp(min=1e-20)
+
+
+def heads_to_prune(importance: torch.Tensor,
+                   n_layers: int,
+                   fraction: float) -> Dict[str, List[int]]:
+    """ Selects the least important fraction of the heads of the bottom
+    n_layers layers, keeping at least one head in every layer """
+    n_heads = importance.shape[1]
+    n_to_prune = round(fraction * n_layers * n_heads)
+    order = importance[:n_layers].flatten().argsort().tolist()
+    pruned: Dict[str, List[int]] = {}
+    for flat_id in order:
+        if n_to_prune == 0:
+            break
+        layer_id, head = divmod(flat_id, n_heads)
+        layer_heads = pruned.setdefault(str(layer_id), [])
+        if len(layer_heads) < n_heads - 1:
+            layer_heads.append(head)
+            n_to_prune -= 1
+    return {layer_id: sorted(heads) for layer_id, heads in pruned.items()}
+
+
+def evaluate(model: CorefModel, docs: Sequence[Doc]) -> Dict[str, Any]:
+    """ Measures the latency of CorefModel.run and the scores on docs.
+    The first document is also run once before measuring. """
+    cuda = torch.device(model.config.device).type == "cuda"
+    model.training = False
+    w_checker, s_checker = ClusterChecker(), ClusterChecker()
+    seconds: List[float] = []
+    n_words = pronouns_correct = pronouns_total = 0
+    with torch.no_grad():
+        model.run(docs[0])
+        for doc in docs:
+            start = time.perf_counter()
+            res = model.run(doc)
+            if cuda:
+                torch.cuda.synchronize()
+            seconds.append(time.perf_counter() - start)
+            n_words += len(doc["cased_words"])
+
+            w_checker.add_predictions(doc["word_clusters"], res.word_clusters)
+            s_checker.add_predictions(doc["span_clusters"], res.span_clusters)
+            correct, total = pronoun_counts(doc, res.word_clusters)
+            pronouns_correct += correct
+            pronouns_total += total
+    return {
+        "latency_ms": latency_stats(seconds),
+        "words_per_s": n_words / sum(seconds),
+        "wl_f1": w_checker.total_lea[0],
+        "sl_f1": s_checker.total_lea[0],
+        "pronoun_score": (pronouns_correct / pronouns_total
+                          if pronouns_total else None),
+        "n_pronouns": pronouns_total,
+    }
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("experiment")
+    argparser.add_argument("--weights", required=True,
+                           help="The trained model to slim")
+    argparser.add_argument("--config-file", default="config.toml")
+    argparser.add_argument("--layers", type=int, nargs="+", default=[0],
+                           help="Numbers of bottom layers to keep,"
+                                " 0 keeps all")
+    argparser.add_argument("--prune-heads", type=float, nargs="+",
+                           default=[0.0],
+                           help="Shares of the attention heads of the kept"
+                                " layers to prune")
+    argparser.add_argument("--importance-docs", type=int, default=32,
+                           help="Training documents used to estimate the"
+                                " importance of the heads")
+    argparser.add_argument("--finetune-epochs", type=int, default=0,
+                           help="If greater than zero, every slimmed model"
+                                " is fine-tuned for this many epochs")
+    argparser.add_argument("--save", action="store_true",
+                           help="Save the slimmed models that are not"
+                                " fine-tuned (fine-tuned ones are saved by"
+                                " train())")
+    argparser.add_argument("--data-split", choices=("dev", "test"),
+                           default="dev")
+    argparser.add_argument("--device",
+                           help="Overrides the device of the config, e.g."
+                                " cpu to measure cpu latency")
+    argparser.add_argument("--out", default="slimming.json")
+    args = argparser.parse_args()
+
+    overrides = {"device": args.device} if args.device else {}
+
+    def load_model() -> CorefModel:
+        """ Returns the trained model, with the full encoder """
+        model = CorefModel(args.config_file, args.experiment,
+                           build_optimizers=False, config_overrides=overrides)
+        model.load_weights(args.weights, map_location=model.config.device,
+                           ignore=checkpoint.TRAINING_STATE_KEYS)
+        return model
+
+    full_model = load_model()
+    importance = head_importance(
+        full_model,
+        list(full_model._get_docs(  # pylint: disable=protected-access
+            full_model.config.train_data))[:args.importance_docs])
+    n_total_layers = len(full_model.bert.encoder.layer)
+    del full_model
+
+    results = []
+    for n_layers in args.layers:
+        n_layers = min(n_layers or n_total_layers, n_total_layers)
+        for fraction in args.prune_heads:
+            pruned_heads = heads_to_prune(importance, n_layers, fraction)
+            name = (f"{args.experiment}_L{n_layers}"
+                    f"_H{round(fraction * 100)}")
+            print(f"{name}: {n_layers} layers,"
+                  f" {sum(map(len, pruned_heads.values()))} heads pruned",
+                  flush=True)
+
+            model = load_model()
+            bert.slim_bert(model.bert, n_layers, pruned_heads)
+            model.config.bert_layers = n_layers
+            model.config.bert_pruned_heads = pruned_heads
+            model.config.model_name = name
+            os.makedirs(model._checkpoint_dir(),  # pylint: disable=protected-access
+                        exist_ok=True)
+            if args.finetune_epochs:
+                model.config.train_epochs = args.finetune_epochs
+                model.epochs_trained = 0
+                model._build_optimizers()  # pylint: disable=protected-access
+                model.train()
+            elif args.save:
+                print(f"Saved to {model.save_weights()}")
+
+            result = evaluate(
+                model,
+                model._get_docs(  # pylint: disable=protected-access
+                    getattr(model.config, f"{args.data_split}_data")))
+            result.update({
+                "name": name,
+                "bert_layers": n_layers,
+                "bert_pruned_heads": pruned_heads,
+                "pruned_fraction": fraction,
+                "bert_params_m": sum(param.numel() for param
+                                     in model.bert.parameters()) / 1e6,
+                "finetune_epochs": args.finetune_epochs,
+            })
+            results.append(result)
+            del model
+
+    print(f"\n{'setting':>24} {'params (M)':>10} {'latency (ms)':>12}"
+          f" {'wl_f1':>7} {'sl_f1':>7} {'pronouns':>8}")
+    for result in results:
+        pronoun_score = result["pronoun_score"]
+        print(f"{result['name']:>24} {result['bert_params_m']:>10.1f}"
+              f" {result['latency_ms']['mean']:>12.1f}"
+              f" {result['wl_f1']:>7.4f} {result['sl_f1']:>7.4f}"
+              f" {'-' if pronoun_score is None else f'{pronoun_score:.4f}':>8}")
+    with open(args.out, mode="w", encoding="utf8") as f:
+        json.dump({"weights": args.weights, "data_split": args.data_split,
+                   "importance": importance.tolist(), "results": results},
+                  f, indent=2)
+    print(f"Results written to {args.out}. A config section for a setting"
+          f" sets its bert_layers and bert_pruned_heads.")
@@ -0,0 +1,53 @@
+""" Fixtures shared by the regression tests: a working directory with a tiny
+randomly initialized encoder, synthetic data splits and a config file (see
+bench/tiny_model.py), and a factory of CorefModels built on it. """
+
+import os
+import random
+from typing import Any, Callable, Dict, Optional
+
+import pytest
+import torch
+
+from bench import synthetic, tiny_model
+from coref import CorefModel
+
+
+ModelFactory = Callable[..., CorefModel]
+
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory) -> str:
+    """ Returns the directory of the tiny encoder, data and config """
+    path = str(tmp_path_factory.mktemp("coref"))
+    templates = synthetic.FALLBACK_TEMPLATES
+    bert_model = os.path.join(path, "tiny_bert")
+    tiny_model.build_tiny_bert(bert_model, synthetic.vocabulary(templates),
+                               hidden_size=32, n_layers=2)
+    for name, n_docs in (("bench_train", 4), ("bench_dev", 2),
+                         ("bench_test", 2)):
+        docs = synthetic.generate_docs(n_docs, 60, seed=len(name),
+                                       templates=templates)
+        tiny_model.write_split(path, name, docs)
+    tiny_model.write_config(path, bert_model, "cpu",
+                            overrides={"bert_window_size": 32,
+                                       "train_epochs": 2})
+    return path
+
+
+@pytest.fixture
+def make_model(workdir, monkeypatch) -> ModelFactory:
+    """ Returns a function creating models with the config of workdir and
+    the overrides given, seeding the random number generators first """
+    # Tokenized documents are cached in the working directory
+    monkeypatch.chdir(workdir)
+
+    def make(overrides: Optional[Dict[str, Any]] = None,
+             build_optimizers: bool = True) -> CorefModel:
+        random.seed(0)
+        torch.manual_seed(0)
+        return CorefModel(os.path.join(workdir, "config.toml"),
+                          tiny_model.SECTION,
+                          build_optimizers=build_optimizers,
+                          config_overrides=overrides)
+    return make
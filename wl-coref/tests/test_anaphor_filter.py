@@ -0,0 +1,25 @@
+""" Tests the part of speech candidates of the anaphor pre-filter """
+
+from coref.anaphor_filter import pos_candidates
+
+
+TAGS = ["N", "SPEC", "VNW", "LID", "TW", "NOUN", "PRON"]
+
+
+def test_coarse_part_of_cgn_postags():
+    doc = {"postag": ["SPEC|deeleigen", "WW|pv|tgw|ev",
+                      "VNW|pers|pron|nomin|vol|3|ev|masc",
+                      "N|soort|ev|basis|zijd|stan", "LET", "X"]}
+    assert pos_candidates(doc, TAGS).tolist() == [0, 2, 3, 5]
+
+
+def test_universal_pos_is_preferred():
+    doc = {"pos": ["PROPN", "VERB", "PRON"],
+           "postag": ["SPEC|deeleigen", "WW|pv|tgw|ev",
+                      "VNW|pers|pron|nomin|vol|3|ev|masc"]}
+    assert pos_candidates(doc, TAGS).tolist() == [2]
+
+
+def test_documents_without_annotation():
+    assert pos_candidates({"postag": ["X", "X"]}, TAGS) is None
+    assert pos_candidates({}, TAGS) is None
@@ -0,0 +1,110 @@
+""" Tests saving and loading of CorefModel checkpoints """
+
+import argparse
+import os
+
+import pytest
+import torch
+
+import delta_checkpoints
+from coref import checkpoint, delta
+
+
+def _saved_model(make_model, overrides):
+    """ Returns a model whose weights differ from those of a new one, and
+    the path of its checkpoint """
+    model = make_model(overrides)
+    with torch.no_grad():
+        for param in model.we.parameters():
+            param.add_(1.0)
+    os.makedirs(model._checkpoint_dir(), exist_ok=True)
+    return model, model.save_weights()
+
+
+def _assert_same_weights(model, other):
+    for name, module in model.trainable.items():
+        other_state = other.trainable[name].state_dict()
+        for key, value in module.state_dict().items():
+            assert torch.equal(value, other_state[key]), f"{name}.{key}"
+
+
+def test_sparse_model_loads_without_optimizers(make_model):
+    overrides = {"model_name": "sparse", "bert_embedding_updates": "sparse"}
+    model, path = _saved_model(make_model, overrides)
+    inference_model = make_model(overrides, build_optimizers=False)
+    inference_model.load_weights(path)
+    assert not inference_model.optimizers
+    _assert_same_weights(model, inference_model)
+
+
+def test_delta_checkpoint_loads_as_full(make_model, tmp_path):
+    base_path = os.path.join(tmp_path, f"base{checkpoint.SUFFIX}")
+    base_model = make_model(build_optimizers=False)
+    checkpoint.save_tensors(
+        base_path, checkpoint.flatten({"bert": base_model.bert.state_dict()}),
+        {})
+    overrides = {"model_name": "delta", "checkpoint_format": "safetensors",
+                 "checkpoint_base": base_path}
+    model, path = _saved_model(make_model, overrides)
+    assert path.endswith(checkpoint.DELTA_SUFFIX)
+
+    loaded = make_model(overrides, build_optimizers=False)
+    loaded.load_weights(path)
+    _assert_same_weights(model, loaded)
+
+
+def test_compress_keeps_checkpoints_with_training_state(make_model, tmp_path):
+    base_path = os.path.join(tmp_path, f"base{checkpoint.SUFFIX}")
+    checkpoint.save_tensors(base_path, {}, {})
+    _, torch_path = _saved_model(make_model, {"model_name": "compress"})
+    model, latest_path = _saved_model(
+        make_model, {"model_name": "compress",
+                     "checkpoint_format": "safetensors",
+                     "async_checkpoints": False})
+    released_path = os.path.join(tmp_path, f"released{checkpoint.SUFFIX}")
+    checkpoint.save_tensors(
+        released_path,
+        checkpoint.flatten({key: module.state_dict()
+                            for key, module in model.trainable.items()}),
+        {})
+    assert checkpoint.holds_training_state(torch_path)
+    assert checkpoint.holds_training_state(latest_path)
+    assert not checkpoint.holds_training_state(released_path)
+
+    for path in (torch_path, latest_path):
+        args = argparse.Namespace(base=base_path, checkpoints=[path],
+                                  remove=True)
+        with pytest.raises(ValueError):
+            delta_checkpoints.compress(args)
+        assert os.path.exists(path)
+
+    args = argparse.Namespace(base=base_path, checkpoints=[released_path],
+                              remove=True)
+    delta_checkpoints.compress(args)
+    assert not os.path.exists(released_path)
+    restored, _ = delta.load_delta(
+        f"{os.path.splitext(released_path)[0]}{checkpoint.DELTA_SUFFIX}")
+    assert restored.keys() == checkpoint.read_weights(latest_path)[0].keys()
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires cuda")
+def test_safetensors_saves_from_cuda(make_model):
+    overrides = {"model_name": "cuda", "device": "cuda:0",
+                 "checkpoint_format": "safetensors",
+                 "async_checkpoints": False}
+    model, path = _saved_model(make_model, overrides)
+    loaded = make_model(overrides, build_optimizers=False)
+    loaded.load_weights(path)
+    _assert_same_weights(model, loaded)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires cuda")
+def test_delta_saves_from_cuda(tmp_path):
+    base_path = os.path.join(tmp_path, f"base{checkpoint.SUFFIX}")
+    tensors = {"weight": torch.randn(4, 3)}
+    checkpoint.save_tensors(base_path, tensors, {})
+    path = os.path.join(tmp_path, f"delta{checkpoint.DELTA_SUFFIX}")
+    delta.save_delta(path, {"weight": tensors["weight"].cuda() + 1},
+                     base_path)
+    restored, _ = delta.load_delta(path)
+    assert torch.equal(restored["weight"], tensors["weight"] + 1)
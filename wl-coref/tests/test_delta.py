@@ -0,0 +1,48 @@
+""" Tests the delta checkpoint format of coref/delta.py """
+
+import os
+
+import torch
+
+from coref import checkpoint, delta
+
+
+def test_delta_round_trip(tmp_path):
+    torch.manual_seed(0)
+    base = {"same": torch.randn(4, 8),
+            "changed": torch.randn(100),
+            "half": torch.randn(3, 5).half(),
+            "ids": torch.arange(10),
+            "reshaped": torch.randn(6)}
+    tensors = {"same": base["same"].clone(),
+               "changed": base["changed"] + torch.randn(100) * 1e-4,
+               "half": base["half"] * 2,
+               "ids": base["ids"] + 1,
+               "reshaped": torch.randn(2, 3),
+               "new": torch.randn(5, 2)}
+    base_path = os.path.join(tmp_path, f"base{checkpoint.SUFFIX}")
+    delta_path = os.path.join(tmp_path, f"model{checkpoint.DELTA_SUFFIX}")
+    checkpoint.save_tensors(base_path, base, {})
+    delta.save_delta(delta_path, tensors, base_path, {"epochs_trained": "3"})
+
+    restored, metadata = delta.load_delta(delta_path)
+    assert metadata["epochs_trained"] == "3"
+    assert restored.keys() == tensors.keys()
+    for key, tensor in tensors.items():
+        assert restored[key].dtype == tensor.dtype, key
+        assert torch.equal(restored[key], tensor), key
+
+
+def test_delta_finds_moved_base(tmp_path):
+    base_path = os.path.join(tmp_path, f"base{checkpoint.SUFFIX}")
+    delta_path = os.path.join(tmp_path, f"model{checkpoint.DELTA_SUFFIX}")
+    checkpoint.save_tensors(base_path, {"weight": torch.zeros(3)}, {})
+    delta.save_delta(delta_path, {"weight": torch.ones(3)}, base_path)
+
+    moved_dir = os.path.join(tmp_path, "moved")
+    os.makedirs(moved_dir)
+    for path in (base_path, delta_path):
+        os.replace(path, os.path.join(moved_dir, os.path.basename(path)))
+    restored, _ = delta.load_delta(
+        os.path.join(moved_dir, os.path.basename(delta_path)))
+    assert torch.equal(restored["weight"], torch.ones(3))
@@ -0,0 +1,109 @@
+""" Tests the optimizers of coref/optim.py """
+
+import io
+
+import pytest
+import torch
+
+from coref.optim import (MIN_QUANTIZED_SIZE, Adam8bit, FactoredAdam,
+                         SparseRowAdam)
+
+
+def _embedding_steps(optimizer_class, n_steps=5):
+    """ Trains an embedding matrix with sparse gradients of random lookups,
+    returns the weights after every step """
+    torch.manual_seed(0)
+    embedding = torch.nn.Embedding(50, 8, sparse=True)
+    optimizer = optimizer_class(embedding.parameters(), lr=0.1)
+    lookups = torch.Generator().manual_seed(1)
+    weights = []
+    for _ in range(n_steps):
+        ids = torch.randint(0, 50, (6,), generator=lookups)
+        optimizer.zero_grad()
+        embedding(ids).pow(2).sum().backward()
+        optimizer.step()
+        weights.append(embedding.weight.detach().clone())
+    return weights
+
+
+def test_sparse_row_adam_matches_sparse_adam():
+    expected = _embedding_steps(torch.optim.SparseAdam)
+    for weights, expected_weights in zip(_embedding_steps(SparseRowAdam),
+                                         expected):
+        assert torch.allclose(weights, expected_weights, atol=1e-6)
+
+
+def test_sparse_row_adam_keeps_state_of_seen_rows_only():
+    embedding = torch.nn.Embedding(50, 8, sparse=True)
+    optimizer = SparseRowAdam(embedding.parameters())
+    embedding(torch.tensor([3, 7, 3])).sum().backward()
+    optimizer.step()
+
+    state = optimizer.state[embedding.weight]
+    assert state["n_slots"] == 2
+    assert sorted(state["slots"][[3, 7]].tolist()) == [0, 1]
+    assert int((state["slots"] >= 0).sum()) == 2
+
+
+def _round_trip(state_dict):
+    """ Returns the state dict as saved and loaded by torch """
+    buffer = io.BytesIO()
+    torch.save(state_dict, buffer)
+    buffer.seek(0)
+    return torch.load(buffer)
+
+
+def _params():
+    """ Returns a matrix large enough to have its state compressed and a
+    vector keeping the Adam state """
+    torch.manual_seed(0)
+    return [torch.nn.Parameter(torch.randn(64, MIN_QUANTIZED_SIZE // 32)),
+            torch.nn.Parameter(torch.randn(16))]
+
+
+def _step(optimizer, params, generator):
+    """ Steps with random gradients, zero for half of the matrix rows """
+    for param in params:
+        param.grad = torch.randn(param.shape, generator=generator)
+        if param.dim() == 2:
+            param.grad[torch.rand(len(param), generator=generator) < 0.5] = 0
+    optimizer.step()
+
+
+@pytest.mark.parametrize("optimizer_class",
+                         [Adam8bit, FactoredAdam, SparseRowAdam])
+def test_optimizer_state_round_trip(optimizer_class):
+    # SparseRowAdam is meant for embedding matrices only
+    params = _params()[:1] if optimizer_class is SparseRowAdam else _params()
+    optimizer = optimizer_class(params, lr=0.01)
+    grads = torch.Generator().manual_seed(1)
+    for _ in range(3):
+        _step(optimizer, params, grads)
+
+    loaded_params = [torch.nn.Parameter(param.detach().clone())
+                     for param in params]
+    loaded = optimizer_class(loaded_params, lr=0.01)
+    loaded.load_state_dict(_round_trip(optimizer.state_dict()))
+    for param, loaded_param in zip(params, loaded_params):
+        for key, value in optimizer.state[param].items():
+            loaded_value = loaded.state[loaded_param][key]
+            if torch.is_tensor(value):
+                assert loaded_value.dtype == value.dtype, key
+                assert torch.equal(loaded_value, value), key
+            else:
+                assert loaded_value == value, key
+
+    state = grads.get_state()
+    _step(optimizer, params, grads)
+    grads.set_state(state)
+    _step(loaded, loaded_params, grads)
+    for param, loaded_param in zip(params, loaded_params):
+        assert torch.equal(param, loaded_param)
+
+
+def test_lean_adam_refuses_adam_state():
+    params = _params()
+    adam = torch.optim.Adam(params)
+    _step(adam, params, torch.Generator().manual_seed(1))
+    with pytest.raises(ValueError):
+        Adam8bit(params).load_state_dict(adam.state_dict())
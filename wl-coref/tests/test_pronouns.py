@@ -0,0 +1,46 @@
+""" Tests the third person pronoun rule shared with full_evaluation.py """
+
+import pytest
+
+from coref.approx_eval import pronoun_counts
+from coref.pronouns import SETTINGS, third_person_pronoun, third_person_pronouns
+
+
+@pytest.mark.parametrize("word, postag, expected", [
+    ("hij", "VNW|pers|pron|nomin|vol|3|ev|masc", True),
+    ("zij", "VNW|pers|pron|nomin|vol|3v|ev|fem", True),
+    ("hen", "VNW|pers|pron|obl|vol|3p|ev", True),
+    ("het", "VNW|pers|pron|stan|red|3|ev|onz", False),
+    ("men", "VNW|pers|pron|nomin|red|3p|ev|masc", False),
+    ("ik", "VNW|pers|pron|nomin|vol|1|ev", False),
+    ("zij", "VNW|pers|pron|nomin|vol|3p|mv", False),
+    ("die", "VNW|aanw|pron|stan|vol|3o|ev", False),
+    ("die", "VNW|betr|pron|stan|vol|persoon|getal", False),
+    ("wie", "VNW|vb|pron|stan|vol|3p|getal", False),
+    ("iemand", "VNW|onbep|pron|stan|vol|3p|ev", False),
+    ("X", "X", False),
+])
+def test_third_person_pronoun(word, postag, expected):
+    assert third_person_pronoun(word, postag, SETTINGS["all"]) is expected
+
+
+def test_third_person_pronouns_use_postags():
+    doc = {
+        "cased_words": ["Sam", "zei", "dat", "hij", "het", "zag", "."],
+        "pos": ["PROPN", "VERB", "SCONJ", "PRON", "PRON", "VERB", "PUNCT"],
+        "postag": ["SPEC|deeleigen", "WW|pv|verl|ev", "VG|onder",
+                   "VNW|pers|pron|nomin|vol|3|ev|masc",
+                   "VNW|pers|pron|stan|red|3|ev|onz", "WW|pv|verl|ev",
+                   "LET"],
+        "word_clusters": [[0, 3]],
+    }
+    assert third_person_pronouns(doc) == [3]
+    assert third_person_pronouns(doc, "fem") == []
+    assert pronoun_counts(doc, [[0, 3]]) == (1, 1)
+    assert pronoun_counts(doc, [[3, 4]]) == (0, 1)
+
+
+def test_third_person_pronouns_without_postags():
+    doc = {"cased_words": ["Sam", "zag", "hen", "."],
+           "postag": ["X", "X", "X", "X"]}
+    assert third_person_pronouns(doc) == [2]
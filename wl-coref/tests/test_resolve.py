@@ -0,0 +1,47 @@
+""" Tests that CorefModel.resolve follows the antecedents of CorefModel.run """
+
+import pytest
+import torch
+
+
+@pytest.fixture
+def model(make_model):
+    model = make_model(build_optimizers=False)
+    # Random weights score every antecedent alike, the bias of the output
+    # is raised to link some of the words
+    with torch.no_grad():
+        model.a_scorer.out.bias.add_(1.0)
+    model.training = False
+    return model
+
+
+def test_resolve_follows_run_antecedents(model):
+    n_chains = 0
+    with torch.no_grad():
+        for doc in model._get_docs(model.config.dev_data):
+            res = model.run(doc)
+            antecedents = model.antecedents(res.coref_scores,
+                                            res.top_indices).tolist()
+            assert any(antecedent >= 0 for antecedent in antecedents)
+            assert any(antecedent < 0 for antecedent in antecedents)
+
+            run_spans = {word: span
+                         for cluster, spans in zip(res.word_clusters,
+                                                   res.span_clusters)
+                         for word, span in zip(cluster, spans)}
+
+            queries = list(range(0, len(antecedents), 3))
+            result = model.resolve(doc, queries, predict_spans=True)
+            assert sorted(result.chains) == queries
+            for query, chain in result.chains.items():
+                expected = []
+                antecedent = antecedents[query]
+                while antecedent >= 0:
+                    expected.append(antecedent)
+                    antecedent = antecedents[antecedent]
+                assert chain == expected
+                if chain:
+                    n_chains += 1
+                    assert result.spans[query] == [
+                        run_spans[word] for word in (query, *chain)]
+    assert n_chains
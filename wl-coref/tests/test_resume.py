@@ -0,0 +1,83 @@
+""" Tests that training resumed from a mid-epoch checkpoint ends the way an
+uninterrupted run does """
+
+import os
+
+import pytest
+import torch
+
+
+RESUMABLE = {"checkpoint_format": "safetensors", "resume_every": 2}
+
+
+class Crash(Exception):
+    """ Stands for the training process being killed """
+
+
+def _train(make_model, overrides, crash_at=None, resume_at=None):
+    model = make_model({**RESUMABLE, **overrides})
+    os.makedirs(model._checkpoint_dir(), exist_ok=True)
+    if resume_at is not None:
+        assert model.resume()
+        assert model._resume_point["position"] == resume_at
+    if crash_at is not None:
+        train_step, n_steps = model.train_step, [0]
+
+        def crashing_step(*args, **kwargs):
+            n_steps[0] += 1
+            if n_steps[0] == crash_at:
+                raise Crash
+            return train_step(*args, **kwargs)
+        model.train_step = crashing_step
+        with pytest.raises(Crash):
+            model.train()
+        if model._writer is not None:
+            model._writer.wait()
+    else:
+        model.train()
+    return model
+
+
+@pytest.mark.parametrize("overrides", [
+    {"async_checkpoints": True},
+    {"async_checkpoints": False},
+    pytest.param({"async_checkpoints": False, "device": "cuda:0"},
+                 marks=pytest.mark.skipif(not torch.cuda.is_available(),
+                                          reason="requires cuda")),
+])
+def test_resume_matches_uninterrupted_training(make_model, overrides):
+    # Each case writes checkpoints of its own
+    suffix = "_".join(str(value) for value in overrides.values())
+    full = _train(make_model,
+                  {**overrides, "model_name": f"uninterrupted_{suffix}"})
+    # Four training documents per epoch, crashing at the third of epoch 2
+    resumed_overrides = {**overrides, "model_name": f"resumed_{suffix}"}
+    _train(make_model, resumed_overrides, crash_at=7)
+    resumed = _train(make_model, resumed_overrides, resume_at=2)
+
+    assert resumed.train_logs["training"] == full.train_logs["training"]
+    assert ([entry["sl_f1"] for entry in resumed.train_logs["dev_eval"]]
+            == [entry["sl_f1"] for entry in full.train_logs["dev_eval"]])
+    for name, module in full.trainable.items():
+        resumed_state = resumed.trainable[name].state_dict()
+        for key, value in module.state_dict().items():
+            assert torch.equal(value, resumed_state[key]), f"{name}.{key}"
+
+
+@pytest.mark.parametrize("async_dev_eval", [False, True])
+def test_resume_restores_dev_evaluations(make_model, async_dev_eval):
+    overrides = {"async_dev_eval": async_dev_eval, "dev_eval_fraction": 0.5}
+    suffix = f"dev_eval_{async_dev_eval}"
+    full = _train(make_model,
+                  {**overrides, "model_name": f"uninterrupted_{suffix}"})
+    # Crashing at the first document of epoch 2, resuming from the
+    # checkpoint of epoch 1, the evaluation of which epoch 2 is compared to
+    resumed_overrides = {**overrides, "model_name": f"resumed_{suffix}"}
+    _train(make_model, resumed_overrides, crash_at=5)
+    resumed = _train(make_model, resumed_overrides, resume_at=0)
+
+    keys = ("epoch", "sl_f1", "estimate")
+    assert ([{key: entry.get(key) for key in keys}
+             for entry in resumed.train_logs["dev_eval"]]
+            == [{key: entry.get(key) for key in keys}
+                for entry in full.train_logs["dev_eval"]])
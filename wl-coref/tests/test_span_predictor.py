@@ -0,0 +1,114 @@
+""" Tests that the sentence-local scores of SpanPredictor are those of
+scoring every word of the document against every head """
+
+import pytest
+import torch
+
+
+def _document_scores(sp, doc_tensors, words, heads_ids):
+    """ Scores the words of the document for every head as SpanPredictor
+    did before scoring sentence-locally: [n_heads, n_words, 2], -inf
+    outside of the head's sentence """
+    relative_positions = (heads_ids.unsqueeze(1)
+                          - torch.arange(words.shape[0]).unsqueeze(0))
+    emb_ids = relative_positions + 63
+    emb_ids[(emb_ids < 0) + (emb_ids > 126)] = 127
+
+    sent_id = doc_tensors.sent_ids
+    same_sent = (sent_id[heads_ids].unsqueeze(1) == sent_id.unsqueeze(0))
+    rows, cols = same_sent.nonzero(as_tuple=True)
+    pair_matrix = torch.cat((words[heads_ids[rows]], words[cols],
+                             sp.emb(emb_ids[rows, cols])), dim=1)
+
+    lengths = same_sent.sum(dim=1)
+    padding_mask = torch.arange(0, lengths.max()).unsqueeze(0) \
+        < lengths.unsqueeze(1)
+    padded_pairs = torch.zeros(*padding_mask.shape, pair_matrix.shape[-1])
+    padded_pairs[padding_mask] = pair_matrix
+
+    res = sp.ffnn(padded_pairs)
+    res = sp.conv(res.permute(0, 2, 1)).permute(0, 2, 1)
+    scores = torch.full((len(heads_ids), words.shape[0], 2), float("-inf"))
+    scores[rows, cols] = res[padding_mask]
+    if not sp.training:
+        valid_starts = torch.log((relative_positions >= 0).to(torch.float))
+        valid_ends = torch.log((relative_positions <= 0).to(torch.float))
+        scores = scores + torch.stack((valid_starts, valid_ends), dim=2)
+    return scores
+
+
+@pytest.mark.parametrize("training", [False, True])
+def test_sentence_local_scores_match_document_scores(make_model, training):
+    model = make_model(build_optimizers=False)
+    model.training = training
+    # Dropout would make the two computations differ
+    for module in model.sp.modules():
+        if isinstance(module, torch.nn.Dropout):
+            module.p = 0.0
+
+    n_heads = 0
+    with torch.no_grad():
+        for doc in model._get_docs(model.config.dev_data):
+            doc_tensors = doc["tensors"]
+            words, _ = model.we(doc_tensors, model._bertify(doc))
+            heads_ids = torch.arange(len(words))
+            expected = _document_scores(model.sp, doc_tensors, words,
+                                        heads_ids)
+
+            scores = model.sp(doc_tensors, words, heads_ids)
+            starts = model.sp.sentence_starts(doc_tensors, heads_ids)
+            for head, (head_scores, start) in enumerate(zip(scores, starts)):
+                n_words = int(doc_tensors.sent_bounds[head, 1] - start)
+                expected_scores = expected[head, start:start + n_words]
+                assert torch.isinf(head_scores[n_words:]).all()
+                assert torch.equal(torch.isinf(head_scores[:n_words]),
+                                   torch.isinf(expected_scores))
+                finite = torch.isfinite(expected_scores)
+                assert torch.allclose(head_scores[:n_words][finite],
+                                      expected_scores[finite], atol=1e-5)
+                assert torch.isinf(torch.cat((
+                    expected[head, :start],
+                    expected[head, start + n_words:]))).all()
+            n_heads += len(heads_ids)
+
+            if not training:
+                clusters = [[head] for head in heads_ids.tolist()]
+                expected_spans = [
+                    [(start, end + 1)] for start, end in zip(
+                        expected[:, :, 0].argmax(dim=1).tolist(),
+                        expected[:, :, 1].argmax(dim=1).tolist())]
+                assert model.sp.predict(doc_tensors, words, clusters) \
+                    == expected_spans
+    assert n_heads
+
+
+def test_training_targets_are_sentence_local(make_model):
+    model = make_model(build_optimizers=False)
+    with torch.no_grad():
+        for doc in model._get_docs(model.config.dev_data):
+            doc_tensors = doc["tensors"]
+            words, _ = model.we(doc_tensors, model._bertify(doc))
+            scores, (starts, ends) = model.sp.get_training_data(doc_tensors,
+                                                                words)
+            heads = doc_tensors.head2span[:, 0]
+            offsets = model.sp.sentence_starts(doc_tensors, heads)
+            assert torch.equal(starts + offsets, doc_tensors.head2span[:, 1])
+            assert torch.equal(ends + offsets + 1,
+                               doc_tensors.head2span[:, 2])
+            assert (ends < scores.shape[1]).all()
+
+
+def test_padding_dropout_masks_differ(make_model):
+    model = make_model(build_optimizers=False)
+    model.training = True
+    outputs = []
+    model.sp.ffnn.register_forward_hook(
+        lambda module, inputs, output: outputs.append(output))
+    with torch.no_grad():
+        doc = model._get_docs(model.config.dev_data)[0]
+        words, _ = model.we(doc["tensors"], model._bertify(doc))
+        model.sp(doc["tensors"], words, torch.arange(len(words)))
+    # The FFNN is only called as a whole on the zeros of the padding
+    padding, = outputs
+    assert len(padding) > 1
+    assert not (padding == padding[0]).all()
@@ -0,0 +1,96 @@
+""" Trims the subword vocabulary of the encoder to the subwords that occur
+in the data, see coref/vocab_trim.py.
+
+Writes a directory with the trimmed encoder and its tokenizer, to be used
+as bert_model of a config section, and trims the encoder embeddings of
+the given checkpoints to match. Subwords that were not kept are mapped to
+the unknown token, outputs for the rest of the text are unchanged.
+
+  Usage example:
+
+  python trim_vocab.py xlm-roberta data/xlm-roberta-nl \\
+      --extra data/production.jsonlines \\
+      --weights data/model_checkpoints/regular/xlm-roberta_e20.pt
+
+  # then, in config.toml
+  [xlm-roberta-nl]
+  bert_model = "data/xlm-roberta-nl"
+"""
+
+import argparse
+import os
+import time
+
+from coref import CorefModel, bert, checkpoint, vocab_trim
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("experiment",
+                           help="Config section of the untrimmed model")
+    argparser.add_argument("out", help="Directory of the trimmed model")
+    argparser.add_argument("--config-file", default="config.toml")
+    argparser.add_argument("--splits", nargs="*",
+                           default=["train", "dev", "test"],
+                           choices=("train", "dev", "test"),
+                           help="Data splits of the config whose subwords"
+                                " to keep")
+    argparser.add_argument("--extra", nargs="*", default=[],
+                           help="Other jsonlines files whose subwords to"
+                                " keep, e.g. samples of production text")
+    argparser.add_argument("--min-count", type=int, default=1,
+                           help="Only keep subwords occurring this many"
+                                " times")
+    argparser.add_argument("--weights", nargs="*", default=[],
+                           help="Checkpoints of the untrimmed model to trim,"
+                                " written as {input}_trimmed.safetensors")
+    args = argparser.parse_args()
+
+    model = CorefModel(args.config_file, args.experiment,
+                       build_optimizers=False)
+    counts = vocab_trim.count_subword_ids(
+        doc
+        for split in args.splits
+        for doc in model._get_docs(  # pylint: disable=protected-access
+            getattr(model.config, f"{split}_data")))
+    for path in args.extra:
+        counts.update(vocab_trim.count_subword_ids(
+            model._tokenize_docs(path)))  # pylint: disable=protected-access
+    kept_ids = vocab_trim.select_ids(counts, model.tokenizer, args.min_count)
+
+    embeddings = model.bert.get_input_embeddings().weight
+    size_before = embeddings.numel() * embeddings.element_size() / 2 ** 20
+    vocab_trim.trim_embeddings(model.bert, kept_ids)
+    embeddings = model.bert.get_input_embeddings().weight
+    size_after = embeddings.numel() * embeddings.element_size() / 2 ** 20
+    n_dropped = sum(count for subword_id, count in counts.items()
+                    if count < args.min_count)
+    print(f"Kept {len(kept_ids)} of {len(model.tokenizer)} subwords,"
+          f" {n_dropped} of {sum(counts.values())} subwords of the data"
+          f" become unknown")
+    print(f"Embedding matrix: {size_before:.1f} MB -> {size_after:.1f} MB")
+
+    os.makedirs(args.out, exist_ok=True)
+    model.bert.save_pretrained(args.out)
+    model.tokenizer.save_pretrained(args.out)
+    vocab_trim.save_kept_ids(args.out, kept_ids,
+                             bert.tokenizer_name(model.config))
+    print(f"Trimmed model written to {args.out}")
+
+    model.config.bert_model = args.out
+    identity = bert.tokenizer_identity(bert.load_tokenizer(model.config))
+    embedding_name = next(
+        f"bert.{name}" for name, parameter in model.bert.named_parameters()
+        if parameter is embeddings)
+    for path in args.weights:
+        start = time.perf_counter()
+        tensors, metadata = checkpoint.read_weights(path)
+        tensors = vocab_trim.trim_weights(tensors, embedding_name, kept_ids)
+        metadata = {key: value for key, value in metadata.items()
+                    if key not in ("base", "base_fingerprint")}
+        metadata.update(bert_model=args.out, **identity)
+        out_path = f"{os.path.splitext(path)[0]}_trimmed{checkpoint.SUFFIX}"
+        checkpoint.save_tensors(out_path, tensors, metadata)
+        print(f"{path}: {os.path.getsize(path) / 2 ** 20:.1f} MB ->"
+              f" {os.path.getsize(out_path) / 2 ** 20:.1f} MB"
+              f" ({time.perf_counter() - start:.1f} s)")